@@ -0,0 +1,73 @@
+#coding=utf-8
+
+"""baselines of the bench suite: json files under bench/baselines
+
+A baseline maps result names to numbers. compare() puts a new run next
+to a saved one so a regression shows up as a ratio, not as a feeling.
+"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+__all__ = ['BASELINE_DIR', 'get_baseline_file', 'load', 'save', 'compare']
+
+import os
+import json
+import time
+import socket
+import platform
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+BASELINE_DIR = os.path.join(ROOT, 'baselines')
+
+
+def get_baseline_file(name):
+    return os.path.join(BASELINE_DIR, '%s.json' % name)
+
+
+def load(name):
+    """results of baseline name, None if it was never saved"""
+    fname = get_baseline_file(name)
+    if not os.path.exists(fname):
+        return None
+    with open(fname) as f:
+        return json.load(f)['results']
+
+
+def save(name, results, params=None):
+    """save results with the machine they come from"""
+    if not os.path.isdir(BASELINE_DIR):
+        os.makedirs(BASELINE_DIR)
+    baseline = {
+        'name' : name,
+        'time' : time.strftime('%Y-%m-%d %H:%M:%S'),
+        'host' : socket.gethostname(),
+        'python' : platform.python_version(),
+        'machine' : platform.machine(),
+        'params' : params or {},
+        'results' : results,
+    }
+    with open(get_baseline_file(name), 'w') as f:
+        json.dump(baseline, f, indent=4, sort_keys=True)
+
+
+def compare(results, baseline, higher=(), tolerance=0.1):
+    """print results next to baseline, return names worse by more than tolerance
+
+    Lower is better, except for the names in higher, eg. throughput.
+    """
+    regressions = []
+    print '%-32s %14s %14s %8s' % ('name', 'baseline', 'current', 'ratio')
+    for name in sorted(results):
+        current = results[name]
+        old = baseline.get(name) if baseline else None
+        if not old:
+            print '%-32s %14s %14.3f' % (name, '-', current)
+            continue
+        ratio = current / float(old)
+        worse = ratio < 1 - tolerance if name in higher else ratio > 1 + tolerance
+        if worse:
+            regressions.append(name)
+        print '%-32s %14.3f %14.3f %7.2fx%s' % (name, old, current, ratio,
+            ' !' if worse else '')
+    return regressions
@@ -0,0 +1,186 @@
+#!/usr/bin/env python2.7
+#coding=utf-8
+
+"""boot storm benchmark: boxes of a venue connecting at once
+
+N boxes connect to route together and every one sends the same init
+requests, like boxes coming back with the power. The storm runs with
+[coalesce] off and on, and reports the requests the business module
+had to handle and how long the boxes waited, compared with
+bench/baselines/bootstorm.json.
+
+eg.
+    bench/bootstorm.py                    # 1000 boxes, 10000 and 10001
+    bench/bootstorm.py -b 5000 --delay 50
+    bench/bootstorm.py -s                 # save as the baseline
+"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream, StreamClosedError
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TOP = os.path.abspath(os.path.join(ROOT, '..'))
+sys.path.append(os.path.join(ROOT, '../generic'))
+import baseline
+from e2e import HOST, start, stop, admin, wait
+from framing import CLIENT_HEADER
+from metrics import Histogram
+
+BOX_PORT = 58849
+
+# the same body from every box, eg. the venue id
+BODY = '{"venue" : 520}'
+
+# results where higher is better
+HIGHER = ()
+
+
+@gen.coroutine
+def boot(device, codes, latency, errors):
+    """connect, send every init request at once, wait for the replies"""
+    stream = IOStream(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+    start_time = time.time()
+    try:
+        yield stream.connect((HOST, BOX_PORT))
+        for verify, request in enumerate(codes):
+            stream.write(CLIENT_HEADER.pack(17, 100, request, verify, len(BODY),
+                device) + BODY)
+        for i in xrange(len(codes)):
+            header = CLIENT_HEADER.unpack((yield stream.read_bytes(CLIENT_HEADER.size)))
+            yield stream.read_bytes(header[4])
+        latency.record(time.time() - start_time)
+    except StreamClosedError:
+        errors.append(device)
+    finally:
+        stream.close()
+
+
+@gen.coroutine
+def storm(boxes, codes, latency, errors):
+    yield [boot(device, codes, latency, errors) for device in xrange(1, boxes + 1)]
+
+
+def write_config(tmp, codes, coalesce):
+    """route.ini with codes coalesced or not"""
+    with open(os.path.join(TOP, 'route.ini')) as f:
+        text = f.read()
+    if coalesce:
+        text = text.replace('[coalesce]\n', '[coalesce]\n' +
+            ''.join('%d = yes\n' % request for request in codes), 1)
+    ini_file = os.path.join(tmp, 'route-%s.ini' % ('on' if coalesce else 'off'))
+    with open(ini_file, 'w') as f:
+        f.write(text)
+    return ini_file
+
+
+def get_handled(function):
+    metrics = admin('metrics')['function'].get(function, {})
+    return metrics.get('forwarded', 0), metrics.get('coalesced', 0)
+
+
+def run_storm(name, coalesce, opts, tmp):
+    codes = [int(request) for request in opts.codes.split(',')]
+    procs = []
+    try:
+        route = start(['route/route.py', '-i', HOST, '-c',
+            write_config(tmp, codes, coalesce), '-l', os.path.join(tmp, 'route.log')],
+            os.path.join(tmp, 'route-%s.out' % name))
+        procs.append(route)
+        if not wait(lambda: admin('help') is not None):
+            raise RuntimeError('route did not start, see %s' % tmp)
+
+        procs.append(start(['bench/stub.py', '-i', HOST, '-f', opts.function,
+            '-m', 'delay', '--delay', str(opts.delay), '-l', os.path.join(tmp, 'stub.log')],
+            os.path.join(tmp, 'stub-%s.out' % name)))
+        if not wait(lambda: (admin('routes') or {}).get(opts.function, 0) >= 1):
+            raise RuntimeError('business module did not register, see %s' % tmp)
+
+        latency = Histogram()
+        errors = []
+        start_time = time.time()
+        IOLoop.current().run_sync(lambda: storm(opts.boxes, codes, latency, errors))
+        elapsed = time.time() - start_time
+        forwarded, coalesced = get_handled(opts.function)
+    finally:
+        for proc in reversed(procs):
+            stop(proc)
+
+    summary = latency.snapshot()
+    print '%s: %d requests, %d forwarded, %d coalesced, %.3f s, p99 %.1f ms, %d errors' % (
+        name, opts.boxes * len(codes), forwarded, coalesced, elapsed,
+        summary.get('p99', 0) * 1000, len(errors))
+    return {
+        '%s business requests' % name : forwarded,
+        '%s storm s' % name : elapsed,
+        '%s p50 ms' % name : summary.get('p50', 0) * 1000,
+        '%s p99 ms' % name : summary.get('p99', 0) * 1000,
+        '%s errors' % name : len(errors),
+    }
+
+
+def register_options():
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option("-b", "--boxes", dest="boxes",
+        type=int,
+        default=1000, help="specify booting boxes, default is 1000")
+    parser.add_option("-c", "--codes", dest="codes",
+        default='10000,10001', help="specify init requests of every box, default is 10000,10001")
+    parser.add_option("-f", "--function", dest="function",
+        default='control', help="specify function serving the codes, default is control")
+    parser.add_option("--delay", dest="delay",
+        type=float,
+        default=20, help="specify ms the business module takes per request, default is 20")
+    parser.add_option("-B", "--baseline", dest="baseline",
+        default='bootstorm', help="specify baseline name, default is bootstorm")
+    parser.add_option("-s", "--save", dest="save",
+        action='store_true',
+        default=False, help="save results into the baseline")
+    parser.add_option("-t", "--tolerance", dest="tolerance",
+        type=float,
+        default=0.2, help="specify change reported as regression, default is 0.2")
+    parser.add_option("-k", "--keep", dest="keep",
+        action='store_true',
+        default=False, help="keep logs of the runs")
+
+    (options, args) = parser.parse_args()
+    return options
+
+
+if __name__ == '__main__':
+
+    opts = register_options()
+
+    tmp = tempfile.mkdtemp(prefix='bootstorm-')
+    print 'boot %d boxes, logs in %s' % (opts.boxes, tmp)
+    results = {}
+    results.update(run_storm('single', False, opts, tmp))
+    results.update(run_storm('coalesced', True, opts, tmp))
+    if not opts.keep:
+        shutil.rmtree(tmp)
+
+    single = results['single business requests']
+    if single:
+        print 'business load %.1f%% of single requests' % (
+            100.0 * results['coalesced business requests'] / single)
+
+    old = baseline.load(opts.baseline)
+    regressions = baseline.compare(results, old, HIGHER, opts.tolerance)
+
+    if opts.save:
+        params = dict((key, getattr(opts, key)) for key in ('boxes', 'codes',
+            'function', 'delay'))
+        baseline.save(opts.baseline, results, params)
+        print 'saved %s' % baseline.get_baseline_file(opts.baseline)
+    elif regressions:
+        print '%d regressions' % len(regressions)
+        sys.exit(1)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python2.7
+#coding=utf-8
+
+"""microbenchmark: per packet cost of choosing a business connection
+
+old: config.get_server + clients_lock + dict lookup + set pop/add
+new: one lookup in the compiled routing table + balancer select
+"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import os
+import sys
+import timeit
+import random
+import threading
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, '../generic'))
+sys.path.append(os.path.join(ROOT, '../route'))
+import config
+import routing
+from balancer import create_balancer
+
+
+class FakeBusiness(object):
+    def __init__(self, function):
+        self._function = function
+
+    def get_inflight(self):
+        return 0
+
+    def get_latency(self):
+        return 0.01
+
+    def is_saturated(self):
+        return False
+
+
+def old_dispatch(codes, clients, lock):
+    for request in codes:
+        business = config.get_server(request)
+        lock.acquire()
+        if business in clients:
+            conn = clients[business].pop()
+            clients[business].add(conn)
+        lock.release()
+
+
+def lookup_only(codes):
+    routes = routing.ROUTES
+    for request in codes:
+        pool = routes.get(request)
+
+
+def new_dispatch(codes):
+    routes = routing.ROUTES
+    for request in codes:
+        pool = routes.get(request)
+        conn = pool.select() if pool is not None else None
+
+
+def register_options():
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option("-n", "--num", dest="num",
+        type=int,
+        default=100000, help="specify packets per run")
+    parser.add_option("-c", "--conns", dest="conns",
+        type=int,
+        default=4, help="specify business connections per function")
+    parser.add_option("-r", "--repeat", dest="repeat",
+        type=int,
+        default=5, help="specify runs, best one is reported")
+
+    (options, args) = parser.parse_args()
+    return options
+
+
+def measure(stmt, num, repeat):
+    """best cost per packet in ns"""
+    return min(timeit.repeat(stmt, number=1, repeat=repeat)) / num * 1e9
+
+
+if __name__ == '__main__':
+
+    opts = register_options()
+
+    functions = set(config.get_routes().itervalues())
+    clients = {}
+    for function in functions:
+        clients[function] = set()
+        for i in xrange(opts.conns):
+            conn = FakeBusiness(function)
+            clients[function].add(conn)
+            routing.register(conn)
+    lock = threading.Lock()
+
+    all_codes = config.get_routes().keys()
+    codes = [random.choice(all_codes) for i in xrange(opts.num)]
+
+    old = measure(lambda: old_dispatch(codes, clients, lock), opts.num, opts.repeat)
+    print 'old dispatch: %8.1f ns/packet' % old
+
+    lookup = measure(lambda: lookup_only(codes), opts.num, opts.repeat)
+    print 'table lookup: %8.1f ns/packet' % lookup
+
+    for name in ('roundrobin', 'least', 'p2c'):
+        for function in functions:
+            pool = create_balancer(name)
+            for conn in routing.POOLS[function]:
+                pool.add(conn)
+            routing.POOLS[function] = pool
+        routing.ROUTES = routing.compile_routes()
+        new = measure(lambda: new_dispatch(codes), opts.num, opts.repeat)
+        print 'new dispatch: %8.1f ns/packet (%s)' % (new, name)
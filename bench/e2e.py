@@ -0,0 +1,229 @@
+#!/usr/bin/env python2.7
+#coding=utf-8
+
+"""end to end benchmark on localhost
+
+Starts route/route.py, M stub business modules (bench/stub.py) and
+client.py with N boxes for every scenario, then compares throughput
+and latency with bench/baselines/e2e.json.
+
+eg.
+    bench/e2e.py                          # all scenarios
+    bench/e2e.py -S echo,delay -b 5000 -m 4
+    bench/e2e.py -S echo -s               # save as the baseline
+"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import signal
+import shutil
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TOP = os.path.abspath(os.path.join(ROOT, '..'))
+import baseline
+
+HOST = '127.0.0.1'
+ADMIN_PORT = 7666
+
+# stub arguments of every scenario
+SCENARIOS = [
+    ('echo', ['-m', 'echo']),
+    ('tcp', ['-m', 'echo', '-T', 'tcp']),
+    ('v1', ['-m', 'echo', '-P', '1']),
+    ('checksum', ['-m', 'echo', '--checksum']),
+    ('delay', ['-m', 'delay', '--delay', '5']),
+    ('sleep', ['-m', 'sleep', '--delay', '5', '-e', 'thread', '-w', '32']),
+    ('drop', ['-m', 'drop', '--drop', '0.01']),
+]
+
+# results where higher is better
+HIGHER = ('throughput',)
+
+
+def start(args, log):
+    """start a python script in its own process group"""
+    out = open(log, 'w')
+    return subprocess.Popen([sys.executable] + args, cwd=TOP, stdout=out,
+        stderr=subprocess.STDOUT, preexec_fn=os.setsid)
+
+
+def stop(proc):
+    """stop proc and the processes it forked"""
+    if proc.poll() is not None:
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        for i in xrange(20):
+            if proc.poll() is not None:
+                break
+            time.sleep(0.1)
+        # whatever of the group is still up, eg. a process with a blocked ioloop
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError, e:
+        if e.errno != errno.ESRCH:
+            raise
+    proc.wait()
+
+
+def admin(command, port=ADMIN_PORT, timeout=1):
+    """reply of an admin command of route, None if route is not up"""
+    try:
+        sock = socket.create_connection((HOST, port), timeout)
+    except socket.error:
+        return None
+    try:
+        sock.sendall(command + '\n')
+        data = ''
+        while not data.endswith('\n'):
+            chunk = sock.recv(65536)
+            if not chunk:
+                return None
+            data += chunk
+        return json.loads(data)['result']
+    finally:
+        sock.close()
+
+
+def wait(fn, timeout=10):
+    end = time.time() + timeout
+    while time.time() < end:
+        if fn():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def run_scenario(name, stub_args, opts, tmp):
+    procs = []
+    try:
+        route = start(['route/route.py', '-i', HOST, '-n', str(opts.workers),
+            '-l', os.path.join(tmp, 'route.log')], os.path.join(tmp, 'route.out'))
+        procs.append(route)
+        if not wait(lambda: admin('help') is not None):
+            raise RuntimeError('route did not start, see %s' % tmp)
+
+        for i in xrange(opts.businesses):
+            procs.append(start(['bench/stub.py', '-i', HOST, '-f', opts.function,
+                '-l', os.path.join(tmp, 'stub%d.log' % i)] + stub_args,
+                os.path.join(tmp, 'stub%d.out' % i)))
+        # stubs register on worker 0 first, then connect to the other workers
+        if not wait(lambda: (admin('routes') or {}).get(opts.function, 0) >= opts.businesses):
+            raise RuntimeError('business modules did not register, see %s' % tmp)
+        time.sleep(0.5)
+
+        output = os.path.join(tmp, '%s.json' % name)
+        args = ['client.py', '-i', HOST, '-n', str(opts.boxes),
+            '-m', opts.mix, '-d', str(opts.duration), '-w', str(opts.warmup),
+            '-C', str(opts.concurrency), '-r', str(opts.rate),
+            '-o', output, '-l', os.path.join(tmp, 'client.log')]
+        client = start(args, os.path.join(tmp, 'client.out'))
+        procs.append(client)
+        client.wait()
+        if client.returncode != 0 or not os.path.exists(output):
+            raise RuntimeError('client failed, see %s' % tmp)
+
+        with open(output) as f:
+            result = json.load(f)
+    finally:
+        for proc in reversed(procs):
+            stop(proc)
+
+    latency = result['latency']
+    return {
+        '%s throughput' % name : result['throughput'],
+        '%s p50 ms' % name : latency.get('p50', 0) * 1000,
+        '%s p99 ms' % name : latency.get('p99', 0) * 1000,
+        '%s p999 ms' % name : latency.get('p999', 0) * 1000,
+        '%s errors' % name : result['errors'],
+        '%s lost' % name : result['lost'],
+    }
+
+
+def register_options():
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option("-S", "--scenario", dest="scenarios",
+        default=','.join(name for name, args in SCENARIOS),
+        help="specify scenarios, default is all of them")
+    parser.add_option("-b", "--boxes", dest="boxes",
+        type=int,
+        default=1000, help="specify box connections, default is 1000")
+    parser.add_option("-m", "--businesses", dest="businesses",
+        type=int,
+        default=2, help="specify stub business modules, default is 2")
+    parser.add_option("-n", "--workers", dest="workers",
+        type=int,
+        default=1, help="specify route processes, default is 1")
+    parser.add_option("-f", "--function", dest="function",
+        default='control', help="specify function of the stubs, default is control")
+    parser.add_option("--mix", dest="mix",
+        default='10001', help="specify request mix, all codes must be served by --function")
+    parser.add_option("-d", "--duration", dest="duration",
+        type=float,
+        default=10, help="specify seconds to measure, default is 10")
+    parser.add_option("-w", "--warmup", dest="warmup",
+        type=float,
+        default=2, help="specify seconds to warm up, default is 2")
+    parser.add_option("-C", "--concurrency", dest="concurrency",
+        type=int,
+        default=1, help="specify outstanding requests per box in closed loop, default is 1")
+    parser.add_option("-r", "--rate", dest="rate",
+        type=int,
+        default=0, help="specify requests per second for open loop, default 0 is closed loop")
+    parser.add_option("-B", "--baseline", dest="baseline",
+        default='e2e', help="specify baseline name, default is e2e")
+    parser.add_option("-s", "--save", dest="save",
+        action='store_true',
+        default=False, help="save results into the baseline")
+    parser.add_option("-t", "--tolerance", dest="tolerance",
+        type=float,
+        default=0.2, help="specify change reported as regression, default is 0.2")
+    parser.add_option("-k", "--keep", dest="keep",
+        action='store_true',
+        default=False, help="keep logs of the runs")
+
+    (options, args) = parser.parse_args()
+    return options
+
+
+if __name__ == '__main__':
+
+    opts = register_options()
+
+    scenarios = dict(SCENARIOS)
+    names = opts.scenarios.split(',')
+    for name in names:
+        if name not in scenarios:
+            sys.exit('unknown scenario %s, choose from %s' % (name, ', '.join(scenarios)))
+
+    results = {}
+    for name in names:
+        tmp = tempfile.mkdtemp(prefix='e2e-%s-' % name)
+        print 'run %s: %d boxes, %d businesses, %d route processes, logs in %s' % (
+            name, opts.boxes, opts.businesses, opts.workers, tmp)
+        results.update(run_scenario(name, scenarios[name], opts, tmp))
+        if not opts.keep:
+            shutil.rmtree(tmp)
+
+    higher = [name for name in results if name.endswith(HIGHER)]
+    old = baseline.load(opts.baseline)
+    regressions = baseline.compare(results, old, higher, opts.tolerance)
+
+    if opts.save:
+        merged = dict(old or {})
+        merged.update(results)
+        params = dict((key, getattr(opts, key)) for key in ('boxes', 'businesses',
+            'workers', 'mix', 'duration', 'warmup', 'concurrency', 'rate'))
+        baseline.save(opts.baseline, merged, params)
+        print 'saved %s' % baseline.get_baseline_file(opts.baseline)
+    elif regressions:
+        print '%d regressions' % len(regressions)
+        sys.exit(1)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python2.7
+#coding=utf-8
+
+"""memory footprint of idle box connections
+
+Starts one route process, opens N box connections which send one init
+request each and then stay idle, like the boxes of big venues, and
+reports the resident memory route takes per connection, compared with
+bench/baselines/footprint.json.
+
+N is capped by the open files limit of this host, raise it (ulimit -Hn)
+to measure 50000. Beyond about 28000 connections source addresses
+127.0.0.2, 127.0.0.3 ... are used, one host has that many ports.
+
+eg.
+    bench/footprint.py                    # 50000 connections
+    bench/footprint.py -b 10000
+    bench/footprint.py -s                 # save as the baseline
+"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import os
+import sys
+import time
+import shutil
+import socket
+import resource
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, '../generic'))
+import baseline
+from e2e import HOST, start, stop, admin, wait
+from framing import CLIENT_HEADER
+
+BOX_PORT = 58849
+
+# files route and this process keep open besides the connections
+SPARE_FILES = 100
+
+# connections of one source address
+PER_ADDRESS = 20000
+
+# init request of every box
+REQUEST = 10001
+BODY = '{"venue" : 520}'
+
+# results where higher is better
+HIGHER = ()
+
+
+def get_rss(pid):
+    """resident memory of pid in bytes"""
+    with open('/proc/%d/status' % pid) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def get_boxes():
+    return (admin('metrics') or {}).get('connections', {}).get('box', 0)
+
+
+def raise_file_limit(wanted):
+    """raise the open files limit, inherited by route, return connections possible"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY:
+        wanted = min(wanted, hard - SPARE_FILES)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (wanted + SPARE_FILES, hard))
+    return wanted
+
+
+def connect(boxes, batch):
+    """open boxes connections, batch at a time, each sends its init request"""
+    socks = []
+    for i in xrange(boxes):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.%d' % (1 + i // PER_ADDRESS), 0))
+        sock.connect((HOST, BOX_PORT))
+        sock.sendall(CLIENT_HEADER.pack(17, 100, REQUEST, 0, len(BODY), i + 1) + BODY)
+        socks.append(sock)
+        if len(socks) % batch == 0:
+            # route accepts and reads them before the next batch
+            expected = len(socks)
+            if not wait(lambda: get_boxes() >= expected, 30):
+                raise RuntimeError('route accepted %d of %d connections' % (
+                    get_boxes(), expected))
+    if not wait(lambda: get_boxes() >= boxes, 30):
+        raise RuntimeError('route accepted %d of %d connections' % (get_boxes(), boxes))
+    return socks
+
+
+def run(opts, tmp):
+    procs = []
+    socks = []
+    try:
+        route = start(['route/route.py', '-i', HOST, '-n', '1',
+            '-l', os.path.join(tmp, 'route.log')], os.path.join(tmp, 'route.out'))
+        procs.append(route)
+        if not wait(lambda: admin('help') is not None):
+            raise RuntimeError('route did not start, see %s' % tmp)
+        time.sleep(0.5)
+        idle = get_rss(route.pid)
+
+        start_time = time.time()
+        socks = connect(opts.boxes, opts.batch)
+        elapsed = time.time() - start_time
+        # let the error replies go out and the allocator settle
+        time.sleep(opts.settle)
+        rss = get_rss(route.pid)
+    finally:
+        for sock in socks:
+            sock.close()
+        for proc in reversed(procs):
+            stop(proc)
+
+    per_connection = float(rss - idle) / opts.boxes
+    print '%d connections in %.1f s, route rss %.1f MB -> %.1f MB, %.0f bytes per connection' % (
+        opts.boxes, elapsed, idle / 1048576.0, rss / 1048576.0, per_connection)
+    return {
+        'idle rss MB' : idle / 1048576.0,
+        'rss MB' : rss / 1048576.0,
+        'bytes per connection' : per_connection,
+    }
+
+
+def register_options():
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option("-b", "--boxes", dest="boxes",
+        type=int,
+        default=50000, help="specify box connections, default is 50000")
+    parser.add_option("--batch", dest="batch",
+        type=int,
+        default=1000, help="specify connections opened before waiting for route, default is 1000")
+    parser.add_option("--settle", dest="settle",
+        type=float,
+        default=2, help="specify seconds to wait before measuring, default is 2")
+    parser.add_option("-B", "--baseline", dest="baseline",
+        default='footprint', help="specify baseline name, default is footprint")
+    parser.add_option("-s", "--save", dest="save",
+        action='store_true',
+        default=False, help="save results into the baseline")
+    parser.add_option("-t", "--tolerance", dest="tolerance",
+        type=float,
+        default=0.2, help="specify change reported as regression, default is 0.2")
+    parser.add_option("-k", "--keep", dest="keep",
+        action='store_true',
+        default=False, help="keep logs of the run")
+
+    (options, args) = parser.parse_args()
+    return options
+
+
+if __name__ == '__main__':
+
+    opts = register_options()
+
+    boxes = raise_file_limit(opts.boxes)
+    if boxes < opts.boxes:
+        print 'open files limit allows %d connections, not %d' % (boxes, opts.boxes)
+        opts.boxes = boxes
+
+    tmp = tempfile.mkdtemp(prefix='footprint-')
+    print 'open %d box connections, logs in %s' % (opts.boxes, tmp)
+    results = run(opts, tmp)
+    if not opts.keep:
+        shutil.rmtree(tmp)
+
+    old = baseline.load(opts.baseline)
+    regressions = baseline.compare(results, old, HIGHER, opts.tolerance)
+
+    if opts.save:
+        baseline.save(opts.baseline, results, {'boxes' : opts.boxes})
+        print 'saved %s' % baseline.get_baseline_file(opts.baseline)
+    elif regressions:
+        print '%d regressions' % len(regressions)
+        sys.exit(1)
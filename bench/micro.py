@@ -0,0 +1,266 @@
+#!/usr/bin/env python2.7
+#coding=utf-8
+
+"""microbenchmarks of the per packet work of route and business modules
+
+Every case runs --num operations --repeat times, the best run is
+reported in ns per operation. "old" cases are the code paths the
+modules used before, kept to show what the current ones save.
+
+eg.
+    bench/micro.py              # compare with bench/baselines/micro.json
+    bench/micro.py -s           # save this run as the baseline
+    bench/micro.py -k header    # only cases whose name contains header
+"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import os
+import sys
+import time
+import socket
+import struct
+import timeit
+import random
+import hashlib
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, '../generic'))
+sys.path.append(os.path.join(ROOT, '../route'))
+import config
+import routing
+import baseline
+from framing import FrameReader, CLIENT_HEADER, CLIENT_LENGTH_INDEX, ROUTE_HEADER
+from framing import encode_ip, encode_timestamp
+from framing import ROUTE_HEADER_V2, encode_ip16, get_monotonic_us
+from metrics import Histogram
+from pending import PendingTable
+from ratelimit import RateLimiter
+
+BODY = 'hello world' * 10
+
+MD5 = hashlib.md5(BODY).hexdigest()
+
+SEQUENCE = struct.Struct('Q')
+
+
+class FakeStream(object):
+    """stream whose buffer is filled by the benchmark"""
+
+    def closed(self):
+        return False
+
+
+    def read_bytes(self, num, callback, partial=False):
+        pass
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self._pending = set()
+
+
+def client_header_pack_old(num):
+    """native pack of six htonl, as client.py did"""
+    for i in xrange(num):
+        elems = [socket.htonl(x) for x in (17, 100, 10001, i, len(BODY), 520)]
+        struct.pack('6I', elems[0], elems[1], elems[2],
+            elems[3], elems[4], elems[5])
+
+
+def client_header_pack(num):
+    pack = CLIENT_HEADER.pack
+    for i in xrange(num):
+        pack(17, 100, 10001, i, len(BODY), 520)
+
+
+def client_header_unpack_old(num):
+    """native unpack and six ntohl of Connection.read_header"""
+    header = struct.pack('!6I', 17, 100, 10001, 1, len(BODY), 520)
+    for i in xrange(num):
+        parts = struct.unpack('6I', header)
+        parts = [socket.ntohl(x) for x in parts]
+
+
+def client_header_unpack(num):
+    data = CLIENT_HEADER.pack(17, 100, 10001, 1, len(BODY), 520) + BODY
+    unpack_from = CLIENT_HEADER.unpack_from
+    for i in xrange(num):
+        unpack_from(data, 0)
+
+
+def route_header_pack_old(num):
+    """BusinessConnection.send: inet_aton and htonl of every field"""
+    htonl = socket.htonl
+    for i in xrange(num):
+        ip = struct.unpack('I', socket.inet_aton('127.0.0.1'))[0]
+        struct.pack('2I32sdII', htonl(1), htonl(1), MD5, time.time(),
+            htonl(len(BODY)), htonl(ip))
+
+
+def route_header_pack(num):
+    """the ip is encoded once per client connection"""
+    pack = ROUTE_HEADER.pack
+    ip = encode_ip('127.0.0.1')
+    for i in xrange(num):
+        pack(1, 520, MD5, encode_timestamp(time.time()), len(BODY), ip)
+
+
+def route_header_pack_v2(num):
+    """protocol 2: request id and ip need no hashing or conversion"""
+    pack = ROUTE_HEADER_V2.pack
+    ip16 = encode_ip16('127.0.0.1')
+    for i in xrange(num):
+        pack(1, 0, len(BODY), i, get_monotonic_us(), ip16, 0)
+
+
+def route_header_unpack_old(num):
+    """BusinessConnection.read_header: ntohl and inet_ntoa of the fields"""
+    ntohl = socket.ntohl
+    header = struct.pack('!2I32sdII', 1, 1, MD5, time.time(), len(BODY), 2130706433)
+    for i in xrange(num):
+        device_type, device_id, md5, timestamp, length, ip = struct.unpack(
+            '2I32sdII', header)
+        device_type = ntohl(device_type)
+        device_id = ntohl(device_id)
+        length = ntohl(length)
+        ip = socket.inet_ntoa(struct.pack('I', ntohl(ip)))
+
+
+def route_header_unpack(num):
+    data = ROUTE_HEADER.pack(1, 520, MD5, encode_timestamp(time.time()),
+        len(BODY), encode_ip('127.0.0.1')) + BODY
+    unpack_from = ROUTE_HEADER.unpack_from
+    for i in xrange(num):
+        unpack_from(data, 0)
+
+
+def get_server_old(num):
+    codes = config.get_routes().keys()
+    get_server = config.get_server
+    for i in xrange(num):
+        get_server(codes[i % len(codes)])
+
+
+def get_server(num):
+    codes = config.get_routes().keys()
+    routes = routing.ROUTES
+    for i in xrange(num):
+        routes.get(codes[i % len(codes)])
+
+
+def request_id_md5(num):
+    """request id of BusinessConnection.forward"""
+    msg = CLIENT_HEADER.pack(17, 100, 10001, 1, len(BODY), 520) + BODY
+    pack = SEQUENCE.pack
+    for i in xrange(num):
+        verify = hashlib.md5()
+        verify.update(msg)
+        verify.update(pack(i))
+        verify.hexdigest()
+
+
+def frame_dispatch(num):
+    """FrameReader cost per frame, all frames in one read"""
+    frame = CLIENT_HEADER.pack(17, 100, 10001, 1, len(BODY), 520) + BODY
+    reader = FrameReader(FakeStream(), CLIENT_HEADER, CLIENT_LENGTH_INDEX,
+        lambda header, packet: None)
+    reader._on_data(frame * num)
+
+
+def histogram_record(num):
+    histogram = Histogram()
+    values = [random.expovariate(1000) for i in xrange(1000)]
+    record = histogram.record
+    for i in xrange(num):
+        record(values[i % 1000])
+
+
+def pending_add_pop(num):
+    table = PendingTable()
+    client, business = FakeConnection(), FakeConnection()
+    header = (17, 100, 10001, 1, 520)
+    keys = [hashlib.md5(str(i)).hexdigest() for i in xrange(1000)]
+    for i in xrange(num):
+        key = keys[i % 1000]
+        table.add(key, client, business, header, 30)
+        table.pop(key)
+
+
+def rate_limit_admit(num):
+    # limited device, ip and port, rates high enough to admit all
+    config.reload_config({'rate_limit_map' : {'device_rate' : 1e9,
+        'ip_rate' : 1e9, 'port_rate' : 1e9}})
+    admit = RateLimiter('bench').admit
+    now = time.time()
+    for i in xrange(num):
+        admit(i % 5000, '10.0.0.1', now)
+
+
+CASES = [
+    ('client header pack old', client_header_pack_old),
+    ('client header pack', client_header_pack),
+    ('client header unpack old', client_header_unpack_old),
+    ('client header unpack', client_header_unpack),
+    ('route header pack old', route_header_pack_old),
+    ('route header pack', route_header_pack),
+    ('route header pack v2', route_header_pack_v2),
+    ('route header unpack old', route_header_unpack_old),
+    ('route header unpack', route_header_unpack),
+    ('get_server old', get_server_old),
+    ('get_server', get_server),
+    ('request id md5', request_id_md5),
+    ('frame dispatch', frame_dispatch),
+    ('histogram record', histogram_record),
+    ('pending add pop', pending_add_pop),
+    ('rate limit admit', rate_limit_admit),
+]
+
+
+def measure(fn, num, repeat):
+    """best cost per operation in ns"""
+    return min(timeit.repeat(lambda: fn(num), number=1, repeat=repeat)) / num * 1e9
+
+
+def register_options():
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option("-n", "--num", dest="num",
+        type=int,
+        default=100000, help="specify operations per run")
+    parser.add_option("-r", "--repeat", dest="repeat",
+        type=int,
+        default=5, help="specify runs, best one is reported")
+    parser.add_option("-k", "--keyword", dest="keyword",
+        default='', help="specify cases to run by a part of their name")
+    parser.add_option("-b", "--baseline", dest="baseline",
+        default='micro', help="specify baseline name, default is micro")
+    parser.add_option("-s", "--save", dest="save",
+        action='store_true',
+        default=False, help="save results as the baseline")
+    parser.add_option("-t", "--tolerance", dest="tolerance",
+        type=float,
+        default=0.2, help="specify slow down reported as regression, default is 0.2")
+
+    (options, args) = parser.parse_args()
+    return options
+
+
+if __name__ == '__main__':
+
+    opts = register_options()
+
+    results = {}
+    for name, fn in CASES:
+        if opts.keyword in name:
+            results[name] = measure(fn, opts.num, opts.repeat)
+
+    regressions = baseline.compare(results, baseline.load(opts.baseline),
+        tolerance=opts.tolerance)
+
+    if opts.save:
+        baseline.save(opts.baseline, results, {'num' : opts.num, 'repeat' : opts.repeat})
+        print 'saved %s' % baseline.get_baseline_file(opts.baseline)
+    elif regressions:
+        print '%d regressions' % len(regressions)
+        sys.exit(1)
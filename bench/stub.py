@@ -0,0 +1,130 @@
+#!/usr/bin/env python2.7
+#coding=utf-8
+
+"""stub business module for benchmarks
+
+echo: reply the request body at once
+delay: reply after --delay ms without blocking, a coroutine
+sleep: block --delay ms before replying, eg. a slow database call,
+    only a thread or process executor keeps other requests going
+drop: never reply --drop of the requests, echo the others
+
+eg. bench/stub.py -i 127.0.0.1 -f control -m sleep --delay 5 -e thread -w 16
+"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import os
+import sys
+import time
+import random
+import signal
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, '../generic'))
+from utility import init_log, get_ip
+from business import Business
+from executor import EXECUTORS
+
+MODES = ('echo', 'delay', 'sleep', 'drop')
+
+
+def sig_handler(sig, frame):
+    IOLoop.current().stop()
+
+
+class Stub(Business):
+    mode = 'echo'
+    delay = 0 # seconds
+    drop = 0 # fraction of requests never replied
+
+    def new_connection(self, port):
+        return Stub(self._function, self._address[0], port)
+
+
+    def handle(self, request):
+        if self.mode == 'delay':
+            return self.handle_later(request)
+        if self.mode == 'sleep':
+            time.sleep(self.delay)
+        elif self.mode == 'drop' and random.random() < self.drop:
+            return None
+        return request.body
+
+
+    @gen.coroutine
+    def handle_later(self, request):
+        yield gen.sleep(self.delay)
+        raise gen.Return(request.body)
+
+
+def register_options():
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option("-i", "--host", dest="host",
+        default=get_ip(), help="specify host, default is local ip")
+    parser.add_option("-p", "--port", dest="port",
+        type="int",
+        default=6666, help="specify port, default is 6666")
+    parser.add_option("-f", "--function", dest="function",
+        default='control', help="specify business function, default is control")
+    parser.add_option("-n", "--num", dest="num",
+        type="int",
+        default=1, help="specify connections, default is 1")
+    parser.add_option("-m", "--mode", dest="mode",
+        choices=MODES,
+        default='echo', help="specify mode: echo, delay, sleep or drop")
+    parser.add_option("--delay", dest="delay",
+        type="float",
+        default=1, help="specify ms a reply is delayed in delay and sleep mode, default is 1")
+    parser.add_option("--drop", dest="drop",
+        type="float",
+        default=0.01, help="specify fraction of requests dropped in drop mode, default is 0.01")
+    parser.add_option("-e", "--executor", dest="executor",
+        choices=EXECUTORS,
+        default='inline', help="specify executor: inline, thread or process")
+    parser.add_option("-w", "--workers", dest="workers",
+        type="int",
+        default=0, help="specify threads or processes of executor, default is cpu count")
+    parser.add_option("-o", "--ordered", dest="ordered",
+        action='store_true',
+        default=False, help="handle requests of one device in order")
+    parser.add_option("-P", "--protocol", dest="protocol",
+        type="int",
+        default=2, help="specify protocol asked for at register, default is 2")
+    parser.add_option("--checksum", dest="checksum",
+        action='store_true',
+        default=False, help="checksum bodies in protocol 2")
+    parser.add_option("-T", "--transport", dest="transport",
+        choices=('auto', 'tcp', 'unix'),
+        default='auto', help="specify transport to route: auto, tcp or unix, default is auto")
+    parser.add_option("-l", "--log", dest="log",
+        default='/dev/null', help="specify log name")
+
+    (options, args) = parser.parse_args()
+    return options
+
+
+if __name__ == '__main__':
+
+    opts = register_options()
+
+    init_log(opts.log, False)
+
+    Stub.mode = opts.mode
+    Stub.delay = opts.delay / 1000.0
+    Stub.drop = opts.drop
+    Business.set_executor(opts.executor, opts.workers or None, opts.ordered)
+    Business.protocol = opts.protocol
+    Business.checksum = opts.checksum
+    Business.transport = opts.transport
+
+    signal.signal(signal.SIGTERM, sig_handler)
+    signal.signal(signal.SIGINT, sig_handler)
+
+    for i in xrange(opts.num):
+        Stub(opts.function, opts.host, opts.port)
+
+    IOLoop.current().start()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python2.7
+#coding=utf-8
+
+"""benchmark of route <-> business transports on one host
+
+A parent and a forked child play ping-pong with messages of --size
+bytes over every transport and report the round trip latency and the
+cpu of both processes per message:
+
+tcp: loopback tcp, what business modules used before
+unix: unix domain socket, what local business modules use now
+ring: one shared memory ring per direction, busy polled, no syscall
+ring+bell: the same rings, a byte on a unix socket wakes the reader up
+
+Results are compared with bench/baselines/transport.json.
+
+eg.
+    bench/transport.py
+    bench/transport.py -n 100000 --size 4096
+    bench/transport.py -s                 # save as the baseline
+"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import os
+import sys
+import mmap
+import time
+import socket
+import struct
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, '../generic'))
+import baseline
+from metrics import Histogram
+
+TRANSPORTS = ('tcp', 'unix', 'ring', 'ring+bell')
+
+# results where higher is better
+HIGHER = ()
+
+LENGTH = struct.Struct('I')
+POSITION = struct.Struct('Q')
+
+# bytes of data of one ring
+RING_SIZE = 1024 * 1024
+
+
+class Ring(object):
+    """single producer single consumer ring in shared memory
+
+    head and tail are byte counts written and read, each one updated by
+    one side only, after the data it covers.
+    """
+
+    def __init__(self, size=RING_SIZE):
+        self._size = size
+        self._map = mmap.mmap(-1, 16 + size)
+
+
+    def _get(self, offset):
+        return POSITION.unpack_from(self._map, offset)[0]
+
+
+    def _copy_in(self, pos, data):
+        start = 16 + pos % self._size
+        first = min(len(data), 16 + self._size - start)
+        self._map[start:start + first] = data[:first]
+        if first < len(data):
+            self._map[16:16 + len(data) - first] = data[first:]
+
+
+    def _copy_out(self, pos, size):
+        start = 16 + pos % self._size
+        first = min(size, 16 + self._size - start)
+        data = self._map[start:start + first]
+        if first < size:
+            data += self._map[16:16 + size - first]
+        return data
+
+
+    def put(self, data):
+        """False if the ring has no room"""
+        head, tail = self._get(0), self._get(8)
+        if head + LENGTH.size + len(data) - tail > self._size:
+            return False
+        self._copy_in(head, LENGTH.pack(len(data)) + data)
+        POSITION.pack_into(self._map, 0, head + LENGTH.size + len(data))
+        return True
+
+
+    def get(self):
+        """next message, None if the ring is empty"""
+        head, tail = self._get(0), self._get(8)
+        if head == tail:
+            return None
+        size = LENGTH.unpack(self._copy_out(tail, LENGTH.size))[0]
+        data = self._copy_out(tail + LENGTH.size, size)
+        POSITION.pack_into(self._map, 8, tail + LENGTH.size + size)
+        return data
+
+
+def recv_exactly(sock, size):
+    data = ''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError()
+        data += chunk
+    return data
+
+
+class SocketLink(object):
+    def __init__(self, sock):
+        self._sock = sock
+
+
+    def send(self, data):
+        self._sock.sendall(LENGTH.pack(len(data)) + data)
+
+
+    def recv(self):
+        size = LENGTH.unpack(recv_exactly(self._sock, LENGTH.size))[0]
+        return recv_exactly(self._sock, size)
+
+
+class RingLink(object):
+    """rings of both directions, bell wakes up the reader if set"""
+
+    def __init__(self, outgoing, incoming, bell=None):
+        self._outgoing = outgoing
+        self._incoming = incoming
+        self._bell = bell
+
+
+    def send(self, data):
+        while not self._outgoing.put(data):
+            pass
+        if self._bell is not None:
+            self._bell.send('\0')
+
+
+    def recv(self):
+        while True:
+            data = self._incoming.get()
+            if data is not None:
+                return data
+            if self._bell is not None:
+                recv_exactly(self._bell, 1)
+
+
+def create_links(transport, tmp):
+    """link of parent and link of child, called before fork"""
+    if transport in ('tcp', 'unix'):
+        if transport == 'tcp':
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.bind(('127.0.0.1', 0))
+        else:
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(os.path.join(tmp, 'transport.sock'))
+        server.listen(1)
+        client = socket.socket(server.family, socket.SOCK_STREAM)
+        client.connect(server.getsockname())
+        accepted, address = server.accept()
+        server.close()
+        if transport == 'tcp':
+            for sock in (client, accepted):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return SocketLink(client), SocketLink(accepted)
+
+    up, down = Ring(), Ring()
+    bells = socket.socketpair() if transport == 'ring+bell' else (None, None)
+    return RingLink(up, down, bells[0]), RingLink(down, up, bells[1])
+
+
+def get_cpu():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def run_transport(transport, opts, tmp):
+    parent, child = create_links(transport, tmp)
+    message = 'x' * opts.size
+    total = opts.num + opts.warmup
+
+    pid = os.fork()
+    if pid == 0:
+        # echo every message back, then report own cpu
+        for i in xrange(total):
+            child.send(child.recv())
+        child.send(struct.pack('d', get_cpu()))
+        os._exit(0)
+
+    latency = Histogram()
+    for i in xrange(opts.warmup):
+        parent.send(message)
+        parent.recv()
+    cpu = get_cpu()
+    start = time.time()
+    for i in xrange(opts.num):
+        sent = time.time()
+        parent.send(message)
+        parent.recv()
+        latency.record(time.time() - sent)
+    elapsed = time.time() - start
+    cpu = get_cpu() - cpu
+    # the child cpu of the warm up is counted too, it is small
+    cpu += struct.unpack('d', parent.recv())[0]
+    os.waitpid(pid, 0)
+
+    summary = latency.snapshot()
+    print '%-10s %8.1f us p50 %8.1f us p99 %8.1f us cpu/msg %9.0f msg/s' % (
+        transport, summary['p50'] * 1e6, summary['p99'] * 1e6,
+        cpu / opts.num * 1e6, opts.num / elapsed)
+    return {
+        '%s p50 us' % transport : summary['p50'] * 1e6,
+        '%s p99 us' % transport : summary['p99'] * 1e6,
+        '%s cpu us' % transport : cpu / opts.num * 1e6,
+    }
+
+
+def register_options():
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option("-T", "--transport", dest="transports",
+        default=','.join(TRANSPORTS), help="specify transports, default is all of them")
+    parser.add_option("-n", "--num", dest="num",
+        type=int,
+        default=20000, help="specify round trips, default is 20000")
+    parser.add_option("-w", "--warmup", dest="warmup",
+        type=int,
+        default=1000, help="specify round trips not measured, default is 1000")
+    parser.add_option("--size", dest="size",
+        type=int,
+        default=200, help="specify bytes of a message, default is 200")
+    parser.add_option("-B", "--baseline", dest="baseline",
+        default='transport', help="specify baseline name, default is transport")
+    parser.add_option("-s", "--save", dest="save",
+        action='store_true',
+        default=False, help="save results into the baseline")
+    parser.add_option("-t", "--tolerance", dest="tolerance",
+        type=float,
+        default=0.2, help="specify change reported as regression, default is 0.2")
+
+    (options, args) = parser.parse_args()
+    return options
+
+
+if __name__ == '__main__':
+
+    opts = register_options()
+
+    names = opts.transports.split(',')
+    for name in names:
+        if name not in TRANSPORTS:
+            sys.exit('unknown transport %s, choose from %s' % (name, ', '.join(TRANSPORTS)))
+
+    tmp = tempfile.mkdtemp(prefix='transport-')
+    results = {}
+    try:
+        for name in names:
+            results.update(run_transport(name, opts, tmp))
+    finally:
+        sock = os.path.join(tmp, 'transport.sock')
+        if os.path.exists(sock):
+            os.remove(sock)
+        os.rmdir(tmp)
+
+    old = baseline.load(opts.baseline)
+    regressions = baseline.compare(results, old, HIGHER, opts.tolerance)
+
+    if opts.save:
+        merged = dict(old or {})
+        merged.update(results)
+        baseline.save(opts.baseline, merged, {'num' : opts.num, 'size' : opts.size})
+        print 'saved %s' % baseline.get_baseline_file(opts.baseline)
+    elif regressions:
+        print '%d regressions' % len(regressions)
+        sys.exit(1)
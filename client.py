@@ -1,168 +1,467 @@
-#!/usr/bin/env python
-#!coding=utf-8
+#!/usr/bin/env python2.7
+#coding=utf-8
 
+"""load generator: many box/app/erp connections on one ioloop
+
+Every connection sends requests drawn from a mix of request codes and
+matches replies by the verify field of the client header.
+
+closed loop: each connection keeps --concurrency requests outstanding
+and sends the next one as soon as a reply comes.
+open loop: --rate requests per second are sent whatever the replies
+are, latency counts from the time a request was due, so a stalled
+router shows up in the percentiles instead of slowing the load down.
+
+eg.
+    client.py -i 127.0.0.1 -n 10000 --app 2000 -d 60
+    client.py -i 127.0.0.1 -n 5000 -r 20000 -m 10001=5,10004=1
+"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import os
 import sys
-import time 
+import json
+import time
+import random
 import socket
 import signal
+import bisect
 import logging
-from threading import Thread
-from struct import pack, unpack
+from tornado.iostream import IOStream, StreamClosedError
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, 'generic'))
+sys.path.append(os.path.join(ROOT, 'route'))
+from utility import init_log, get_default_log, get_ip
+from framing import FrameReader, FrameWriter, CLIENT_HEADER, CLIENT_LENGTH_INDEX
+from metrics import Histogram
+from config import parse_config
+
+BOX_PORT = 58849
+ERP_PORT = 25377
+APP_PORT = 3050
+
+AUTHOR = 17
+VERSION = 100
+
+# open loop: interval of the send timer, seconds
+SEND_INTERVAL = 0.005
+
+# seconds between progress reports
+REPORT_INTERVAL = 1
+
+# route error replies are json with a non zero status
+ERROR_MARK = '"status"'
+
+
+def parse_mix(mix, ini_file):
+    """'10001=5,10004=1' -> {request : weight}, all codes of ini_file if empty"""
+    weights = {}
+    for item in filter(None, mix.split(',')):
+        if '=' in item:
+            request, weight = item.split('=')
+        else:
+            request, weight = item, 1
+        weights[int(request)] = float(weight)
+    if not weights:
+        codes = parse_config(ini_file)['request_server_map']
+        weights = dict((request, 1.0) for request in codes)
+    return weights
+
+
+def is_error(body):
+    try:
+        return json.loads(body).get('status', 0) != 0
+    except (ValueError, AttributeError):
+        return False
+
+
+class Mix(object):
+    """pick request codes by weight"""
+
+    def __init__(self, weights):
+        self.codes = sorted(weights)
+        self._bounds = []
+        total = 0
+        for request in self.codes:
+            total += weights[request]
+            self._bounds.append(total)
+        self._total = total
+        # bodies are built once, every request of a code sends the same one
+        self.bodies = dict((request, json.dumps({'request' : request}))
+            for request in self.codes)
+
+
+    def pick(self):
+        return self.codes[bisect.bisect(self._bounds, random.random() * self._total)]
+
+
+class Client(object):
+    """one simulated box/app/erp connection"""
+    __slots__ = ('_gen', '_address', '_device', '_stream', '_reader',
+        '_writer', '_verify', '_sent', '_connected')
+
+    def __init__(self, gen, address, device):
+        self._gen = gen
+        self._address = address
+        self._device = device
+        self._verify = 0
+        self._sent = {} # verify : (request, due time)
+        self._connected = False
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._stream = IOStream(sock)
+        self._stream.set_close_callback(self.on_close)
+        self._writer = FrameWriter(self._stream)
+        self._reader = FrameReader(self._stream, CLIENT_HEADER,
+            CLIENT_LENGTH_INDEX, self.read_packet)
+        try:
+            self._stream.connect(address, self.on_connect)
+        except StreamClosedError:
+            pass
 
-import tornado.iostream
-import tornado.ioloop
 
-THREADS = []
+    def on_connect(self):
+        self._connected = True
+        self._reader.start()
+        self._gen.on_connect(self)
 
-def init_log():
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format='[%(asctime)s - %(process)-6d - %(threadName)-10s - %(levelname)-8s]\t%(message)s',
-        datefmt='%a, %d %b %Y %H:%M:%S',
-        filename='log/client.log',
-        filemode='w')
-    
-    sh = logging.StreamHandler()
-    sh.setLevel(logging.INFO)
-    formatter = logging.Formatter('%(levelname)-8s %(message)s')
-    sh.setFormatter(formatter)
-    logging.getLogger('').addHandler(sh)
 
+    def get_outstanding(self):
+        return len(self._sent)
 
-def get_ip():
-    hostname = socket.gethostname()
-    ip = socket.gethostbyname(hostname)
-    return ip
 
+    def send(self, due):
+        gen = self._gen
+        request = gen.mix.pick()
+        body = gen.mix.bodies[request]
+        self._verify = (self._verify + 1) & 0xffffffff
+        self._sent[self._verify] = (request, due)
+        self._writer.write(CLIENT_HEADER.pack(AUTHOR, VERSION, request,
+            self._verify, len(body), self._device), body)
+        gen.sent += 1
 
-def register_options():
-    from optparse import OptionParser
-    parser = OptionParser()
-    parser.add_option("-i", "--host", dest="host",
-        default=get_ip(), help="specify host, default is localhost")
-    parser.add_option("-p", "--port", dest="port",
-        type="int",
-        default=58849, help="specify port, default is 58849")
-    parser.add_option("-n", "--num", dest="num",
-        type="int",
-        default=1, help="specify threads num, default is 1")
-
-    (options, args) = parser.parse_args() 
-    return options
 
+    def read_packet(self, header, packet):
+        sent = self._sent.pop(header[3], None)
+        if sent is None:
+            self._gen.unmatched += 1
+            return
+        request, due = sent
+        if ERROR_MARK in packet and is_error(packet[CLIENT_HEADER.size:]):
+            self._gen.errors += 1
+        self._gen.on_reply(self, request, time.time() - due)
 
-def sig_handler(sig, iframe):
-    tornado.ioloop.IOLoop.current().stop()
-    for i in THREADS:
-        i.stop()
-    logging.info('stop ...')
-
-
-class Client(Thread):
-    clients = set()
-    def __init__(self, ip, port):
-        Thread.__init__(self) 
-        Client.clients.add(self)
-        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._address = (ip, port)
-        self._addr_str = ip + ':' + str(port)
-
-        self._stream = ''
-        self._stop = False
-
-
-    def run(self):
-        while not self._stop:
-            try:
-                self._sock.connect(self._address)
-                logging.info('new client connection %d to %s' %
-                    (len(Client.clients), self._addr_str))
-                break
-            except socket.error, arg:
-                (errno, err_msg) = arg
-                logging.error('connect to server %s failed: %s, errno=%d' %
-                    (self._addr_str, err_msg, errno))
-            time.sleep(1)
-
-        self._stream = tornado.iostream.IOStream(self._sock)
-        self._stream.set_close_callback(self.on_close)
-        
-        self._stream.read_bytes(24, self.read_header)
 
-        while not self._stop:
-            self.send()
-            time.sleep(0.1)
+    def on_close(self):
+        gen = self._gen
+        if self._connected:
+            self._connected = False
+            gen.lost += len(self._sent)
+            gen.on_disconnect(self)
+        else:
+            gen.failed += 1
+            logging.debug('connect to %s:%d failed: %s', self._address[0],
+                self._address[1], self._stream.error)
+        self._sent.clear()
+
+
+class LoadGenerator(object):
+
+    def __init__(self, opts, mix):
+        self.opts = opts
+        self.mix = mix
+        self.clients = []
+        self.connected = []
+        self.sent = 0
+        self.replies = 0
+        self.unmatched = 0 # replies whose verify was never sent
+        self.errors = 0 # error replies of route, eg. no business server
+        self.lost = 0 # outstanding requests of closed connections
+        self.failed = 0 # connections never established
+        self.latency = Histogram()
+        self.latencies = dict((request, Histogram()) for request in mix.codes)
+
+        self._running = False
+        self._stopped = False
+        self._measuring = False
+        self._started = 0 # of the load, warm up included
+        self._start = 0 # of the measurement, after warm up
+        self._due = 0 # open loop: requests scheduled since started
+        self._next = 0 # open loop: round robin position
+        self._last = (0, 0, 0)
+        self._measured = 0 # replies until the end of the measurement
+
+
+    def connect(self):
+        """open connections at --connect-rate, do not flood the accept queue"""
+        opts = self.opts
+        ports = [(BOX_PORT, opts.box), (APP_PORT, opts.app), (ERP_PORT, opts.erp)]
+        addresses = []
+        for port, num in ports:
+            addresses.extend([(opts.host, port)] * num)
+
+        io_loop = IOLoop.current()
+        batch = max(1, opts.connect_rate / 100)
+
+        def connect_batch(offset):
+            for i in xrange(offset, min(offset + batch, len(addresses))):
+                self.clients.append(Client(self, addresses[i], opts.device + i))
+            if offset + batch < len(addresses):
+                io_loop.add_timeout(io_loop.time() + 0.01, connect_batch, offset + batch)
+            else:
+                logging.info('%d connections opened', len(addresses))
+
+        connect_batch(0)
+
+
+    def start(self):
+        io_loop = IOLoop.current()
+        if self._stopped:
+            return
+        self._running = True
+        self._started = time.time()
+        self._last = (self._started, self.sent, self.replies)
+        logging.info('start %s loop load, warm up %d s, measure %d s',
+            'open' if self.opts.rate else 'closed', self.opts.warmup, self.opts.duration)
+
+        if self.opts.rate:
+            self._send_timer = PeriodicCallback(self.send_due, SEND_INTERVAL * 1000)
+            self._send_timer.start()
+        else:
+            for client in self.connected:
+                self.fill(client)
+
+        self._report_timer = PeriodicCallback(self.report, REPORT_INTERVAL * 1000)
+        self._report_timer.start()
+        io_loop.add_timeout(self._started + self.opts.warmup, self.measure)
+
+
+    def measure(self):
+        """forget the warm up, stop after --duration"""
+        if self._stopped:
+            return
+        self._measuring = True
+        self._start = time.time()
+        self._last = (self._start, 0, 0)
+        self.sent = self.replies = self.unmatched = self.errors = self.lost = 0
+        self.latency = Histogram()
+        self.latencies = dict((request, Histogram()) for request in self.mix.codes)
+        IOLoop.current().add_timeout(self._start + self.opts.duration, self.stop)
 
 
     def stop(self):
-        self._stop = True
+        """stop sending, give outstanding requests --timeout to come back"""
+        io_loop = IOLoop.current()
+        if self._stopped:
+            return
+        self._stopped = True
+        if not self._running:
+            # interrupted before the load started
+            io_loop.stop()
+            return
+        self._running = False
+        self._end = time.time()
+        self._measured = self.replies if self._measuring else 0
+        if not self._measuring:
+            self._start = self._end
+        if self.opts.rate:
+            self._send_timer.stop()
+        io_loop.add_timeout(self._end + self.opts.timeout, self.finish)
 
 
-    def read_header(self, header):
-        from socket import ntohl
-        # extract route header
-        parts = unpack("6I", header)
-        parts = [ntohl(x) for x in parts]
-        
-        author, version, request, verify, length, device_id = parts
+    def finish(self):
+        self._report_timer.stop()
+        self.summary()
+        IOLoop.current().stop()
 
-        logging.debug('read header:(%d, %d, %d, %d, %d, %d)'
-            % (author, version, request,
-               verify, length, device_id))
 
-        self._stream.read_bytes(length, self.read_body)
+    def on_connect(self, client):
+        self.connected.append(client)
+        if self._running and not self.opts.rate:
+            self.fill(client)
 
 
-    def read_body(self, body):
-        logging.debug('read body: %s' % body)
- 
+    def on_disconnect(self, client):
+        self.connected.remove(client)
 
-    def send(self):
-        body = 'hello world'
-        orig = [17, 100, 10001, 65536, len(body), 520]
-        elems = [socket.htonl(x) for x in orig]
-        header = pack('6I', elems[0], elems[1], elems[2],
-                            elems[3], elems[4], elems[5])
-        msg = header + body
-        try:
-            self._stream.write(msg)
-        except socket.error, arg:
-            (errno, err_msg) = arg
-            logging.error('send msg to server failed: %s, errno=%d' % (err_msg, errno))
+
+    def fill(self, client):
+        """closed loop: keep --concurrency requests outstanding"""
+        now = time.time()
+        for i in xrange(self.opts.concurrency - client.get_outstanding()):
+            client.send(now)
+
+
+    def send_due(self):
+        """open loop: send every request due by now, round robin over connections"""
+        connected = self.connected
+        if not connected:
             return
-        
-        header_str = ', '.join([str(x) for x in orig])
-        logging.debug('send header: (%d : %s) to %s:%d' % (len(header), header_str,
-            self._address[0], self._address[1]))
-        logging.debug('send body: (%d : %s) to %s:%d' % (len(body), body, 
-            self._address[0], self._address[1]))
-            
+        elapsed = time.time() - self._started
+        rate = float(self.opts.rate)
+        target = int(elapsed * rate)
+        while self._due < target:
+            self._next = (self._next + 1) % len(connected)
+            connected[self._next].send(self._started + self._due / rate)
+            self._due += 1
+
+
+    def on_reply(self, client, request, latency):
+        self.replies += 1
+        if self._measuring:
+            self.latency.record(latency)
+            self.latencies[request].record(latency)
+        if self._running and not self.opts.rate:
+            client.send(time.time())
+
+
+    def report(self):
+        now = time.time()
+        last, sent, replies = self._last
+        elapsed = now - last
+        self._last = (now, self.sent, self.replies)
+        if elapsed <= 0:
+            return
+        outstanding = sum(client.get_outstanding() for client in self.connected)
+        logging.info('connections %d, sent %.0f/s, replies %.0f/s, outstanding %d',
+            len(self.connected), max(0, self.sent - sent) / elapsed,
+            max(0, self.replies - replies) / elapsed, outstanding)
+
+
+    def summary(self):
+        duration = self._end - self._start
+        outstanding = sum(client.get_outstanding() for client in self.connected)
+        result = {
+            'connections' : len(self.connected),
+            'failed' : self.failed,
+            'mode' : 'open' if self.opts.rate else 'closed',
+            'rate' : self.opts.rate,
+            'concurrency' : self.opts.concurrency,
+            'duration' : duration,
+            'sent' : self.sent,
+            'replies' : self.replies,
+            'unmatched' : self.unmatched,
+            'errors' : self.errors,
+            'lost' : self.lost + outstanding,
+            'throughput' : self._measured / duration if duration > 0 else 0,
+            'latency' : self.latency.snapshot(),
+            'requests' : dict((str(request), histogram.snapshot())
+                for request, histogram in self.latencies.iteritems()
+                if histogram.count),
+        }
+
+        latency = result['latency']
+        logging.info('%d connections (%d failed), %s loop, %.1f s',
+            result['connections'], self.failed, result['mode'], duration)
+        logging.info('sent %d, replies %d, errors %d, unmatched %d, lost %d',
+            self.sent, self.replies, self.errors, self.unmatched, result['lost'])
+        if latency['count']:
+            logging.info('throughput %.0f/s, latency ms: mean %.3f p50 %.3f p99 %.3f p999 %.3f max %.3f',
+                result['throughput'], latency['mean'] * 1000, latency['p50'] * 1000,
+                latency['p99'] * 1000, latency['p999'] * 1000, latency['max'] * 1000)
+
+        if self.opts.output:
+            with open(self.opts.output, 'w') as f:
+                json.dump(result, f, indent=4, sort_keys=True)
+        return result
+
+
+def raise_fd_limit(num):
+    """every connection needs one file descriptor"""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    want = num + 1024
+    if soft < want:
+        if hard != resource.RLIM_INFINITY:
+            want = min(want, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (want, hard))
+        if want < num + 1024:
+            logging.warning('file descriptor limit %d, some connections will fail', want)
+
+
+def sig_handler(sig, frame):
+    IOLoop.current().add_callback_from_signal(GENERATOR.stop)
 
-    def on_close(self):
-        logging.debug('disconnected from %s:%d' % (len(header), header_str))
-        self._stream.close()
+
+def register_options():
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option("-i", "--host", dest="host",
+        default=get_ip(), help="specify host, default is local ip")
+    parser.add_option("-n", "--num", "--box", dest="box",
+        type="int",
+        default=1, help="specify box connections, default is 1")
+    parser.add_option("--app", dest="app",
+        type="int",
+        default=0, help="specify app connections, default is 0")
+    parser.add_option("--erp", dest="erp",
+        type="int",
+        default=0, help="specify erp connections, default is 0")
+    parser.add_option("--device", dest="device",
+        type="int",
+        default=520, help="specify device id of first connection, default is 520")
+    parser.add_option("-m", "--mix", dest="mix",
+        default='', help="specify request mix, eg. 10001=5,10004=1, default is all codes of route.ini")
+    parser.add_option("-c", "--config", dest="config",
+        default=os.path.join(ROOT, 'route.ini'), help="specify route.ini to draw codes from")
+    parser.add_option("-r", "--rate", dest="rate",
+        type="int",
+        default=0, help="specify requests per second for open loop, default 0 is closed loop")
+    parser.add_option("-C", "--concurrency", dest="concurrency",
+        type="int",
+        default=1, help="specify outstanding requests per connection in closed loop, default is 1")
+    parser.add_option("-d", "--duration", dest="duration",
+        type="float",
+        default=10, help="specify seconds to measure, default is 10")
+    parser.add_option("-w", "--warmup", dest="warmup",
+        type="float",
+        default=2, help="specify seconds to warm up before measuring, default is 2")
+    parser.add_option("-T", "--timeout", dest="timeout",
+        type="float",
+        default=2, help="specify seconds to wait for outstanding replies, default is 2")
+    parser.add_option("--connect-rate", dest="connect_rate",
+        type="int",
+        default=5000, help="specify connections opened per second, default is 5000")
+    parser.add_option("-o", "--output", dest="output",
+        default='', help="specify file to write the json result")
+    parser.add_option("-l", "--log", dest="log",
+        default=get_default_log(), help="specify log name")
+    parser.add_option("-D", "--debug", dest="debug",
+        action='store_true',
+        default=False, help="enable debug")
+
+    (options, args) = parser.parse_args()
+    return options
 
 
 if __name__ == '__main__':
 
-    init_log()
-
     opts = register_options()
 
-    logging.info('start %d threads to server %s:%d ...' % (opts.num, opts.host, opts.port))
+    init_log(opts.log, opts.debug)
+
+    mix = Mix(parse_mix(opts.mix, opts.config))
+    num = opts.box + opts.app + opts.erp
+    raise_fd_limit(num)
 
-    for i in xrange(opts.num):
-        cli = Client(opts.host, opts.port)
-        THREADS.append(cli)
+    logging.info('%d box, %d app, %d erp connections to %s, %d request codes',
+        opts.box, opts.app, opts.erp, opts.host, len(mix.codes))
 
-    for i in THREADS:
-        i.setDaemon(True)
-        i.start()
+    GENERATOR = LoadGenerator(opts, mix)
 
     signal.signal(signal.SIGTERM, sig_handler)
     signal.signal(signal.SIGINT, sig_handler)
 
-    tornado.ioloop.IOLoop.current().start()
-
-    logging.info('stop ...')
-
+    io_loop = IOLoop.current()
+    GENERATOR.connect()
+    # start once connections had the time to open
+    io_loop.add_timeout(io_loop.time() + float(num) / opts.connect_rate + 0.5,
+        GENERATOR.start)
+    io_loop.start()
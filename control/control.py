@@ -15,7 +15,10 @@ from tornado.ioloop import IOLoop
 ROOT = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(ROOT, '../generic'))
 from utility import init_log, get_default_log, get_ip 
-from business import Business
+from business import Business, handler
+from framing import FrameWriter
+from executor import EXECUTORS
+from admin import AdminServer
 
 
 def sig_handler(sig, frame):
@@ -31,9 +34,16 @@ class Control(Business):
         Business.__init__(self, 'control', ip, port)
 
 
-    # overwrite process method
-    def process(self):
+    def new_connection(self, port):
+        return Control(self._address[0], port)
+
+
+    # requests route.ini forwards to control
+    @handler(10000, 10001, 10002, 10004, 10018, 10019, 10027, 10028, 10029,
+        10030, 10042, 10043, 20001, 20002, 20003, 20004, 20100)
+    def process(self, request):
         logging.debug('in control process ...')
+        return 'hi~'
 
 
     def on_close(self):
@@ -54,6 +64,29 @@ def register_options():
         default=1, help="specify threads num, default is 10")
     parser.add_option("-l", "--log", dest="log",
         default=get_default_log(), help="specify log name")
+    parser.add_option("-f", "--flush-delay", dest="flush_delay",
+        type="float",
+        default=0, help="specify max ms a write is delayed for batching, default is end of ioloop iteration")
+    parser.add_option("-L", "--log-level", dest="levels",
+        default='', help="specify log level of modules, eg. connection=debug,bconnection=info")
+    parser.add_option("-t", "--trace", dest="rates",
+        default='', help="specify traced fraction of packets per request, eg. 10001=0.01,default=1")
+    parser.add_option("-c", "--config", dest="config",
+        default=os.path.join(ROOT, '../route.ini'), help="specify route.ini to check handlers against")
+    parser.add_option("-e", "--executor", dest="executor",
+        choices=EXECUTORS,
+        default='inline', help="specify where requests are handled: inline, thread or process")
+    parser.add_option("-w", "--workers", dest="workers",
+        type="int",
+        default=0, help="specify threads or processes of executor, default is cpu count")
+    parser.add_option("-o", "--ordered", dest="ordered",
+        action='store_true',
+        default=False, help="handle requests of one device in order")
+    parser.add_option("-a", "--admin-port", dest="admin_port",
+        type="int",
+        default=0, help="specify admin port for metrics, default 0 is disabled")
+    parser.add_option("-A", "--admin-host", dest="admin_host",
+        default='127.0.0.1', help="specify host of the admin port, it has no auth, default is 127.0.0.1")
     parser.add_option("-d", "--debug", dest="debug",
         action='store_true',
         default=False, help="enable debug")
@@ -66,7 +99,10 @@ if __name__ == '__main__':
 
     opts = register_options()
 
-    init_log(opts.log, opts.debug)
+    init_log(opts.log, opts.debug, opts.levels, opts.rates)
+    FrameWriter.max_delay = opts.flush_delay / 1000.0
+    Business.set_executor(opts.executor, opts.workers or None, opts.ordered)
+    Control.check_handlers('control', opts.config)
 
     signal.signal(signal.SIGTERM, sig_handler)
     signal.signal(signal.SIGINT, sig_handler)
@@ -75,6 +111,10 @@ if __name__ == '__main__':
 
     for i in xrange(opts.num):
         Control(opts.host, opts.port)
+
+    if opts.admin_port:
+        AdminServer().listen(opts.admin_port, opts.admin_host)
+        logging.info('listen %s port %d for admin ...' % (opts.admin_host, opts.admin_port))
     
     IOLoop.current().start()
 
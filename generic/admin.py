@@ -0,0 +1,72 @@
+#coding=utf-8
+
+"""admin port: one command per line, one json reply per line
+
+eg. echo metrics | nc localhost 7666
+"""
+
+__author__ = 'Yingqi Jin <jinyingqi@luoha.com>'
+
+__all__ = ['AdminServer']
+
+import json
+import logging
+from tornado.tcpserver import TCPServer
+from tornado.iostream import StreamClosedError
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# longest command line accepted
+MAX_LINE = 1024
+
+
+class AdminServer(TCPServer):
+
+    def __init__(self):
+        TCPServer.__init__(self)
+        self.commands = {
+            'metrics' : registry.snapshot,
+            'help' : lambda: sorted(self.commands),
+        }
+
+
+    def add_command(self, name, fn):
+        """fn() returns the json serializable reply of command name"""
+        self.commands[name] = fn
+
+
+    def handle_stream(self, stream, address):
+        AdminConnection(stream, self.commands)
+
+
+class AdminConnection(object):
+
+    def __init__(self, stream, commands):
+        self._stream = stream
+        self._commands = commands
+        self.read_command()
+
+
+    def read_command(self):
+        try:
+            self._stream.read_until('\n', self.run_command, max_bytes=MAX_LINE)
+        except StreamClosedError:
+            pass
+
+
+    def run_command(self, line):
+        command = line.strip()
+        if command in self._commands:
+            try:
+                reply = {'status' : 0, 'result' : self._commands[command]()}
+            except Exception, e:
+                logger.exception('admin command %s failed', command)
+                reply = {'status' : 1, 'reason' : str(e)}
+        else:
+            reply = {'status' : 1, 'reason' : 'unsupported command %s' % command}
+
+        if not self._stream.closed():
+            self._stream.write(json.dumps(reply) + '\n')
+            self.read_command()
@@ -1,6 +1,6 @@
 #coding=utf-8
 """basic business template: it supports Asynchronous IO using tornado ioloop/iostream
-subclass inherits Business class and overwrite the routinue process
+subclass inherits Business class and overwrite the routinue handle
 eg.
 #control.py
 class Control(Business):
@@ -8,38 +8,150 @@ class Control(Business):
     def __init__(self, ip='localhost', port=58849):
         Business.__init__('control', ip, port)
 
-    def process(self):
+    @handler(10001, 10002)
+    def open_status(self, request):
         #TODO
-        pass
+        return json.dumps({'status' : 0, 'room' : request.get_json()['room']})
+
+Every packet becomes an immutable Request. Its handler, a method marked
+with @handler for its request code, runs on the ioloop (inline), in a
+thread pool or in a process pool, see Business.set_executor, and
+returns the reply body, None for no reply, or a Future of it. The body
+is only decoded by request.get_json(), forwarded bodies never are.
+Replies are written on the ioloop as they complete, so one module
+keeps many requests in flight. With ordered set, the requests of one
+device are handled one after another.
+
+Modules ask route for heartbeats at register: every interval seconds
+each connection sends one, and a connection route has been silent on
+for idle_timeout seconds is closed, on_close tells the subclass.
 """
 
 __author__ = 'Yingqi Jin <jinyingqi@luoha.com>'
 
+import os
 import sys
 import time 
 import json
 import socket
 import logging
-from struct import pack, unpack
+import functools
+from collections import namedtuple, deque
 import tornado.iostream
 import tornado.ioloop
+from tornado.concurrent import is_future
 
 from utility import BUSINESS_REGISTER_HEADER_LENGTH, BUSINESS_REGISTER_FEEDBACK_HEADER_LENGTH
 from utility import BUSINESS_HEADER_LENGTH, BUSINESS_FEEDBACK_HEADER_LENGTH, CLIENT_HEADER_LENGTH
+from utility import get_unix_socket, is_local
+from framing import FrameReader, FrameWriter, CLIENT_HEADER, ROUTE_HEADER, ROUTE_LENGTH_INDEX
+from framing import REGISTER_HEADER, FEEDBACK_HEADER, COMMAND_ID
+from framing import encode_ip, decode_ip, encode_timestamp, decode_timestamp
+from framing import ROUTE_HEADER_V2, ROUTE_V2_LENGTH_INDEX, COMMAND_ID_V2, FLAG_CHECKSUM
+from framing import MAX_PROTOCOL, decode_ip16, get_checksum
+from logqueue import tracing
+from metrics import registry, Traffic, Histogram
+from executor import create_executor, process_request
+
+logger = logging.getLogger(__name__)
+
+# traffic and time from read to reply of each request code
+REQUESTS = registry.family('request', Traffic)
+PROCESS = registry.family('process', Histogram)
+
+# body starts after route header and client header
+BODY_OFFSET = ROUTE_HEADER.size + CLIENT_HEADER.size
+BODY_OFFSET_V2 = ROUTE_HEADER_V2.size + CLIENT_HEADER.size
+
+# seconds between looks at the heartbeats of all connections
+BEAT_TICK = 1.0
+
+
+def error_reply(reason):
+    return json.dumps({'status' : 1, 'reason' : reason})
+
+
+# reply of requests whose handler raised
+ERROR_REPLY = error_reply('business internal error')
+
+
+class Request(namedtuple('Request', ['device_type', 'device_id', 'md5',
+        'raw_timestamp', 'raw_ip', 'author', 'version', 'request', 'verify',
+        'device', 'body', 'received', 'protocol', 'trace'])):
+    """one packet forwarded by route: route header, client header and body
+
+    Timestamp and ip stay as route sent them and are only decoded when
+    asked for, a reply sends them back as they are. body excludes the
+    client header, received is the time it was read and trace whether it
+    is traced at DEBUG, sampled once then. In protocol 2 md5 is the
+    request id, an int, and timestamp the seconds of the monotonic clock
+    of route.
+    """
+    __slots__ = ()
+
+    @property
+    def timestamp(self):
+        if self.protocol > 1:
+            return self.raw_timestamp / 1000000.0
+        return decode_timestamp(self.raw_timestamp)
+
+
+    @property
+    def ip(self):
+        if self.protocol > 1:
+            return decode_ip16(self.raw_ip)
+        return decode_ip(self.raw_ip)
+
+
+    def get_json(self):
+        """decode body, each call decodes again: keep the result"""
+        return json.loads(self.body)
+
+
+    def get_device_key(self):
+        return (self.device_type, self.device)
+
+
+def handler(*requests):
+    """mark a method of a Business subclass as the handler of requests
+
+    The method is called with the Request and returns what handle does.
+    """
+    def mark(fn):
+        fn.requests = getattr(fn, 'requests', ()) + requests
+        return fn
+    return mark
 
 
 class Business(object):
     clients = set()
+    executor = None # runs handle() off the ioloop, None runs it inline
+    executor_name = 'inline'
+    ordered = False # handle the requests of one device one by one
+    protocol = MAX_PROTOCOL # asked for at register, route may agree on less
+    checksum = False # crc32 of bodies in protocol 2
+    max_length = 16 * 1024 * 1024 # longer packets from route close the connection
+    transport = 'auto' # tcp, unix, or auto: unix if route runs on this host
+    heartbeat = True # asked for at register, route tells interval and idle_timeout
+    beater = None # PeriodicCallback of the heartbeats of all connections
+    beaten = 0 # time beat last ran
+    devices = {} # device key : requests waiting for the one in process
 
     def __init__(self, function='control', ip='localhost', port=58849):
         Business.clients.add(self)
 
-        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._ip = ip
         self._port = port
-        self._addr_str = ip + ':' + str(port)
         self._address = (ip, port)
+        self.open_socket()
         self._function = function
+        self._registered = False # route accepted the register info
+        self._protocol = 1 # of route <-> business packets, agreed on at register
+        self._checksum = False
+        self._loaded = None # request of load_request
+        self._interval = 0 # seconds between heartbeats, 0 sends none
+        self._idle_timeout = 0 # seconds route may be silent, 0 forever
+        self._beaten = 0 # time of the last heartbeat sent
 
         # route server packet header
         self._header_length = BUSINESS_HEADER_LENGTH
@@ -62,20 +174,43 @@ class Business(object):
         self.connect()
 
 
+    def open_socket(self, transport=None):
+        """socket of transport to route, Business.transport by default"""
+        transport = transport or self.transport
+        path = get_unix_socket(self._port)
+        if transport == 'unix' or (transport == 'auto' and
+                is_local(self._address[0]) and os.path.exists(path)):
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._endpoint = path
+            self._addr_str = path
+        else:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._endpoint = self._address
+            self._addr_str = '%s:%d' % self._address
+
+
     def connect(self):
         try:
-            self._sock.connect(self._address)
-            logging.info('%s module connect to router %s successfully' %
-                (self._function, self._addr_str))
-            self._stream = tornado.iostream.IOStream(self._sock)
-            self._stream.set_close_callback(self.on_close)
-        
-            self.send_register()
+            self._sock.connect(self._endpoint)
         except socket.error, arg:
             (errno, err_msg) = arg
-            logging.error('%s module connect to router %s failed: %s:%d' %
-                (self._function, self._addr_str, err_msg, errno))
-            self.on_close()
+            logger.error('%s module connect to router %s failed: %s:%d',
+                self._function, self._addr_str, err_msg, errno)
+            if self._sock.family != socket.AF_UNIX or self.transport == 'unix':
+                self.on_close()
+                return
+            # eg. route of another user, tcp still works
+            self._sock.close()
+            self.open_socket('tcp')
+            self.connect()
+            return
+
+        logger.info('%s module connect to router %s successfully',
+            self._function, self._addr_str)
+        self._stream = tornado.iostream.IOStream(self._sock)
+        self._stream.set_close_callback(self.on_close)
+        self._writer = FrameWriter(self._stream)
+        self.send_register()
 
 
     def send_register(self):
@@ -89,6 +224,11 @@ class Business(object):
         body = {}
         body['function'] = self._function 
         body['timestamp'] = time.time()
+        if self.protocol > 1:
+            body['protocol'] = self.protocol
+            body['checksum'] = self.checksum
+        if self.heartbeat:
+            body['heartbeat'] = True
         msg = json.dumps(body)
 
         verify = hashlib.md5()
@@ -96,100 +236,376 @@ class Business(object):
         md5 = verify.hexdigest()
 
         msg = json.dumps(body)
-        header = pack("I32s", socket.htonl(len(msg)), md5)
-        self._stream.write(header + msg)
-        logging.debug('send register info: header: %d, %s body:%s' % (len(msg), md5, msg))
+        header = REGISTER_HEADER.pack(len(msg), md5)
+        self._writer.write(header, msg)
+        logger.debug('send register info: header: %d, %s body:%s', len(msg), md5, msg)
 
-        self._stream.read_bytes(
-            BUSINESS_REGISTER_FEEDBACK_HEADER_LENGTH,
-            self.read_register_feedback_header)
+        self._reader = FrameReader(self._stream, FEEDBACK_HEADER, 0,
+            self.read_register_feedback)
+        self._reader.set_limits(self.max_length)
+        self._reader.start()
 
 
-    def read_register_feedback_header(self, header):
-        self._length = socket.ntohl(unpack('I', header)[0])
-        self._stream.read_bytes(self._length, self.read_register_feedback_body)
-
-
-    def read_register_feedback_body(self, body_str):
-        body = json.loads(body_str)
+    def read_register_feedback(self, header, packet):
+        self._length = header[0]
+        body = json.loads(packet[BUSINESS_REGISTER_FEEDBACK_HEADER_LENGTH:])
         if 'status' not in body:
-            logging.error('status field not in body')
+            logger.error('status field not in body')
             return
         status = body['status'] 
 
         if status == 0:
-            logging.info('register successfully : header:%d body:%s' % (self._length, body))
+            self._registered = True
+            logger.info('register successfully : header:%d body:%s', self._length, body)
+            # route runs several processes, each one listens on its own
+            # port after the first one: connect to all of them
+            if body.get('worker', 0) == 0:
+                for worker in xrange(1, body.get('workers', 1)):
+                    self.new_connection(self._port + worker)
         else:
-            logging.info('register failed')
+            logger.info('register failed')
             self.on_close()
 
-        self._stream.read_bytes(BUSINESS_HEADER_LENGTH, self.read_packet_header)
+        # a route not knowing protocol 2 does not answer protocol
+        self._protocol = body.get('protocol', 1)
+        self._checksum = bool(body.get('checksum'))
+        # nor heartbeat, then no heartbeats are sent and route never closes us
+        heartbeat = body.get('heartbeat')
+        if heartbeat and self._registered:
+            self._interval = heartbeat.get('interval', 0)
+            self._idle_timeout = heartbeat.get('idle_timeout', 0)
+            self._beaten = time.time()
+            Business.start_heartbeats()
+        if self._protocol > 1:
+            self._reader.set_header(ROUTE_HEADER_V2, ROUTE_V2_LENGTH_INDEX,
+                self.read_packet_v2)
+        else:
+            self._reader.set_header(ROUTE_HEADER, ROUTE_LENGTH_INDEX,
+                self.read_packet)
 
 
-    def read_packet_header(self, header):
-        from socket import ntohl
-        # extract route header
-        self._header = header 
-        parts = unpack("II32sdII", self._header)
-        (self._device_type, self._device_id, self._md5,
-            self._timestamp, self._length, self._ip) = parts
+    def read_packet(self, header, packet):
+        device_type, device_id, md5, timestamp, route_length, ip = header
+        if md5 == COMMAND_ID:
+            self.run_command(packet[BUSINESS_HEADER_LENGTH:])
+            return
+        author, version, code, verify, length, device = CLIENT_HEADER.unpack_from(
+            packet, BUSINESS_HEADER_LENGTH)
+        request = Request(device_type, device_id, md5, timestamp, ip,
+            author, version, code, verify, device, packet[BODY_OFFSET:],
+            time.time(), 1, tracing(logger, code))
+
+        if request.trace:
+            logger.debug('read header:(%d, %d, %s, %.4f, %d, %s)',
+                device_type, device_id, md5, request.timestamp,
+                route_length, request.ip)
+            logger.debug('read body: header(%d, %d, %d, %d, %d, %d) body:%s',
+                author, version, code, verify, length, device, request.body)
+
+        REQUESTS[code].read(len(packet))
+        self.dispatch(request)
+
+
+    def read_packet_v2(self, header, packet):
+        device_type, flags, route_length, key, timestamp, ip, checksum = header
+        if flags & FLAG_CHECKSUM and get_checksum(
+                packet[ROUTE_HEADER_V2.size:]) != checksum:
+            logger.error('drop packet %d: checksum mismatch', key)
+            return
+        if key == COMMAND_ID_V2:
+            self.run_command(packet[ROUTE_HEADER_V2.size:])
+            return
+        author, version, code, verify, length, device = CLIENT_HEADER.unpack_from(
+            packet, ROUTE_HEADER_V2.size)
+        request = Request(device_type, 1, key, timestamp, ip,
+            author, version, code, verify, device, packet[BODY_OFFSET_V2:],
+            time.time(), 2, tracing(logger, code))
+
+        if request.trace:
+            logger.debug('read header:(%d, %d, %d, %d, %.6f, %s)',
+                device_type, flags, route_length, key, request.timestamp,
+                request.ip)
+            logger.debug('read body: header(%d, %d, %d, %d, %d, %d) body:%s',
+                author, version, code, verify, length, device, request.body)
 
-        # convert integers from network to host byte order
-        self._device_type = ntohl(self._device_type)
-        self._device_id = ntohl(self._device_id)
-        self._length = ntohl(self._length)
-        self._ip = socket.inet_ntoa(pack('I', ntohl(self._ip)))
+        REQUESTS[code].read(len(packet))
+        self.dispatch(request)
 
-        logging.debug('read header:(%d, %d, %s, %.4f, %d, %s)'
-            % (self._device_type, self._device_id, self._md5,
-               self._timestamp, self._length, self._ip))
 
-        self._stream.read_bytes(self._length, self.read_packet_body)
+    def run_command(self, body):
+        """command of route, only heartbeats so far: the packet was enough"""
+        try:
+            command = json.loads(body)['cmd']
+        except (ValueError, TypeError, KeyError):
+            logger.warning('drop invalid command %r from %s', body[:256], self._addr_str)
+            return
+        if command != 'heartbeat':
+            logger.warning('drop unsupported command %s from %s', command, self._addr_str)
 
 
-    def read_packet_body(self, body):
-        from socket import ntohl
-        self._body = body 
+    @classmethod
+    def start_heartbeats(cls):
+        if Business.beater is None:
+            Business.beater = tornado.ioloop.PeriodicCallback(Business.beat,
+                BEAT_TICK * 1000)
+            Business.beater.start()
 
-        # unpack body header
-        parts = unpack('6I', self._body[:self._client_header_length])
-        parts = [ntohl(x) for x in parts] 
-        (self._author, self._version, self._request,
-            self._verify, self._length, self._device) = parts
- 
-        body1 = self._body[self._client_header_length:]
-        logging.debug('read body: header(%d, %d, %d, %d, %d, %d) body:%s'
-            % (self._author, self._version, self._request,
-               self._verify, self._length, self._device, body1))
 
-        # all logic will be handled here
+    @classmethod
+    def beat(cls):
+        """send heartbeats due, close connections route is silent on
+
+        Any data read counts, part of a long body too. Nothing is closed
+        when beat runs late: the ioloop was blocked and the packets of
+        route may wait unread in the sockets.
+        """
+        now = time.time()
+        late = Business.beaten and now - Business.beaten > 2 * BEAT_TICK
+        Business.beaten = now
+        for conn in list(Business.clients):
+            if not conn._registered or not conn._interval:
+                continue
+            silent = now - conn._reader.get_read_time()
+            if not late and conn._idle_timeout and silent >= conn._idle_timeout:
+                logger.warning('%s module close %s: route silent for %.0f s',
+                    conn._function, conn._addr_str, silent)
+                conn._stream.close()
+                continue
+            if now - conn._beaten >= conn._interval:
+                conn._beaten = now
+                conn.send_command({'cmd' : 'heartbeat'})
+
+
+    @classmethod
+    def set_executor(cls, name, workers=None, ordered=False):
+        """inline, thread or process, see executor.py"""
+        if Business.executor is not None:
+            Business.executor.shutdown()
+        Business.executor = create_executor(name, workers)
+        Business.executor_name = name
+        Business.ordered = ordered
+
+
+    def dispatch(self, request):
+        if Business.ordered:
+            key = request.get_device_key()
+            waiting = Business.devices.get(key)
+            if waiting is not None:
+                waiting.append((self, request))
+                return
+            Business.devices[key] = deque()
+        self.submit(request)
+
+
+    def submit(self, request):
+        executor = Business.executor
+        if executor is None:
+            try:
+                result = self.handle(request)
+            except Exception:
+                logger.exception('%s module failed to handle request %d',
+                    self._function, request.request)
+                result = ERROR_REPLY
+        elif Business.executor_name == 'process':
+            result = executor.submit(process_request, self.__class__, request)
+        else:
+            result = executor.submit(self.handle, request)
+
+        if is_future(result):
+            tornado.ioloop.IOLoop.current().add_future(result,
+                functools.partial(self.on_handled, request))
+        else:
+            self.finish(request, result)
+
+
+    def on_handled(self, request, future):
+        try:
+            result = future.result()
+        except Exception, e:
+            logger.error('%s module failed to handle request %d: %s',
+                self._function, request.request, e)
+            result = ERROR_REPLY
+        self.finish(request, result)
+
+
+    def finish(self, request, body):
+        if body is not None:
+            self.reply(request, body)
+        PROCESS[request.request].record(time.time() - request.received)
+
+        if Business.ordered:
+            key = request.get_device_key()
+            waiting = Business.devices[key]
+            if waiting:
+                conn, request = waiting.popleft()
+                conn.submit(request)
+            else:
+                del Business.devices[key]
+
+
+    @classmethod
+    def get_handlers(cls):
+        """request : method marked by @handler, built once per class"""
+        handlers = cls.__dict__.get('_handlers')
+        if handlers is None:
+            handlers = {}
+            for klass in reversed(cls.__mro__):
+                for fn in klass.__dict__.itervalues():
+                    for request in getattr(fn, 'requests', ()):
+                        handlers[request] = fn
+            cls._handlers = handlers
+        return handlers
+
+
+    @classmethod
+    def check_handlers(cls, function, ini_file):
+        """warn about requests route.ini forwards to function without a handler
+
+        and about handlers of requests forwarded elsewhere.
+        """
+        import ConfigParser
+        parser = ConfigParser.ConfigParser()
+        if not parser.read(ini_file) or not parser.has_section(function):
+            logger.warning('no [%s] section in %s', function, ini_file)
+            return
+        routed = set(int(request) for request in parser.options(function))
+        handled = set(cls.get_handlers())
+        for request in sorted(routed - handled):
+            logger.warning('%s module has no handler of request %d', function, request)
+        for request in sorted(handled - routed):
+            logger.warning('request %d of %s module is not routed to it', request, function)
+
+
+    # child class overload this routine or mark handlers with @handler
+    def handle(self, request):
+        """return reply body of request, None for no reply or a Future of it
+
+        The default calls the handler of the request code. Classes
+        without handlers get process_packet, which reads the fields of
+        the request from the instance: only right for inline handlers.
+        """
+        handlers = self.get_handlers()
+        fn = handlers.get(request.request)
+        if fn is not None:
+            return fn(self, request)
+        if handlers:
+            logger.warning('%s module has no handler of request %d',
+                self._function, request.request)
+            return error_reply('unsupported request %d' % request.request)
+        self.load_request(request)
         self.process_packet()
 
-        # read next packets
-        self._stream.read_bytes(BUSINESS_HEADER_LENGTH, self.read_packet_header)
 
+    def load_request(self, request):
+        """fields of request as instance attributes for process_packet"""
+        self._loaded = request
+        (self._device_type, self._device_id, self._md5, self._author,
+            self._version, self._request, self._verify, self._device) = (
+            request.device_type, request.device_id, request.md5,
+            request.author, request.version, request.request,
+            request.verify, request.device)
+        self._timestamp = request.timestamp
+        self._ip = request.ip
+        self._length = len(request.body)
+        self._body = CLIENT_HEADER.pack(request.author, request.version,
+            request.request, request.verify, self._length,
+            request.device) + request.body
 
-    # child class overload this routine
+
+    # child class overload this routine if its __init__ differs
+    def new_connection(self, port):
+        """connect one more module instance to route process on port"""
+        return self.__class__(self._function, self._address[0], port)
+
+
+    # former routine of child classes, see handle
     def process_packet(self):
-        logging.debug('process packet ...')
+        logger.debug('process packet ...')
 
         self.send()
 
 
+    def send_command(self, command):
+        """send command to the route process of this connection"""
+        msg = json.dumps(command)
+        if self._protocol > 1:
+            header = self.pack_header_v2(0, COMMAND_ID_V2, 0, '\0' * 16, msg)
+        else:
+            header = ROUTE_HEADER.pack(0, 0, COMMAND_ID, encode_timestamp(time.time()),
+                len(msg), encode_ip('0.0.0.0'))
+        self._writer.write(header, msg)
+
+
+    def pack_header_v2(self, device_type, key, timestamp, ip16, body):
+        if self._checksum:
+            return ROUTE_HEADER_V2.pack(device_type, FLAG_CHECKSUM, len(body),
+                key, timestamp, ip16, get_checksum(body))
+        return ROUTE_HEADER_V2.pack(device_type, 0, len(body), key, timestamp,
+            ip16, 0)
+
+
+    def push(self, target, request, body, **kw):
+        """send body as packet request to clients of every route process
+
+        target is boxes, rooms (rooms=[room, ...]), apps (room=room for
+        the apps of one room), device (device_type='box', device=id) or
+        ip (ip='1.2.3.4'). Call it from the ioloop thread.
+        """
+        self.broadcast(dict(kw, cmd='push', target=target, request=request, body=body))
+
+
+    def invalidate(self, requests=None):
+        """drop replies of requests cached by every route process, all of
+        them if None, eg. after the configuration they return changed
+        """
+        command = {'cmd' : 'invalidate'}
+        if requests is not None:
+            command['requests'] = list(requests)
+        self.broadcast(command)
+
+
+    def broadcast(self, command):
+        """send command to every route process this function registered on"""
+        for conn in Business.clients:
+            if conn._function == self._function and conn._registered:
+                conn.send_command(command)
+
+
+    def reply(self, request, body):
+        """send body back as the reply of request"""
+        if request.protocol > 1:
+            header = self.pack_header_v2(request.device_type, request.md5,
+                request.raw_timestamp, request.raw_ip, body)
+        else:
+            header = ROUTE_HEADER.pack(request.device_type, request.device_id,
+                request.md5, request.raw_timestamp, len(body), request.raw_ip)
+
+        self._writer.write(header, body)
+        REQUESTS[request.request].write(len(header) + len(body))
+        if request.trace:
+            logger.debug('send packet back: header(%d, %d, %s, %.4f, %d, %s) body:%s',
+                request.device_type, request.device_id, request.md5,
+                request.timestamp, len(body), request.ip, body)
+
+
     def send(self, body='hi~'):
-        """send packet back"""
-        from socket import htonl
-        ip = htonl(unpack('I', socket.inet_aton(self._ip))[0])
-        header = pack("2I32sdII", htonl(self._device_type),
-            htonl(self._device_id), self._md5, self._timestamp,
-            htonl(len(body)), ip)
-
-        msg = header + body
-        self._stream.write(msg)
-        logging.debug('send packet back: header(%d, %d, %s, %.4f, %d, %s) body:%s'
-            % (self._device_type, self._device_id, self._md5,
-               self._timestamp, len(body), self._ip, body))
+        """send packet back as the reply of the last packet read"""
+        if self._loaded is not None and self._loaded.protocol > 1:
+            self.reply(self._loaded, body)
+            return
+        header = ROUTE_HEADER.pack(self._device_type, self._device_id,
+            self._md5, encode_timestamp(self._timestamp), len(body),
+            encode_ip(self._ip))
+
+        self._writer.write(header, body)
+        REQUESTS[self._request].write(len(header) + len(body))
+        if self._loaded is not None and self._loaded.trace:
+            logger.debug('send packet back: header(%d, %d, %s, %.4f, %d, %s) body:%s',
+                self._device_type, self._device_id, self._md5,
+                self._timestamp, len(body), self._ip, body)
         
 
     def on_close(self):
-        logging.debug('%s module disconnected' % self._function)
+        self._registered = False
+        Business.clients.discard(self)
+        logger.debug('%s module disconnected', self._function)
@@ -0,0 +1,95 @@
+#coding=utf-8
+
+"""run request handlers off the ioloop
+
+thread: a pool of threads, for handlers blocked on a database or a socket
+process: a pool of processes, for handlers busy with the cpu
+
+Results come back as tornado Futures resolved on the ioloop, so the
+caller writes replies from the ioloop thread only. Only multiprocessing
+of the standard library is needed, concurrent.futures is not.
+"""
+
+__author__ = 'Yingqi Jin <jinyingqi@luoha.com>'
+
+__all__ = ['PoolExecutor', 'HandlerError', 'EXECUTORS', 'create_executor',
+    'process_request']
+
+import traceback
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+# inline runs handlers on the ioloop, they may return a Future (coroutine)
+EXECUTORS = ('inline', 'thread', 'process')
+
+
+class HandlerError(Exception):
+    """exception raised by a handler in a pool, with its traceback"""
+
+
+def run(fn, args):
+    """pool side: never raise, a pool drops the results of exceptions"""
+    try:
+        return True, fn(*args)
+    except Exception:
+        return False, traceback.format_exc()
+
+
+class PoolExecutor(object):
+
+    def __init__(self, pool):
+        self._pool = pool
+
+
+    def submit(self, fn, *args):
+        """run fn(*args) in the pool, return a Future resolved on the ioloop"""
+        future = Future()
+        io_loop = IOLoop.current()
+
+        def done(result):
+            # called from the result thread of the pool
+            io_loop.add_callback(resolve, future, result)
+
+        self._pool.apply_async(run, (fn, args), callback=done)
+        return future
+
+
+    def shutdown(self):
+        self._pool.terminate()
+
+
+def resolve(future, result):
+    ok, value = result
+    if ok:
+        future.set_result(value)
+    else:
+        future.set_exception(HandlerError(value))
+
+
+def create_executor(name, workers=None):
+    """None for inline, workers defaults to the cpu count"""
+    if name not in EXECUTORS:
+        raise ValueError('unsupported executor %s' % name)
+    if name == 'thread':
+        return PoolExecutor(ThreadPool(workers or multiprocessing.cpu_count()))
+    if name == 'process':
+        return PoolExecutor(multiprocessing.Pool(workers))
+    return None
+
+
+# handler instance of each class in a pool process
+_handlers = {}
+
+
+def process_request(cls, request):
+    """process pool side of cls.handle(request)
+
+    Connections do not cross processes: handle runs on an instance of
+    cls that was never connected and must only use request.
+    """
+    handler = _handlers.get(cls)
+    if handler is None:
+        handler = _handlers[cls] = cls.__new__(cls)
+    return handler.handle(request)
@@ -0,0 +1,324 @@
+#coding=utf-8
+
+"""framing engine shared by route and business modules
+
+FrameReader reads whatever the socket has into one growable buffer and
+dispatches every complete frame found in it, instead of two chained
+read_bytes callbacks (header then body) per packet. Headers are parsed
+with precompiled structs straight from the buffer.
+
+FrameWriter collects the frames written to a stream during one ioloop
+iteration and hands them to the stream as one write.
+"""
+
+__author__ = 'Yingqi Jin <jinyingqi@luoha.com>'
+
+__all__ = ['FrameReader', 'FrameWriter', 'CLIENT_HEADER', 'ROUTE_HEADER', 'REGISTER_HEADER',
+    'FEEDBACK_HEADER', 'COMMAND_ID', 'encode_ip', 'decode_ip', 'encode_timestamp',
+    'decode_timestamp', 'ROUTE_HEADER_V2', 'ROUTE_V2_LENGTH_INDEX', 'COMMAND_ID_V2',
+    'FLAG_CHECKSUM', 'MAX_PROTOCOL', 'encode_ip16', 'decode_ip16', 'get_checksum',
+    'get_monotonic_us', 'HEARTBEAT_REQUEST', 'NO_IP']
+
+import time
+import zlib
+import socket
+import struct
+import logging
+
+from tornado.ioloop import IOLoop
+from tornado.platform.auto import monotonic_time
+
+# app/box/erp/init packet header: author, version, request, verify, length, device
+CLIENT_HEADER = struct.Struct('!6I')
+CLIENT_LENGTH_INDEX = 4
+
+# request of client heartbeats: route echoes them back, never forwards them
+HEARTBEAT_REQUEST = 0
+
+# route <-> business packet header: type, id, md5, timestamp, length, ip
+# timestamp and ip keep the little endian layout of the x86 modules,
+# they stay raw bytes until somebody decodes them
+ROUTE_HEADER = struct.Struct('!2I32s8sI4s')
+ROUTE_LENGTH_INDEX = 4
+
+# md5 of frames that are commands, not requests or replies, eg. push to
+# route or heartbeats both ways. Their body is json: {"cmd" : name, ...}
+COMMAND_ID = '\0' * 32
+
+# route <-> business packet header of protocol 2, agreed on at register:
+# type, flags, length, request id, timestamp, ip, checksum.
+# The request id is allocated by route, the timestamp is microseconds of
+# its monotonic clock, ip is 16 bytes with IPv4 mapped into IPv6 and
+# checksum is the crc32 of the body if flags has FLAG_CHECKSUM, else 0
+ROUTE_HEADER_V2 = struct.Struct('!HHIQQ16sI')
+ROUTE_V2_LENGTH_INDEX = 2
+
+# request id of commands in protocol 2
+COMMAND_ID_V2 = 0
+
+FLAG_CHECKSUM = 1
+
+# latest protocol of route <-> business packets
+MAX_PROTOCOL = 2
+
+IPV4_MAPPED = '\0' * 10 + '\xff\xff'
+
+# ip 0.0.0.0 of protocol 1 packets, eg. of commands
+NO_IP = '\0' * 4
+
+# business register info header: length, md5
+REGISTER_HEADER = struct.Struct('!I32s')
+
+# business register feedback header: length
+FEEDBACK_HEADER = struct.Struct('!I')
+
+TIMESTAMP = struct.Struct('<d')
+
+# bytes asked from the socket per read
+READ_CHUNK_SIZE = 65536
+
+# buffered bytes that make FrameWriter flush at once
+FLUSH_SIZE = 65536
+
+
+def encode_ip(ip_str):
+    """ip in protocol 1 packets, ipv6 ones have none: NO_IP"""
+    if ':' in ip_str:
+        return NO_IP
+    return socket.inet_aton(ip_str)[::-1]
+
+
+def decode_ip(raw):
+    return socket.inet_ntoa(raw[::-1])
+
+
+def encode_timestamp(timestamp):
+    return TIMESTAMP.pack(timestamp)
+
+
+def decode_timestamp(raw):
+    return TIMESTAMP.unpack(raw)[0]
+
+
+def encode_ip16(ip_str):
+    if ':' in ip_str:
+        return socket.inet_pton(socket.AF_INET6, ip_str)
+    return IPV4_MAPPED + socket.inet_aton(ip_str)
+
+
+def decode_ip16(raw):
+    if raw.startswith(IPV4_MAPPED):
+        return socket.inet_ntoa(raw[12:])
+    return socket.inet_ntop(socket.AF_INET6, raw)
+
+
+def get_checksum(body):
+    return zlib.crc32(body) & 0xffffffff
+
+
+# never goes back, python 2 needs the monotonic package for it
+_clock = monotonic_time or time.time
+
+
+def get_monotonic_us():
+    return int(_clock() * 1000000)
+
+
+class FrameReader(object):
+    """read frames of header + body from stream
+
+    callback(parts, frame) is called for every frame, parts is the
+    unpacked header and frame the whole packet, header included.
+
+    A frame longer than max_length closes the stream, its length is not
+    to be trusted. The body of a frame longer than stream_length is not
+    buffered: on_stream(parts, head) is called with the header bytes and
+    returns sink, sink(chunk) is called with the body as it arrives and
+    sink(None) at its end. on_stream returns None to skip the body.
+    """
+    __slots__ = ('_stream', '_header', '_length_index', '_callback', '_buffer',
+        '_reading', '_paused', '_max_length', '_stream_length', '_on_stream',
+        '_sink', '_remaining', '_read_time')
+
+    def __init__(self, stream, header, length_index, callback):
+        self._stream = stream
+        self._header = header
+        self._length_index = length_index
+        self._callback = callback
+        self._buffer = bytearray()
+        self._reading = False
+        self._paused = False
+        self._max_length = 0 # 0 is no limit
+        self._stream_length = 0 # 0 never streams
+        self._on_stream = None
+        self._sink = None # of the body being streamed
+        self._remaining = 0 # bytes of the body being streamed
+        self._read_time = time.time() # of the last data, see get_read_time
+
+
+    def set_limits(self, max_length=0, stream_length=0, on_stream=None):
+        self._max_length = max_length
+        self._stream_length = stream_length if on_stream is not None else 0
+        self._on_stream = on_stream
+
+
+    def set_header(self, header, length_index, callback):
+        """parse following frames with another header"""
+        self._header = header
+        self._length_index = length_index
+        self._callback = callback
+
+
+    def start(self):
+        if not self._reading:
+            self._read()
+
+
+    def pause(self):
+        """stop dispatching frames and reading the socket"""
+        self._paused = True
+
+
+    def resume(self):
+        """dispatch buffered frames and read again on next iteration"""
+        if self._paused:
+            self._paused = False
+            IOLoop.current().add_callback(self._dispatch)
+
+
+    def is_paused(self):
+        return self._paused
+
+
+    def get_read_time(self):
+        """time data was last read, parts of a frame too, eg. of a long body"""
+        return self._read_time
+
+
+    def _read(self):
+        if self._stream.closed() or self._paused or self._reading:
+            return
+        self._reading = True
+        self._stream.read_bytes(READ_CHUNK_SIZE, self._on_data, partial=True)
+
+
+    def _on_data(self, data):
+        self._reading = False
+        self._read_time = time.time()
+        self._buffer.extend(data)
+        self._dispatch()
+
+
+    def _dispatch(self):
+        buf = self._buffer
+        view = memoryview(buf)
+        offset = 0
+        end = len(buf)
+        try:
+            while not self._paused and not self._stream.closed():
+                if self._remaining:
+                    if offset == end:
+                        break
+                    offset = self._pipe(view, offset, end)
+                    continue
+
+                header = self._header
+                if end - offset < header.size:
+                    break
+                parts = header.unpack_from(buf, offset)
+                length = parts[self._length_index]
+                if self._max_length and length > self._max_length:
+                    logging.warning('close stream: frame of %d bytes over %d',
+                        length, self._max_length)
+                    self._stream.close()
+                    break
+                if self._stream_length and length > self._stream_length:
+                    head = view[offset:offset + header.size].tobytes()
+                    offset += header.size
+                    self._remaining = length
+                    self._sink = self._on_stream(parts, head)
+                    continue
+                frame_end = offset + header.size + length
+                if frame_end > end:
+                    break
+                frame = view[offset:frame_end].tobytes()
+                offset = frame_end
+                self._callback(parts, frame)
+        finally:
+            # the buffer can not be resized while viewed
+            del view
+            del buf[:offset]
+
+        self._read()
+
+
+    def _pipe(self, view, offset, end):
+        """hand the buffered part of a streamed body to its sink"""
+        size = min(self._remaining, end - offset)
+        chunk = view[offset:offset + size].tobytes()
+        self._remaining -= size
+        sink = self._sink
+        if not self._remaining:
+            self._sink = None
+        if sink is not None:
+            sink(chunk)
+            if not self._remaining:
+                sink(None)
+        return offset + size
+
+
+class FrameWriter(object):
+    """coalesce frames written to stream
+
+    Parts are kept as they are, header and body are never concatenated
+    per frame. They are joined once when flushed, at the end of the
+    current ioloop iteration, or max_delay seconds after the first
+    buffered part if max_delay is set. FLUSH_SIZE buffered bytes flush
+    at once, so max_delay is the upper bound of the added latency.
+
+    on_drain is called once the stream has sent all flushed data.
+    """
+    __slots__ = ('_stream', '_on_drain', '_parts', '_size', '_scheduled')
+    max_delay = 0 # seconds, set by command line of route/business
+
+    def __init__(self, stream, on_drain=None):
+        self._stream = stream
+        self._on_drain = on_drain
+        self._parts = []
+        self._size = 0
+        self._scheduled = False
+
+
+    def write(self, *parts):
+        if self._stream.closed():
+            return
+        self._parts.extend(parts)
+        for part in parts:
+            self._size += len(part)
+
+        if self._size >= FLUSH_SIZE:
+            self.flush()
+        elif not self._scheduled:
+            self._scheduled = True
+            io_loop = IOLoop.current()
+            if FrameWriter.max_delay > 0:
+                io_loop.add_timeout(io_loop.time() + FrameWriter.max_delay,
+                    self.flush)
+            else:
+                io_loop.add_callback(self.flush)
+
+
+    def flush(self):
+        self._scheduled = False
+        if not self._parts:
+            return
+        data = ''.join(self._parts)
+        self._parts = []
+        self._size = 0
+        if not self._stream.closed():
+            self._stream.write(data, self._on_drain)
+
+
+    def get_buffered_size(self):
+        """bytes waiting in this writer and in the stream"""
+        return self._size + getattr(self._stream, '_write_buffer_size', 0)
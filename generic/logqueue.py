@@ -0,0 +1,138 @@
+#coding=utf-8
+
+"""logging off the ioloop thread
+
+QueueHandler only puts records into a queue, QueueListener formats and
+writes them from a background thread. Sampler decides per request code
+which packets are traced, so tracing can stay on under load.
+"""
+
+__author__ = 'Yingqi Jin <jinyingqi@luoha.com>'
+
+__all__ = ['QueueHandler', 'QueueListener', 'Sampler', 'sampler', 'tracing',
+    'parse_levels', 'parse_rates']
+
+import Queue
+import logging
+import threading
+
+# records waiting for the writer thread, more are dropped
+QUEUE_SIZE = 100000
+
+
+class QueueHandler(logging.Handler):
+    """hand records to a queue, never block the caller"""
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+
+class QueueListener(object):
+    """write records of queue to handlers from one thread"""
+
+    def __init__(self, queue, *handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self._thread = None
+
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='log')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+
+    def stop(self):
+        """write what is queued and stop"""
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+
+class Sampler(object):
+    """trace one packet out of every n per request code
+
+    rates maps request codes, or 'default', to the traced fraction:
+    1 traces all packets, 0.01 one in a hundred, 0 none.
+
+    Codes of rates and those known(request) is true for are counted
+    apart, all others share one count: a client may send any code.
+    """
+
+    def __init__(self, rates=None, known=None):
+        self._every = {}
+        self._default = 1
+        self._counts = {}
+        self.known = known # None knows every code
+        self.set_rates(rates or {})
+
+
+    def set_rates(self, rates):
+        every = {}
+        for request, rate in rates.iteritems():
+            every[request] = int(round(1 / rate)) if rate > 0 else 0
+        self._default = every.pop('default', 1)
+        self._every = every
+        self._counts = {}
+
+
+    def __call__(self, request):
+        every = self._every.get(request, self._default)
+        if every <= 1:
+            return every == 1
+        if (self.known is not None and request not in self._every and
+                not self.known(request)):
+            request = 'other'
+        count = self._counts.get(request, 0) + 1
+        self._counts[request] = count
+        return count % every == 0
+
+
+# sampler of this process, configured by init_log
+sampler = Sampler()
+
+
+def tracing(logger, request):
+    """whether logger traces this packet of request at DEBUG"""
+    return logger.isEnabledFor(logging.DEBUG) and sampler(request)
+
+
+def parse_levels(levels):
+    """'connection=debug,business=info' -> {name : level}"""
+    result = {}
+    for item in filter(None, levels.split(',')):
+        name, level = item.split('=')
+        result[name.strip()] = getattr(logging, level.strip().upper())
+    return result
+
+
+def parse_rates(rates):
+    """'10001=0.01,default=0' -> {request : rate}"""
+    result = {}
+    for item in filter(None, rates.split(',')):
+        request, rate = item.split('=')
+        request = request.strip()
+        if request != 'default':
+            request = int(request)
+        result[request] = float(rate)
+    return result
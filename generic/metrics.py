@@ -0,0 +1,214 @@
+#coding=utf-8
+
+"""in-process metrics: counters, gauges and latency histograms
+
+Updating a metric is a few integer operations, nothing is aggregated on
+the hot path. snapshot() walks the registry when somebody asks for it,
+eg. through the admin port.
+"""
+
+__author__ = 'Yingqi Jin <jinyingqi@luoha.com>'
+
+__all__ = ['Counter', 'Gauge', 'Histogram', 'Traffic', 'Family', 'Registry',
+    'registry']
+
+
+class Counter(object):
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+
+    def inc(self, n=1):
+        self.value += n
+
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge(object):
+    """current value, set by hand or read from fn at snapshot"""
+    __slots__ = ('value', 'fn')
+
+    def __init__(self, fn=None):
+        self.value = 0
+        self.fn = fn
+
+
+    def set(self, value):
+        self.value = value
+
+
+    def snapshot(self):
+        if self.fn is not None:
+            return self.fn()
+        return self.value
+
+
+class Traffic(object):
+    """packets and bytes in and out"""
+    __slots__ = ('packets_in', 'bytes_in', 'packets_out', 'bytes_out')
+
+    def __init__(self):
+        self.packets_in = 0
+        self.bytes_in = 0
+        self.packets_out = 0
+        self.bytes_out = 0
+
+
+    def read(self, size):
+        self.packets_in += 1
+        self.bytes_in += size
+
+
+    def write(self, size):
+        self.packets_out += 1
+        self.bytes_out += size
+
+
+    def snapshot(self):
+        return {
+            'packets_in' : self.packets_in,
+            'bytes_in' : self.bytes_in,
+            'packets_out' : self.packets_out,
+            'bytes_out' : self.bytes_out,
+        }
+
+
+# histogram precision: 2 ** SUB_BITS buckets per power of two, ~3%
+SUB_BITS = 5
+SUB_COUNT = 1 << SUB_BITS
+
+# values above 2 ** MAX_BITS units land in the last bucket
+MAX_BITS = 40
+
+
+def bucket_index(value):
+    if value < 2 * SUB_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BITS - 1
+    return 2 * SUB_COUNT + (shift - 1) * SUB_COUNT + (value >> shift) - SUB_COUNT
+
+
+def bucket_value(index):
+    """lowest value of bucket index"""
+    if index < 2 * SUB_COUNT:
+        return index
+    shift = (index - 2 * SUB_COUNT) // SUB_COUNT + 1
+    return (SUB_COUNT + (index - 2 * SUB_COUNT) % SUB_COUNT) << shift
+
+
+class Histogram(object):
+    """HDR style log-linear histogram of integer values
+
+    Values are recorded in unit (1e-6: microseconds for seconds input).
+    Buckets are exact below 2 * SUB_COUNT and keep SUB_COUNT buckets per
+    power of two above, so any percentile is within ~3% of the truth
+    while recording costs one index computation.
+    """
+    __slots__ = ('unit', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, unit=1e-6):
+        self.unit = unit
+        self.counts = [0] * (bucket_index((1 << MAX_BITS) - 1) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+
+    def record(self, value):
+        value = int(value / self.unit)
+        if value < 0:
+            value = 0
+        elif value >> MAX_BITS:
+            value = (1 << MAX_BITS) - 1
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+
+    def percentile(self, p):
+        if self.count == 0:
+            return 0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                return bucket_value(index) * self.unit
+        return self.max * self.unit
+
+
+    def snapshot(self):
+        if self.count == 0:
+            return {'count' : 0}
+        return {
+            'count' : self.count,
+            'mean' : self.total * self.unit / self.count,
+            'p50' : self.percentile(50),
+            'p90' : self.percentile(90),
+            'p99' : self.percentile(99),
+            'p999' : self.percentile(99.9),
+            'max' : self.max * self.unit,
+        }
+
+
+class Family(dict):
+    """metrics of one name keyed by a label, created on first use"""
+
+    def __init__(self, cls):
+        dict.__init__(self)
+        self._cls = cls
+
+
+    def __missing__(self, label):
+        metric = self[label] = self._cls()
+        return metric
+
+
+    def snapshot(self):
+        return dict((str(label), metric.snapshot())
+            for label, metric in self.iteritems())
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._metrics = {}
+
+
+    def _get(self, name, factory):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = factory()
+        return metric
+
+
+    def counter(self, name):
+        return self._get(name, Counter)
+
+
+    def gauge(self, name, fn=None):
+        return self._get(name, lambda: Gauge(fn))
+
+
+    def histogram(self, name):
+        return self._get(name, Histogram)
+
+
+    def family(self, name, cls=Counter):
+        """eg. family('packets_in', Counter)[10001].inc()"""
+        return self._get(name, lambda: Family(cls))
+
+
+    def snapshot(self):
+        return dict((name, metric.snapshot())
+            for name, metric in self._metrics.iteritems())
+
+
+# registry of this process
+registry = Registry()
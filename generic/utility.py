@@ -4,9 +4,14 @@
 
 import os
 import sys
+import Queue
+import atexit
 import socket
 import logging
 
+from logqueue import QueueHandler, QueueListener, QUEUE_SIZE
+from logqueue import sampler, parse_levels, parse_rates
+
 # business register info header length. 4 bytes len + 32 bytes md5
 BUSINESS_REGISTER_HEADER_LENGTH = 36
 
@@ -20,15 +25,28 @@ BUSINESS_FEEDBACK_HEADER_LENGTH = 4
 # app/box/erp/init packet header length 
 CLIENT_HEADER_LENGTH = 24
 
+# unix socket route listens on next to business port, see get_unix_socket
+UNIX_SOCKET = '/tmp/route-%d.sock'
+
 ROOT = os.path.dirname(os.path.abspath(__file__))
 
-def init_log(fname, debug):
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format='[%(asctime)s - %(process)-6d - %(threadName)-10s - %(levelname)-8s] %(message)s',
-        datefmt='%a, %d %b %Y %H:%M:%S',
-        filename=fname,
-        filemode='w')
+_log_handler = None
+
+_log_listener = None
+
+
+def init_log(fname, debug, levels='', rates=''):
+    """log into fname and console from a background thread
+
+    debug enables DEBUG for all modules, levels for some of them,
+    eg. 'connection=debug,bconnection=info'. rates samples traced
+    packets per request code, eg. '10001=0.01,default=1'.
+    """
+    global _log_handler, _log_listener
+    fh = logging.FileHandler(fname, 'w')
+    fh.setFormatter(logging.Formatter(
+        '[%(asctime)s - %(process)-6d - %(threadName)-10s - %(levelname)-8s] %(message)s',
+        '%a, %d %b %Y %H:%M:%S'))
     
     sh = logging.StreamHandler()
     if debug:
@@ -37,7 +55,33 @@ def init_log(fname, debug):
         sh.setLevel(logging.INFO)
     formatter = logging.Formatter('%(levelname)-8s %(message)s')
     sh.setFormatter(formatter)
-    logging.getLogger('').addHandler(sh)
+
+    queue = Queue.Queue(QUEUE_SIZE)
+    _log_handler = QueueHandler(queue)
+    _log_listener = QueueListener(queue, fh, sh)
+    _log_listener.start()
+    atexit.register(stop_log)
+
+    root = logging.getLogger('')
+    root.setLevel(logging.DEBUG if debug else logging.INFO)
+    root.addHandler(_log_handler)
+    for name, level in parse_levels(levels).iteritems():
+        logging.getLogger(name).setLevel(level)
+    sampler.set_rates(parse_rates(rates))
+
+
+def restart_log():
+    """start the log thread again in a forked process"""
+    global _log_listener
+    queue = Queue.Queue(QUEUE_SIZE)
+    _log_handler.queue = queue
+    _log_listener = QueueListener(queue, *_log_listener.handlers)
+    _log_listener.start()
+
+
+def stop_log():
+    if _log_listener is not None:
+        _log_listener.stop()
 
 
 def get_default_log():
@@ -56,6 +100,21 @@ def get_ip():
     return ip
 
 
+def get_unix_socket(port):
+    """unix socket of the route process listening on business port"""
+    return UNIX_SOCKET % port
+
+
+def is_local(ip):
+    """ip is this host"""
+    if ip == 'localhost' or ip.startswith('127.'):
+        return True
+    try:
+        return ip == get_ip()
+    except socket.error:
+        return False
+
+
 if __name__ == '__main__':
     
     print get_ip()
@@ -0,0 +1,153 @@
+#coding=utf-8
+
+"""choose one business connection among those serving the same function"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+__all__ = ['Balancer', 'RoundRobinBalancer', 'LeastOutstandingBalancer',
+    'PowerOfTwoBalancer', 'create_balancer']
+
+import random
+import logging
+from collections import deque
+
+
+class Balancer(object):
+    """pool of business connections of one function
+
+    Connections expose their live load: get_inflight() is the number of
+    forwarded requests without reply, get_latency() the EWMA of the
+    reply latency in seconds, is_saturated() whether they are at one of
+    their limits, eg. streaming a body.
+
+    select() returns a connection below its limits if the pool has one,
+    a saturated one only if all are: a request waits only then.
+    """
+
+    def __init__(self):
+        self._conns = []
+        self.waiting = deque() # (client, header, packet, trace) waiting for capacity
+
+
+    def __len__(self):
+        return len(self._conns)
+
+
+    def __iter__(self):
+        return iter(self._conns)
+
+
+    def __contains__(self, conn):
+        return conn in self._conns
+
+
+    def add(self, conn):
+        if conn not in self._conns:
+            self._conns.append(conn)
+
+
+    def remove(self, conn):
+        self._conns.remove(conn)
+
+
+    def select(self):
+        raise NotImplementedError
+
+
+    def select_least(self):
+        """least loaded connection below its limits, None if there is none"""
+        best = None
+        for conn in self._conns:
+            if not conn.is_saturated() and (best is None or load(conn) < load(best)):
+                best = conn
+        return best
+
+
+class RoundRobinBalancer(Balancer):
+
+    def __init__(self):
+        Balancer.__init__(self)
+        self._next = 0
+
+
+    def select(self):
+        if not self._conns:
+            return None
+        n = len(self._conns)
+        for i in xrange(n):
+            if self._next >= n:
+                self._next = 0
+            conn = self._conns[self._next]
+            self._next += 1
+            if not conn.is_saturated():
+                return conn
+        return conn
+
+
+class LeastOutstandingBalancer(Balancer):
+    """fewest requests in flight, lower latency breaks ties"""
+
+    def select(self):
+        if len(self._conns) < 2:
+            return self._conns[0] if self._conns else None
+        best = None
+        best_inflight = best_latency = 0
+        for conn in self._conns:
+            if conn.is_saturated():
+                continue
+            inflight = conn.get_inflight()
+            if best is None or inflight < best_inflight:
+                best, best_inflight, best_latency = conn, inflight, None
+            elif inflight == best_inflight:
+                # latency is asked for only on a tie
+                if best_latency is None:
+                    best_latency = best.get_latency()
+                latency = conn.get_latency()
+                if latency < best_latency:
+                    best, best_latency = conn, latency
+        if best is None:
+            return self._conns[0]
+        return best
+
+
+class PowerOfTwoBalancer(Balancer):
+    """pick two connections at random, keep the less loaded one"""
+
+    def select(self):
+        n = len(self._conns)
+        if n < 2:
+            return self._conns[0] if self._conns else None
+        i = int(random.random() * n)
+        j = int(random.random() * (n - 1))
+        if j >= i:
+            j += 1
+        a, b = self._conns[i], self._conns[j]
+        if load(b) < load(a):
+            a, b = b, a
+        if not a.is_saturated():
+            return a
+        if not b.is_saturated():
+            return b
+        # both are, look at the others
+        return self.select_least() or a
+
+
+def load(conn):
+    """expected wait of a new request on conn"""
+    return (conn.get_inflight() + 1) * conn.get_latency()
+
+
+BALANCERS = {
+    'roundrobin' : RoundRobinBalancer,
+    'least' : LeastOutstandingBalancer,
+    'p2c' : PowerOfTwoBalancer,
+}
+
+DEFAULT_BALANCER = 'least'
+
+
+def create_balancer(name=DEFAULT_BALANCER):
+    if name not in BALANCERS:
+        logging.error('unsupported balancer %s, use %s' % (name, DEFAULT_BALANCER))
+        name = DEFAULT_BALANCER
+    return BALANCERS[name]()
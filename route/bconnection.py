@@ -6,14 +6,77 @@ __author__ = "Yingqi Jin <jinyingqi@luoha.com>"
 
 import json
 import time
-import socket
 import logging
-import threading
-from struct import pack, unpack
+import struct
+import hashlib
 
-BUSINESS_HEADER_LENGTH = 56 
+import routing
+from metrics import registry, Histogram
+from config import get_limit, get_timeout, get_coalesced, get_frame_limit
+from config import get_heartbeat
+from pending import PendingTable
+from cache import CACHE, get_key
+from reaper import REAPER
+from framing import FrameReader, FrameWriter, ROUTE_HEADER, ROUTE_LENGTH_INDEX, CLIENT_HEADER
+from framing import REGISTER_HEADER, FEEDBACK_HEADER, COMMAND_ID
+from framing import decode_ip, encode_timestamp, decode_timestamp, NO_IP
+from framing import ROUTE_HEADER_V2, ROUTE_V2_LENGTH_INDEX, COMMAND_ID_V2, FLAG_CHECKSUM
+from framing import MAX_PROTOCOL, decode_ip16, get_checksum, get_monotonic_us
 
-REGISTER_INFO_LENGTH = 36
+BUSINESS_HEADER_LENGTH = ROUTE_HEADER.size
+
+REGISTER_INFO_LENGTH = REGISTER_HEADER.size
+
+SEQUENCE = struct.Struct('Q')
+
+# bytes written at a time to pad a streamed packet whose client closed
+PAD_SIZE = 65536
+
+logger = logging.getLogger(__name__)
+
+
+class FunctionMetrics(object):
+    """requests of one business function"""
+    __slots__ = ('forwarded', 'queued', 'shed', 'replied', 'timeout', 'coalesced',
+        'evicted', 'latency')
+
+    def __init__(self):
+        self.forwarded = 0
+        self.queued = 0 # client paused until capacity frees up
+        self.shed = 0 # refused, wait queue full
+        self.replied = 0
+        self.timeout = 0
+        self.coalesced = 0 # joined an identical request in flight
+        self.evicted = 0 # dropped from a full pending table, answered busy
+        self.latency = Histogram() # forward to reply, seconds
+
+
+    def snapshot(self):
+        return {
+            'forwarded' : self.forwarded,
+            'queued' : self.queued,
+            'shed' : self.shed,
+            'replied' : self.replied,
+            'timeout' : self.timeout,
+            'coalesced' : self.coalesced,
+            'evicted' : self.evicted,
+            'latency' : self.latency.snapshot(),
+        }
+
+
+FUNCTIONS = registry.family('function', FunctionMetrics)
+
+# forward to reply latency of each request code
+LATENCY = registry.family('latency', Histogram)
+
+registry.gauge('inflight', lambda: dict((function, sum(c.get_inflight() for c in pool))
+    for function, pool in routing.POOLS.iteritems()))
+
+# weight of the newest sample in reply latency EWMA
+LATENCY_ALPHA = 0.2
+
+# latency assumed before the first reply, seconds
+INITIAL_LATENCY = 0.01
 
 
 def get_addr_str(addr):
@@ -21,10 +84,19 @@ def get_addr_str(addr):
 
 
 class BusinessConnection(object):
-    clients = {} # item : business : sockets 
+    __slots__ = ('_stream', '_address', '_addr_str', '_registed', '_pending',
+        '_latency', '_max_inflight', '_max_buffered', '_protocol', '_checksum',
+        '_streaming', '_stream_remaining', '_function', '_writer', '_reader',
+        '_heartbeat', '_idle', '_held')
     conns = set()
-    clients_lock = threading.Lock()
+    port = 'business'
     header_length = BUSINESS_HEADER_LENGTH
+    pending = PendingTable() # forwarded requests waiting for reply
+    sequence = 0 # makes request ids of identical packets unique
+    worker = 0 # id of this route process
+    workers = 1 # number of route processes
+    commands = {} # name : fn(conn, command), see add_command
+    flights = {} # body key : pending request of a coalesced request
 
     @classmethod
     def clean_connection(cls):
@@ -32,109 +104,342 @@ class BusinessConnection(object):
             cli._stream.close()
 
 
+    @classmethod
+    def add_command(cls, name, fn):
+        """fn(conn, command) runs commands {"cmd" : name, ...} of business modules"""
+        cls.commands[name] = fn
+
+
+    @classmethod
+    def set_worker(cls, worker, workers):
+        cls.worker = worker
+        cls.workers = workers
+
+
+    @classmethod
+    def expire_pending(cls):
+        businesses = set()
+        for req in cls.pending.expire():
+            logger.warning('request %s to %s timeout', req.key, req.business._function)
+            FUNCTIONS[req.business._function].timeout += 1
+            req.business.update_latency(time.time() - req.timestamp)
+            for client, header in cls.land(req):
+                client.send_error(header, 'request timeout')
+            businesses.add(req.business)
+        for business in businesses:
+            business.drain()
+
+
+    @classmethod
+    def evict(cls, req):
+        """req was dropped from the full pending table, its clients get an error"""
+        logger.warning('pending table is full, drop request %s to %s', req.key,
+            req.business._function)
+        FUNCTIONS[req.business._function].evicted += 1
+        for client, header in cls.land(req):
+            client.send_error(header, 'business server is busy')
+
+
+    @classmethod
+    def join(cls, client, header, key):
+        """wait for the reply of the identical request in flight
+
+        return False if there is none, the request is to be forwarded.
+        """
+        req = cls.flights.get(key)
+        if req is None:
+            return False
+        if req.key not in cls.pending:
+            # evicted from a full pending table
+            del cls.flights[key]
+            return False
+        if req.waiters is None:
+            req.waiters = []
+        req.waiters.append((client, header))
+        FUNCTIONS[req.business._function].coalesced += 1
+        return True
+
+
+    @classmethod
+    def land(cls, req):
+        """req left the pending table, return (client, header) of its reply"""
+        if req.body_key is not None and cls.flights.get(req.body_key) is req:
+            del cls.flights[req.body_key]
+        if req.waiters is None:
+            return [(req.client, req.header)]
+        return [(req.client, req.header)] + req.waiters
+
+
+    @classmethod
+    def hand_over(cls, req):
+        """client of req closed, the first open waiter takes the request over"""
+        if cls.flights.get(req.body_key) is not req:
+            return
+        del cls.flights[req.body_key]
+        waiters = req.waiters or []
+        while waiters:
+            client, header = waiters.pop(0)
+            if client._stream.closed():
+                continue
+            timeout = get_timeout(header[2]) - (time.time() - req.timestamp)
+            new, evicted = cls.pending.add(req.key, client, req.business, header,
+                max(timeout, 0))
+            if evicted is not None:
+                cls.evict(evicted)
+            if new is None:
+                client.send_error(header, 'too many pending requests')
+                continue
+            new.body_key = req.body_key
+            new.generation = req.generation
+            new.waiters = waiters
+            new.trace = req.trace
+            cls.flights[req.body_key] = new
+            return
+
+
     def __init__(self, stream, address):
         BusinessConnection.conns.add(self)
         self._stream = stream
         self._address = address
         self._addr_str = get_addr_str(self._address) 
         self._registed = False
-
-        self._header = ''
-        self._body = ''
+        self._pending = set() # keys of requests waiting for reply
+        self._latency = INITIAL_LATENCY # EWMA of reply latency
+        self._max_inflight = 0
+        self._max_buffered = 0
+        self._protocol = 1 # of route <-> business packets, agreed on at register
+        self._checksum = False # crc32 of bodies in protocol 2
+        self._streaming = None # client whose body is piped to this connection
+        self._stream_remaining = 0 # bytes of that body not piped yet
+        self._heartbeat = False # module sends heartbeats, asked for at register
+        self._held = None # commands waiting for the end of a streamed packet
 
         self._function = '' # control/forward/music ...
 
-        # header between route and business : 56 bytes
-        self._type = '' # 4 bytes, app/box/erp/init
-        self._id= '' # 4 bytes, unique id
-        self._md5 = '' # 32 bytes, used to track each request
-        self._timestamp = 0 # 8 bytes
-        self._length = 0 # 4 bytes, body length
-        self._ip = 0 # 4 bytes
-
         self._stream.set_close_callback(self.on_close)
-        self.read_register_header()
-
-
-    def read_register_header(self):
-        self._stream.read_bytes(REGISTER_INFO_LENGTH,
-            self.read_register_body) 
+        self._writer = FrameWriter(self._stream, self.drain)
+        self._reader = FrameReader(self._stream, REGISTER_HEADER, 0,
+            self.read_register)
+        self._reader.set_limits(get_frame_limit('business', 'max_length'))
+        self._reader.start()
+        REAPER.add(self) # sets _idle
 
 
-    def read_register_body(self, header):
-        parts = unpack("I32s", header)
-        self._length, self._md5 = parts
-        self._length = socket.ntohl(self._length)
-        logging.debug('read register header: %d %s from %s' % (self._length, self._md5, self._addr_str))
-        self._stream.read_bytes(self._length, self.send_register_feedback)
+    def read_register(self, header, packet):
+        length, md5 = header
+        logger.debug('read register header: %d %s from %s', length, md5, self._addr_str)
+        self.send_register_feedback(packet[REGISTER_INFO_LENGTH:])
 
     
     def send_register_feedback(self, msg):
-        logging.debug('read register body: %d: %s from %s' % (len(msg), msg, self._addr_str))
+        logger.debug('read register body: %d: %s from %s', len(msg), msg, self._addr_str)
         reply = {}
         reply['status'] = 0
         reply['reason'] = ''
+        # business connects to each route process on BUSINESS_PORT + worker
+        reply['worker'] = BusinessConnection.worker
+        reply['workers'] = BusinessConnection.workers
 
         body = json.loads(msg)
         if 'function' not in body or 'timestamp' not in body:
             err = 'unsupported register info: %s' % msg
             reply['status'] = 1
             reply['reason'] = err
-            logging.error('unsupported register info')
+            logger.error('unsupported register info')
         else:
             function = body['function']
             timestamp = body['timestamp']
             time_cost = time.time() - timestamp 
-            logging.info('register %s successfully for %s %.4f s' % (function, self._addr_str, time_cost))
+            logger.info('register %s successfully for %s %.4f s', function, self._addr_str, time_cost)
 
-            BusinessConnection.clients_lock.acquire()
             self._function = function
-            if function in BusinessConnection.clients:
-                BusinessConnection.clients[function].add(self)
-            else:
-                new_business = set()
-                new_business.add(self)
-                BusinessConnection.clients[function] = new_business
+            self.load_limits()
+            routing.register(self)
             self._registed = True 
-            BusinessConnection.clients_lock.release()
+
+            # modules without protocol in their register info only know 1
+            self._protocol = min(int(body.get('protocol', 1)), MAX_PROTOCOL)
+            self._checksum = self._protocol > 1 and bool(body.get('checksum'))
+            reply['protocol'] = self._protocol
+            reply['checksum'] = self._checksum
+
+            # modules not asking for heartbeats are never closed when idle
+            if body.get('heartbeat'):
+                self._heartbeat = True
+                REAPER.update(self)
+                reply['heartbeat'] = {
+                    'interval' : get_heartbeat(self.port, 'interval'),
+                    'idle_timeout' : get_heartbeat(self.port, 'idle_timeout'),
+                }
 
         reply_str = json.dumps(reply)
-        header = pack("I", socket.htonl(len(reply_str)))
-        self._stream.write(header + reply_str)
+        self._writer.write(FEEDBACK_HEADER.pack(len(reply_str)), reply_str)
+
+        if self._protocol > 1:
+            self._reader.set_header(ROUTE_HEADER_V2, ROUTE_V2_LENGTH_INDEX,
+                self.read_packet_v2)
+        else:
+            self._reader.set_header(ROUTE_HEADER, ROUTE_LENGTH_INDEX,
+                self.read_packet)
+
+
+    def read_packet(self, header, packet):
+        # header between route and business: type, id, md5, timestamp, length, ip
+        device_type, device_id, md5, timestamp, length, ip = header
+        body = packet[BUSINESS_HEADER_LENGTH:]
+        if md5 == COMMAND_ID:
+            self.run_command(body)
+            return
+
+        req = self.read_reply(md5, body)
+        if req is not None and req.trace:
+            logger.debug('read header(%d, %d, %s, %f, %d, %s) from %s',
+                device_type, device_id, md5, decode_timestamp(timestamp),
+                length, decode_ip(ip), self._addr_str)
+
+
+    def read_packet_v2(self, header, packet):
+        device_type, flags, length, key, timestamp, ip, checksum = header
+        body = packet[ROUTE_HEADER_V2.size:]
+        if flags & FLAG_CHECKSUM and get_checksum(body) != checksum:
+            logger.error('drop packet %d from %s: checksum mismatch', key, self._addr_str)
+            req = BusinessConnection.pending.pop(key)
+            if req is not None:
+                for client, header in BusinessConnection.land(req):
+                    client.send_error(header, 'business reply corrupted')
+            return
+        if key == COMMAND_ID_V2:
+            self.run_command(body)
+            return
+
+        req = self.read_reply(key, body)
+        if req is not None and req.trace:
+            logger.debug('read header(%d, %d, %d, %d, %d, %s) from %s',
+                device_type, flags, length, key, timestamp, decode_ip16(ip),
+                self._addr_str)
+
+
+    def read_reply(self, key, body):
+        """send body to the clients of request key, return the request"""
+        req = BusinessConnection.pending.pop(key)
+        if req is None:
+            logger.warning('drop reply %s from %s: no pending request', key, self._addr_str)
+            return None
+
+        latency = time.time() - req.timestamp
+        self.update_latency(latency)
+        metrics = FUNCTIONS[self._function]
+        metrics.replied += 1
+        metrics.latency.record(latency)
+        LATENCY[req.header[2]].record(latency)
+        if req.trace:
+            logger.debug('read body(%d:%s) from %s', len(body),
+                body, self._addr_str)
+            logger.debug('reply %s from %s in %.4f s', key,
+                self._addr_str, latency)
+        if req.generation is not None:
+            CACHE.put(req.body_key, body, req.generation)
+        for client, header in BusinessConnection.land(req):
+            client.send(header, body, req.trace)
+        self.drain()
+        return req
+
+
+    def run_command(self, body):
+        try:
+            command = json.loads(body)
+            fn = BusinessConnection.commands[command['cmd']]
+        except (ValueError, TypeError, KeyError):
+            logger.warning('drop invalid command %r from %s', body[:256], self._addr_str)
+            return
+        try:
+            fn(self, command)
+        except (ValueError, TypeError, KeyError, AttributeError, struct.error), e:
+            # eg. a push whose request does not fit the client header
+            logger.warning('drop command %s from %s: %r', command['cmd'],
+                self._addr_str, e)
+
+
+    def send_command(self, command):
+        """send command to the business module, eg. a heartbeat
+
+        Held while a packet is streamed: its body is still to be written.
+        """
+        msg = json.dumps(command)
+        if self._streaming is not None:
+            if self._held is None:
+                self._held = []
+            self._held.append(msg)
+            return
+        self.write_command(msg)
+
+
+    def write_command(self, msg):
+        if self._protocol > 1:
+            self.send_v2(msg, 0, '\0' * 16, COMMAND_ID_V2)
+        else:
+            self.send(msg, 0, NO_IP, COMMAND_ID)
 
-        self._stream.read_bytes(BusinessConnection.header_length, self.read_header)
 
+    def get_idle_timeout(self):
+        if not self._heartbeat:
+            return 0
+        return get_heartbeat(self.port, 'idle_timeout')
 
-    def read_header(self, header):
-        self._header = header
-        parts = unpack("2I32sdII", self._header)
-        from socket import ntohl
 
-        (self._type, self._id, self._md5,
-            self._timestamp, self._length, self._ip) = parts
+    def get_active(self):
+        return self._reader.get_read_time()
 
-        self._type = ntohl(self._type)
-        self._id = ntohl(self._id)
-        self._length = ntohl(self._length)
-        self._ip = socket.inet_ntoa(pack('I', ntohl(self._ip)))
 
-        logging.debug('read header(%d, %d, %s, %f, %d, %s) from %s' % (
-            self._type, self._id, self._md5,
-            self._timestamp, self._length, self._ip,
-            self._addr_str))
+    def load_limits(self):
+        self._max_inflight = get_limit(self._function, 'max_inflight')
+        self._max_buffered = get_limit(self._function, 'max_buffered')
 
-        self._stream.read_bytes(self._length, self.read_body)
 
+    def is_saturated(self):
+        return (self._streaming is not None or
+            len(self._pending) >= self._max_inflight or
+            self._writer.get_buffered_size() >= self._max_buffered)
 
-    def read_body(self, body):
-        logging.debug('read body(%d:%s) from %s' % (len(body),
-            body, self._addr_str))
-        self._body = body
 
-        self._stream.read_bytes(BusinessConnection.header_length, self.read_header)
-        
-        #TODO:
-        #self.send_feedback()
+    def drain(self):
+        """forward waiting requests while the pool has capacity"""
+        if not self._registed:
+            return
+        if self._streaming is not None:
+            if self._streaming._piping is None:
+                # client closed midway, business read the last pads
+                self.pad()
+            else:
+                # business read what was piped, let the client send more
+                self._streaming.resume()
+            return
+        pool = routing.get_pool(self._function)
+        waiting = pool.waiting
+        while waiting:
+            conn = pool.select()
+            if conn is not None and conn.is_saturated():
+                break
+            client, header, packet, trace = waiting.popleft()
+            if client._stream.closed():
+                continue
+            client.resume()
+            if conn is None:
+                client.send_error(header, 'no business server is available')
+            elif not conn.forward(client, header, packet, trace):
+                client.send_error(header, 'too many pending requests')
+
+
+    def get_inflight(self):
+        return len(self._pending)
+
+
+    def get_latency(self):
+        return self._latency
+
+
+    def update_latency(self, latency):
+        self._latency += LATENCY_ALPHA * (latency - self._latency)
 
 
     def send_feedback(self, status=0, reason="send successfully"):
@@ -143,40 +448,214 @@ class BusinessConnection(object):
         reply['reason'] = reason
 
         reply_str = json.dumps(reply)
-        header = pack("I", socket.htonl(len(reply_str)))
-        self._stream.write(header + reply_str)
+        self._writer.write(FEEDBACK_HEADER.pack(len(reply_str)), reply_str)
+
+
+    def forward(self, client, header, msg, trace=False):
+        """forward client packet and track it until business replies"""
+        request = header[2]
+        coalesced = request in get_coalesced()
+        body_key = generation = None
+        if CACHE.is_cached(request):
+            generation = CACHE.get_generation()
+        if coalesced or generation is not None:
+            body_key = get_key(request, msg[CLIENT_HEADER.size:])
+            # an identical request may have been forwarded while msg waited
+            if coalesced and BusinessConnection.join(client, header, body_key):
+                return True
+
+        BusinessConnection.sequence += 1
+        if self._protocol > 1:
+            key = BusinessConnection.sequence
+        else:
+            verify = hashlib.md5()
+            verify.update(msg)
+            verify.update(SEQUENCE.pack(BusinessConnection.sequence))
+            key = verify.hexdigest()
+
+        req, evicted = BusinessConnection.pending.add(key, client, self, header,
+            get_timeout(request))
+        if evicted is not None:
+            BusinessConnection.evict(evicted)
+        if req is None:
+            return False
+        req.body_key = body_key
+        req.generation = generation
+        req.trace = trace
+        if coalesced:
+            BusinessConnection.flights[body_key] = req
+        FUNCTIONS[self._function].forwarded += 1
+        if self._protocol > 1:
+            self.send_v2(msg, client._type, client._ip16, key, trace)
+        else:
+            self.send(msg, client._type, client._ip4, key, trace)
+        return True
+
 
+    def forward_stream(self, client, header, head, length, trace=False):
+        """forward packet of length bytes whose body is still to come
 
-    def send(self, msg, device_type=1, ip_str='127.0.0.1'):
-        from socket import htonl
+        head is the client header, the body is written by pipe as it
+        arrives and nothing else is forwarded to this connection meanwhile.
+        Return pipe, None if client has too many pending requests.
+        """
+        request = header[2]
+        BusinessConnection.sequence += 1
+        if self._protocol > 1:
+            key = BusinessConnection.sequence
+        else:
+            verify = hashlib.md5()
+            verify.update(head)
+            verify.update(SEQUENCE.pack(BusinessConnection.sequence))
+            key = verify.hexdigest()
+
+        req, evicted = BusinessConnection.pending.add(key, client, self, header,
+            get_timeout(request))
+        if evicted is not None:
+            BusinessConnection.evict(evicted)
+        if req is None:
+            return None
+        req.trace = trace
+        FUNCTIONS[self._function].forwarded += 1
+        if self._protocol > 1:
+            # no checksum, the body is not there yet
+            self._writer.write(ROUTE_HEADER_V2.pack(client._type, 0, length, key,
+                get_monotonic_us(), client._ip16, 0), head)
+        else:
+            self._writer.write(ROUTE_HEADER.pack(client._type, 1, key,
+                encode_timestamp(time.time()), length, client._ip4), head)
+        if trace:
+            logger.debug('stream %d bytes of request %d to %s', length, request,
+                self._addr_str)
+
+        self._streaming = client
+        self._stream_remaining = length - len(head)
+        client._piping = self
+        return self.pipe
+
+
+    def pipe(self, chunk):
+        """sink of the body streamed to this connection, see FrameReader"""
+        client = self._streaming
+        if client is None:
+            # business closed midway, the rest of the body goes nowhere
+            return
+        if chunk is None:
+            self.end_stream()
+            return
+        self._stream_remaining -= len(chunk)
+        self._writer.write(chunk)
+        if self._writer.get_buffered_size() >= self._max_buffered:
+            # resumed by drain once business read it
+            client._reader.pause()
+
+
+    def abort_stream(self):
+        """client closed midway: pad the packet to its length, its reply is dropped
+
+        Pads are written as business reads them, like the body would be,
+        and the connection stays saturated until the packet is complete.
+        """
+        self._streaming._piping = None
+        self.pad()
+
+
+    def pad(self):
+        """write pads up to max_buffered, drain writes more once they are read"""
+        while (self._stream_remaining > 0 and
+                self._writer.get_buffered_size() < self._max_buffered):
+            size = min(self._stream_remaining, PAD_SIZE)
+            self._writer.write('\0' * size)
+            self._stream_remaining -= size
+        if self._stream_remaining <= 0:
+            self.end_stream()
+
+
+    def end_stream(self):
+        client = self._streaming
+        self._streaming = None
+        self._stream_remaining = 0
+        client._piping = None
+        held, self._held = self._held, None
+        for msg in held or ():
+            self.write_command(msg)
+        client.resume()
+        self.drain()
+
+
+    def send(self, msg, device_type=1, ip=NO_IP, md5=None, trace=False):
+        """send msg in a protocol 1 packet, ip is encoded by encode_ip"""
         device_id = 1 # id is unuseful
         timestamp = time.time()
-        ip = unpack("I", socket.inet_aton(ip_str))[0]
-        import hashlib
-        verify = hashlib.md5()
-        verify.update(msg)
-        md5 = verify.hexdigest()
+        if md5 is None:
+            verify = hashlib.md5()
+            verify.update(msg)
+            md5 = verify.hexdigest()
         length = len(msg)
         
-        header = pack("2I32sdII", htonl(device_type),
-            htonl(device_id), md5, timestamp,
-            htonl(length), htonl(ip))
-        logging.debug('send header:(%d, %d, %s, %.4f, %d, %s) to %s'
-            % (device_type, device_id, md5, timestamp,
-               length, ip_str, self._addr_str))
-
-        self._stream.write(header + msg)
-        logging.debug('send msg:%s to %s' % (msg, self._addr_str))
+        header = ROUTE_HEADER.pack(device_type, device_id, md5,
+            encode_timestamp(timestamp), length, ip)
+        self._writer.write(header, msg)
+
+        if trace:
+            logger.debug('send header:(%d, %d, %s, %.4f, %d, %s) to %s',
+                device_type, device_id, md5, timestamp,
+                length, decode_ip(ip), self._addr_str)
+            logger.debug('send msg:%s to %s', msg, self._addr_str)
+
+
+    def send_v2(self, msg, device_type, ip16, key, trace=False):
+        """send msg in a protocol 2 packet, ip16 is encoded by encode_ip16"""
+        flags = checksum = 0
+        if self._checksum:
+            flags = FLAG_CHECKSUM
+            checksum = get_checksum(msg)
+        timestamp = get_monotonic_us()
+        self._writer.write(ROUTE_HEADER_V2.pack(device_type, flags, len(msg),
+            key, timestamp, ip16, checksum), msg)
+
+        if trace:
+            logger.debug('send header:(%d, %d, %d, %d, %d, %s) to %s',
+                device_type, flags, len(msg), key, timestamp,
+                decode_ip16(ip16), self._addr_str)
+            logger.debug('send msg:%s to %s', msg, self._addr_str)
 
 
     def on_close(self):
         self._stream.close()
+        BusinessConnection.conns.discard(self)
+        REAPER.remove(self)
         if self._registed:
-            BusinessConnection.clients_lock.acquire()
-            BusinessConnection.clients[self._function].remove(self)
-            if len(BusinessConnection.clients[self._function]) == 0:
-                BusinessConnection.clients.pop(self._function)
-            BusinessConnection.clients_lock.release()
-            logging.info('function %s disconnected from %s' % (self._function, self._addr_str))
+            routing.unregister(self)
+            logger.info('function %s disconnected from %s', self._function, self._addr_str)
+
+        for req in BusinessConnection.pending.discard(self):
+            for client, header in BusinessConnection.land(req):
+                client.send_error(header, 'business server disconnected')
+
+        if self._streaming is not None:
+            self.end_stream()
+
+        # waiting requests move to the other connections, or fail
+        self.drain()
+
+
+
+
+def invalidate(business, command):
+    """{"cmd" : "invalidate", "requests" : [code, ...]}, every code without requests"""
+    requests = command.get('requests')
+    CACHE.invalidate(requests)
+    logger.info('invalidate cached %s from %s', requests or 'requests',
+        business._function)
+
+
+BusinessConnection.add_command('invalidate', invalidate)
+
+
+def heartbeat(business, command):
+    """{"cmd" : "heartbeat"}, answered so the module knows route is there"""
+    business.send_command({'cmd' : 'heartbeat'})
 
 
+BusinessConnection.add_command('heartbeat', heartbeat)
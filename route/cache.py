@@ -0,0 +1,166 @@
+#coding=utf-8
+
+"""replies cached by route, see [cache] of route.ini
+
+A reply is cached under its request code and the digest of the request
+body, for the ttl of the code, and served to every client asking the
+same until it expires, it is evicted, least recently used first, to
+stay under max_bytes, or the business module invalidates it with the
+command {"cmd" : "invalidate", "requests" : [code, ...]}.
+
+Error replies, json objects whose status is not 0, are never cached. A
+reply to a request forwarded before an invalidate of its code is not
+cached either: the request takes the generation of the cache when it
+is forwarded and put drops the reply if its code was invalidated since.
+"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+__all__ = ['ResponseCache', 'CACHE', 'get_key']
+
+import time
+import json
+import hashlib
+from collections import OrderedDict
+
+import config
+from metrics import registry, Counter
+
+# bytes counted per entry besides key and reply
+ENTRY_OVERHEAD = 200
+
+OUTCOMES = registry.family('cache', Counter)
+
+
+def get_key(request, body):
+    """cache key of a request code and its body, client header excluded"""
+    return (request, hashlib.md5(body).digest())
+
+
+def is_error(reply):
+    """whether reply is a json object with a status other than 0"""
+    if not reply.startswith('{'):
+        return False
+    try:
+        return json.loads(reply).get('status', 0) != 0
+    except ValueError:
+        return False
+
+
+class ResponseCache(object):
+
+    def __init__(self, ttls=None, max_bytes=0):
+        self._entries = OrderedDict() # key : (reply, expires), oldest used first
+        self._requests = {} # request : keys
+        self._size = 0
+        self._generation = 0 # invalidates so far
+        self._invalidated = {} # request : generation of its last invalidate
+        self._flushed = 0 # generation of the last invalidate of all requests
+        self.configure(ttls or {}, max_bytes)
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def configure(self, ttls, max_bytes):
+        """replies of requests no longer cached are dropped"""
+        self.ttls = ttls
+        self.max_bytes = max_bytes
+        for request in self._requests.keys():
+            if request not in ttls:
+                self.invalidate([request])
+        self._evict()
+
+
+    def is_cached(self, request):
+        return request in self.ttls
+
+
+    def get_size(self):
+        return self._size
+
+
+    def get_generation(self):
+        """taken by a request when it is forwarded, see put"""
+        return self._generation
+
+
+    def get(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            OUTCOMES['miss'].inc()
+            return None
+        if entry[1] <= time.time():
+            OUTCOMES['expired'].inc()
+            self._forget(key, entry)
+            return None
+        # most recently used last
+        self._entries[key] = entry
+        OUTCOMES['hit'].inc()
+        return entry[0]
+
+
+    def put(self, key, reply, generation=None):
+        """cache reply of the request forwarded at generation, None is now"""
+        request = key[0]
+        ttl = self.ttls.get(request)
+        if not ttl:
+            return
+        if generation is not None and (generation < self._flushed or
+                generation < self._invalidated.get(request, 0)):
+            OUTCOMES['stale'].inc()
+            return
+        if is_error(reply):
+            OUTCOMES['error'].inc()
+            return
+        size = len(reply) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old[0]) + ENTRY_OVERHEAD
+        self._entries[key] = (reply, time.time() + ttl)
+        self._requests.setdefault(request, set()).add(key)
+        self._size += size
+        OUTCOMES['store'].inc()
+        self._evict()
+
+
+    def invalidate(self, requests=None):
+        """drop the replies of requests, all of them if None"""
+        self._generation += 1
+        if requests is None:
+            self._flushed = self._generation
+            self._invalidated.clear()
+            requests = self._requests.keys()
+        else:
+            for request in requests:
+                self._invalidated[request] = self._generation
+        for request in requests:
+            for key in self._requests.pop(request, ()):
+                entry = self._entries.pop(key)
+                self._size -= len(entry[0]) + ENTRY_OVERHEAD
+        OUTCOMES['invalidate'].inc()
+
+
+    def _forget(self, key, entry):
+        """account for entry, already popped from _entries"""
+        self._size -= len(entry[0]) + ENTRY_OVERHEAD
+        keys = self._requests[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._requests[key[0]]
+
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._entries:
+            key, entry = self._entries.popitem(last=False)
+            self._forget(key, entry)
+            OUTCOMES['evict'].inc()
+
+
+# cache of this route process
+CACHE = ResponseCache(config.get_cache_ttls(), config.get_cache_max_bytes())
+
+registry.gauge('cache_bytes', CACHE.get_size)
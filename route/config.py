@@ -6,7 +6,10 @@
 
 __author__ = "Yingqi Jin <jinyingqi@luoha.com>"
 
-__all__ = ['get_server', 'get_server_intro', 'read_config']
+__all__ = ['get_server', 'get_server_intro', 'get_balancer', 'get_routes',
+    'get_limit', 'get_timeout', 'get_cache_ttls', 'get_cache_max_bytes',
+    'get_coalesced', 'get_rate_limit', 'get_rate_exempt', 'get_frame_limit',
+    'get_heartbeat', 'read_config', 'reload_config', 'parse_config']
 
 
 import os
@@ -16,6 +19,42 @@ import logging
 
 ROOT = os.path.dirname(os.path.abspath(__file__))
 
+# seconds a forwarded request waits for its reply
+DEFAULT_TIMEOUT = 30
+
+# memory of the replies cached by route, see [cache] of route.ini
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+# backpressure limits of one business server
+DEFAULT_LIMITS = {
+    'max_inflight' : 1000, # requests forwarded to one connection without reply
+    'max_buffered' : 4 * 1024 * 1024, # bytes waiting to be sent to one connection
+    'max_queue' : 10000, # requests waiting for a connection below its limits
+}
+
+# token bucket limits of each client port type, a rate of 0 is no limit
+DEFAULT_RATE_LIMITS = {
+    'device_rate' : 0, # requests per second of one device
+    'device_burst' : 0, # requests of one device at once, default is its rate
+    'ip_rate' : 0, # requests per second from one source ip
+    'ip_burst' : 0,
+    'port_rate' : 0, # requests per second of all connections of the port
+    'port_burst' : 0,
+    'max_delay' : 0, # seconds a request over the limit may wait, 0 sheds it
+}
+
+# packet sizes of each port: box, app, erp, init and business
+DEFAULT_FRAME_LIMITS = {
+    'max_length' : 16 * 1024 * 1024, # longer packets close their connection
+    'stream_length' : 1024 * 1024, # longer bodies are piped, 0 never
+}
+
+# heartbeats of each port: box, app, erp, init and business
+DEFAULT_HEARTBEATS = {
+    'interval' : 30, # seconds between heartbeats of business modules
+    'idle_timeout' : 0, # seconds without a packet before closing, 0 never
+}
+
 
 class Singleton(object):
     def __new__(cls, *args, **kw):
@@ -25,38 +64,206 @@ class Singleton(object):
         return cls._instance
 
 
+def parse_config(ini_file):
+    """parse and validate ini_file, return its maps
+
+    raise ValueError if the file is missing or invalid.
+    """
+    if not os.path.exists(ini_file):
+        raise ValueError('config %s does not exsit' % ini_file)
+    cf = ConfigParser.ConfigParser()
+    try:
+        cf.read(ini_file)
+    except ConfigParser.Error, e:
+        raise ValueError('config %s is invalid: %s' % (ini_file, e))
+    secs = cf.sections()
+
+    server_intro_map = {}
+    request_server_map = {}
+    request_function_map = {}
+    server_balancer_map = {}
+    server_limit_map = {}
+    request_timeout_map = {}
+    request_cache_map = {}
+    cache_max_bytes = DEFAULT_CACHE_BYTES
+    coalesced_requests = set()
+    rate_limit_map = {}
+    rate_exempt = set()
+    frame_limit_map = {}
+    heartbeat_map = {}
+
+    if 'server' not in secs:
+        raise ValueError('config %s has no server section' % ini_file)
+    opts = cf.options('server')
+    for opt in opts:
+        str_val = cf.get('server', opt)
+        server_intro_map[opt] = str_val
+
+    for sev in server_intro_map.iterkeys():
+        if sev in secs:
+            opts = cf.options(sev)
+            for opt in opts:
+                str_val = cf.get(sev, opt)
+                try:
+                    request = int(opt)
+                except ValueError:
+                    raise ValueError('invalid request %s in %s' % (opt, sev))
+                if request in request_server_map:
+                    raise ValueError('request %d in both %s and %s' % (
+                        request, request_server_map[request], sev))
+                request_function_map[request] = str_val
+                request_server_map[request] = sev
+
+    if 'balancer' in secs:
+        for opt in cf.options('balancer'):
+            server_balancer_map[opt] = cf.get('balancer', opt)
+
+    if 'backpressure' in secs:
+        for opt in cf.options('backpressure'):
+            if opt.split('.')[-1] not in DEFAULT_LIMITS:
+                raise ValueError('unsupported backpressure limit %s' % opt)
+            try:
+                server_limit_map[opt] = int(cf.get('backpressure', opt))
+            except ValueError:
+                raise ValueError('invalid backpressure limit %s' % opt)
+
+    if 'ratelimit' in secs:
+        for opt in cf.options('ratelimit'):
+            value = cf.get('ratelimit', opt)
+            if opt == 'exempt':
+                try:
+                    rate_exempt = set(int(request) for request in value.split(',')
+                        if request.strip())
+                except ValueError:
+                    raise ValueError('invalid ratelimit exempt %s' % value)
+                continue
+            if opt.split('.')[-1] not in DEFAULT_RATE_LIMITS:
+                raise ValueError('unsupported ratelimit %s' % opt)
+            try:
+                rate_limit_map[opt] = float(value)
+            except ValueError:
+                raise ValueError('invalid ratelimit %s' % opt)
+            if rate_limit_map[opt] < 0:
+                raise ValueError('invalid ratelimit %s' % opt)
+
+    if 'frame' in secs:
+        for opt in cf.options('frame'):
+            if opt.split('.')[-1] not in DEFAULT_FRAME_LIMITS:
+                raise ValueError('unsupported frame limit %s' % opt)
+            try:
+                frame_limit_map[opt] = int(cf.get('frame', opt))
+            except ValueError:
+                raise ValueError('invalid frame limit %s' % opt)
+            if frame_limit_map[opt] < 0:
+                raise ValueError('invalid frame limit %s' % opt)
+
+    if 'heartbeat' in secs:
+        for opt in cf.options('heartbeat'):
+            if opt.split('.')[-1] not in DEFAULT_HEARTBEATS:
+                raise ValueError('unsupported heartbeat %s' % opt)
+            try:
+                heartbeat_map[opt] = float(cf.get('heartbeat', opt))
+            except ValueError:
+                raise ValueError('invalid heartbeat %s' % opt)
+            if heartbeat_map[opt] < 0:
+                raise ValueError('invalid heartbeat %s' % opt)
+
+    # every request gets its own timeout: request, then server, then default
+    timeouts = {}
+    if 'timeout' in secs:
+        for opt in cf.options('timeout'):
+            try:
+                timeouts[opt] = float(cf.get('timeout', opt))
+            except ValueError:
+                raise ValueError('invalid timeout %s' % opt)
+            if timeouts[opt] <= 0:
+                raise ValueError('invalid timeout %s' % opt)
+    default = timeouts.get('default', DEFAULT_TIMEOUT)
+    for request, sev in request_server_map.iteritems():
+        request_timeout_map[request] = timeouts.get(str(request),
+            timeouts.get(sev, default))
+    request_timeout_map['default'] = default
+
+    # cached requests: ttl of request, then of server, 0 is not cached
+    ttls = {}
+    if 'cache' in secs:
+        for opt in cf.options('cache'):
+            try:
+                value = float(cf.get('cache', opt))
+            except ValueError:
+                raise ValueError('invalid cache %s' % opt)
+            if value < 0:
+                raise ValueError('invalid cache %s' % opt)
+            if opt == 'max_bytes':
+                cache_max_bytes = int(value)
+            else:
+                ttls[opt] = value
+    for request, sev in request_server_map.iteritems():
+        ttl = ttls.get(str(request), ttls.get(sev, 0))
+        if ttl > 0:
+            request_cache_map[request] = ttl
+
+    # coalesced requests: flag of request, then of server
+    flags = {}
+    if 'coalesce' in secs:
+        for opt in cf.options('coalesce'):
+            try:
+                flags[opt] = cf.getboolean('coalesce', opt)
+            except ValueError:
+                raise ValueError('invalid coalesce %s' % opt)
+    for request, sev in request_server_map.iteritems():
+        if flags.get(str(request), flags.get(sev, False)):
+            coalesced_requests.add(request)
+
+    return {
+        'server_intro_map' : server_intro_map,
+        'request_server_map' : request_server_map,
+        'request_function_map' : request_function_map,
+        'server_balancer_map' : server_balancer_map,
+        'server_limit_map' : server_limit_map,
+        'request_timeout_map' : request_timeout_map,
+        'request_cache_map' : request_cache_map,
+        'cache_max_bytes' : cache_max_bytes,
+        'coalesced_requests' : coalesced_requests,
+        'rate_limit_map' : rate_limit_map,
+        'rate_exempt' : rate_exempt,
+        'frame_limit_map' : frame_limit_map,
+        'heartbeat_map' : heartbeat_map,
+    }
+
+
 class Configure(Singleton):
 
     def __init__(self, ini_file):
+        self.ini_file = ini_file
         self.server_intro_map = {}
         self.request_server_map = {}
         self.request_function_map = {}
+        self.server_balancer_map = {}
+        self.server_limit_map = {}
+        self.request_timeout_map = {'default' : DEFAULT_TIMEOUT}
+        self.request_cache_map = {}
+        self.cache_max_bytes = DEFAULT_CACHE_BYTES
+        self.coalesced_requests = set()
+        self.rate_limit_map = {}
+        self.rate_exempt = set()
+        self.frame_limit_map = {}
+        self.heartbeat_map = {}
 
         self.read_config(ini_file)
 
 
     def read_config(self, ini_file='route.ini'):
-        if not os.path.exists(ini_file):
-            logging.error('config %s does not exsit' % fname)
-            return
-        cf = ConfigParser.ConfigParser()
-        cf.read(ini_file)
-        secs = cf.sections()
-        
-        if 'server' in secs:
-            opts = cf.options('server')
-            for opt in opts:
-                str_val = cf.get('server', opt)
-                self.server_intro_map[opt] = str_val
-
-        for sev in self.server_intro_map.iterkeys():
-            if sev in secs:
-                opts = cf.options(sev)
-                for opt in opts:
-                    str_val = cf.get(sev, opt)
-                    request = int(opt)
-                    self.request_function_map[request] = str_val
-                    self.request_server_map[request] = sev
+        try:
+            self.update(parse_config(ini_file))
+        except ValueError, e:
+            logging.error(str(e))
+
+
+    def update(self, maps):
+        """replace all maps at once"""
+        for name, val in maps.iteritems():
+            setattr(self, name, val)
 
 
     def get_all_server(self):
@@ -67,10 +274,60 @@ class Configure(Singleton):
         return self.request_server_map.get(request, None)
 
 
+    def get_routes(self):
+        return dict(self.request_server_map)
+
+
     def get_server_intro(self, server):
         return self.server_intro_map.get(server, None)
 
 
+    def get_balancer(self, server):
+        default = self.server_balancer_map.get('default', 'least')
+        return self.server_balancer_map.get(server, default)
+
+
+    def get_timeout(self, request):
+        timeouts = self.request_timeout_map
+        return timeouts.get(request) or timeouts['default']
+
+
+    def get_limit(self, server, name):
+        default = self.server_limit_map.get(name, DEFAULT_LIMITS[name])
+        return self.server_limit_map.get('%s.%s' % (server, name), default)
+
+
+    def get_cache_ttls(self):
+        return self.request_cache_map
+
+
+    def get_cache_max_bytes(self):
+        return self.cache_max_bytes
+
+
+    def get_coalesced(self):
+        return self.coalesced_requests
+
+
+    def get_rate_limit(self, port, name):
+        default = self.rate_limit_map.get(name, DEFAULT_RATE_LIMITS[name])
+        return self.rate_limit_map.get('%s.%s' % (port, name), default)
+
+
+    def get_rate_exempt(self):
+        return self.rate_exempt
+
+
+    def get_frame_limit(self, port, name):
+        default = self.frame_limit_map.get(name, DEFAULT_FRAME_LIMITS[name])
+        return self.frame_limit_map.get('%s.%s' % (port, name), default)
+
+
+    def get_heartbeat(self, port, name):
+        default = self.heartbeat_map.get(name, DEFAULT_HEARTBEATS[name])
+        return self.heartbeat_map.get('%s.%s' % (port, name), default)
+
+
 __configure = Configure(os.path.join(ROOT, '../route.ini'))
 
 
@@ -82,14 +339,75 @@ def get_server(request):
     return __configure.get_server(request)
 
 
+def get_routes():
+    return __configure.get_routes()
+
+
 def get_server_intro(server):
     return __configure.get_server_intro(server)
 
 
+def get_balancer(server):
+    return __configure.get_balancer(server)
+
+
+def get_timeout(request):
+    return __configure.get_timeout(request)
+
+
+def get_limit(server, name):
+    return __configure.get_limit(server, name)
+
+
+def get_cache_ttls():
+    """request : seconds its replies are cached"""
+    return __configure.get_cache_ttls()
+
+
+def get_cache_max_bytes():
+    return __configure.get_cache_max_bytes()
+
+
+def get_coalesced():
+    """requests whose identical copies in flight share one reply"""
+    return __configure.get_coalesced()
+
+
+def get_rate_limit(port, name):
+    """name of DEFAULT_RATE_LIMITS for port box, app, erp or init"""
+    return __configure.get_rate_limit(port, name)
+
+
+def get_rate_exempt():
+    """requests never rate limited, eg. fire warnings"""
+    return __configure.get_rate_exempt()
+
+
+def get_frame_limit(port, name):
+    """name of DEFAULT_FRAME_LIMITS for port box, app, erp, init or business"""
+    return __configure.get_frame_limit(port, name)
+
+
+def get_heartbeat(port, name):
+    """name of DEFAULT_HEARTBEATS for port box, app, erp, init or business"""
+    return __configure.get_heartbeat(port, name)
+
+
 def read_config(fname):
     __configure.read_config(fname)
 
 
+def reload_config(maps, ini_file=None):
+    """install maps returned by parse_config, read from ini_file if given"""
+    __configure.update(maps)
+    if ini_file is not None:
+        __configure.ini_file = ini_file
+
+
+def get_ini_file():
+    return __configure.ini_file
+
+
 if __name__ == '__main__':
 
     print get_server(10001)
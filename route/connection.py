@@ -6,146 +6,388 @@ __author__ = "Yingqi Jin <jinyingqi@luoha.com>"
 
 import json
 import time
-import socket
 import logging
-import threading
-from struct import pack, unpack
+from tornado.ioloop import IOLoop
 
-from config import get_server
-from bconnection import BusinessConnection
+import routing
+from logqueue import tracing
+from config import get_limit, get_coalesced, get_rate_exempt, get_frame_limit
+from config import get_heartbeat
+from metrics import registry, Traffic, Counter
+from bconnection import BusinessConnection, FUNCTIONS
+from pending import NO_PENDING
+from cache import CACHE, get_key
+from ratelimit import LIMITERS
+from reaper import REAPER
+from framing import FrameReader, FrameWriter, CLIENT_HEADER, CLIENT_LENGTH_INDEX
+from framing import encode_ip, encode_ip16, HEARTBEAT_REQUEST
 
-HEADER_LENGTH = 24
+HEADER_LENGTH = CLIENT_HEADER.size
+
+# device type of each port
+DEVICE_TYPES = {'app' : 1, 'box' : 2, 'erp' : 3, 'init' : 4}
+
+logger = logging.getLogger(__name__)
+
+# traffic of each port type and each request code, see get_traffic
+PORTS = registry.family('port', Traffic)
+REQUESTS = registry.family('request', Traffic)
+
+# requests of each port type whose body was piped to business
+STREAMED = registry.family('streamed', Counter)
 
 def get_addr_str(addr):
     return '%s:%d' % (addr[0], addr[1])
 
 
+def get_traffic(request):
+    """traffic of request, codes route does not serve share 'other'
+
+    A client may send any code, it must not add metrics at will.
+    """
+    if request == HEARTBEAT_REQUEST or routing.is_routed(request):
+        return REQUESTS[request]
+    return REQUESTS['other']
+
+
 class Connection(object):
-    clients = set()
+    """client connection of one port type
+
+    Instances are kept compact, big venues keep tens of thousands of
+    them open: no __dict__, nothing of a request kept once it is routed
+    but its header, and one registry, clients of its port type.
+    """
+    __slots__ = ('_stream', '_address', '_header', '_indexed', '_piping',
+        '_pending', '_ip4', '_ip16', '_writer', '_reader', '_idle')
+    clients = dict((port, set()) for port in DEVICE_TYPES) # port : connections
     header_length = HEADER_LENGTH 
+    port = 'app' # overwritten by each port type
+    traffic = None # Traffic of the port type, set by each of them
+    limiter = LIMITERS['app'] # overwritten by each port type
+    _type = 1 # app:1 box:2 erp:3 init:4, overwritten by each port type
+    devices = {} # (type, device) : connections, the latest last
+    ips = {} # source ip : connections
 
     @classmethod
     def clean_connection(cls):
-        for cli in cls.clients:
-            cli._stream.close()
-
-    def __init__(self, stream, address):
-        Connection.clients.add(self)
-        self._stream = stream
-        self._address = address
-        self._addr_str = get_addr_str(self._address) 
-        self._type = 1 # app:1 box:2 erp:3 init:4
-        self._registed = False
-
-        self._header = ''
-        self._body = ''
-        self._author = ''
-        self._version = ''
-        self._request = 0
-        self._length = 0
-        self._verify = 0
-        self._device = 0
+        for conns in cls.clients.itervalues():
+            for cli in list(conns):
+                cli._stream.close()
 
-        self._stream.set_close_callback(self.on_close)
 
-        self._stream.read_bytes(Connection.header_length, self.read_header)
+    @classmethod
+    def get_clients(cls, port):
+        """connections of port type, box, app, erp or init"""
+        return cls.clients[port]
 
 
-    def set_type(self, device_type):
-        self._type = device_type
+    @classmethod
+    def get_device(cls, device_type, device):
+        """latest connection of device, None if it is not connected"""
+        conns = cls.devices.get((device_type, device))
+        return conns[-1] if conns else None
 
 
-    def read_header(self, header):
-        self._header = header
-        parts = unpack("6I", self._header)
-        from socket import ntohl
-        parts = [ntohl(x) for x in parts]
+    @classmethod
+    def get_devices(cls, device_type, device):
+        """all connections of device, eg. the apps of one room"""
+        return cls.devices.get((device_type, device), ())
 
-        (self._author, self._version, self._request,
-            self._verify, self._length, self._device) = parts
-        logging.debug('read header(%d, %d, %d, %d, %d, %d) from %s' % (
-            self._author, self._version, self._request,
-            self._verify, self._length, self._device,
-            self._addr_str))
 
-        self._stream.read_bytes(self._length, self.read_body)
+    @classmethod
+    def get_ip(cls, ip):
+        return cls.ips.get(ip, ())
 
+    def __init__(self, stream, address):
+        Connection.clients[self.port].add(self)
+        self._stream = stream
+        self._address = address
+        self._pending = NO_PENDING # keys of requests waiting for reply
 
-    def read_body(self, body):
-        logging.debug('read body(%s) from %s' % (body, self._addr_str))
-        self._body = body
+        # author, version, request, verify, device of the last request
+        self._header = None
+        self._indexed = None # device the connection is indexed by
+        self._piping = None # business connection the body being read goes to
 
-        business = get_server(self._request)        
+        self._stream.set_close_callback(self.on_close)
 
-        BusinessConnection.clients_lock.acquire()
-        if business in BusinessConnection.clients:
-            logging.debug('forward request to %s' % business)
-            conn = BusinessConnection.clients[business].pop()
-            BusinessConnection.clients[business].add(conn)
-            conn.send(self._header + self._body, self._type, self._address[0])
+        self._writer = FrameWriter(self._stream)
+        self._reader = FrameReader(self._stream, CLIENT_HEADER,
+            CLIENT_LENGTH_INDEX, self.read_packet)
+        self._reader.set_limits(get_frame_limit(self.port, 'max_length'),
+            get_frame_limit(self.port, 'stream_length'), self.read_stream)
+        self._reader.start()
+
+        Connection.ips.setdefault(address[0], set()).add(self)
+        self._ip4 = encode_ip(address[0]) # source ip in protocol 1 packets
+        self._ip16 = encode_ip16(address[0]) # and in protocol 2 ones
+        REAPER.add(self) # sets _idle
+        logger.debug('new %s connection # %d from %s', self.port,
+            len(Connection.clients[self.port]), self._addr_str)
+
+
+    @property
+    def _addr_str(self):
+        # only logs use it, not worth keeping per connection
+        return get_addr_str(self._address)
+
+
+    def get_header(self):
+        """header fields echoed back in the reply"""
+        return self._header
+
+
+    def get_idle_timeout(self):
+        return get_heartbeat(self.port, 'idle_timeout')
+
+
+    def get_active(self):
+        return self._reader.get_read_time()
+
+
+    def set_header(self, header):
+        """keep the fields of client header echoed back, return request code"""
+        author, version, request, verify, length, device = header
+        self._header = (author, version, request, verify, device)
+        if device != self._indexed:
+            self.index_device(device)
+        return request
+
+
+    def read_packet(self, header, packet):
+        request = self.set_header(header)
+        self.traffic.read(len(packet))
+        get_traffic(request).read(len(packet))
+        if request == HEARTBEAT_REQUEST:
+            # keeps the connection open, answered here, never forwarded
+            self.send(self._header, '')
+            return
+
+        trace = tracing(logger, request)
+        if trace:
+            logger.debug('read header(%d, %d, %d, %d, %d, %d) from %s',
+                header[0], header[1], header[2], header[3], header[4], header[5],
+                self._addr_str)
+            logger.debug('read body(%s) from %s', packet[HEADER_LENGTH:], self._addr_str)
+
+        if self.limiter.is_limited() and request not in get_rate_exempt():
+            wait = self.limiter.admit(header[5], self._address[0], time.time())
+            if wait is None:
+                logger.debug('shed request %d from %s over rate limit',
+                    request, self._addr_str)
+                self.send_error(self.get_header(), 'too many requests')
+                return
+            if wait:
+                # read nothing more from this client until its packet is routed
+                self._reader.pause()
+                IOLoop.current().call_later(wait, self.route_later, packet, trace)
+                return
+
+        self.route(packet, trace)
+
+
+    def read_stream(self, header, head):
+        """request too long to be read whole, return the sink of its body
+
+        The body is piped to a business connection as it arrives, it is
+        never cached, coalesced or delayed. None skips the body.
+        """
+        request = self.set_header(header)
+        trace = tracing(logger, request)
+        length = HEADER_LENGTH + header[CLIENT_LENGTH_INDEX]
+        self.traffic.read(length)
+        get_traffic(request).read(length)
+
+        if (self.limiter.is_limited() and request not in get_rate_exempt() and
+                self.limiter.admit(header[5], self._address[0], time.time()) is None):
+            self.send_error(self.get_header(), 'too many requests')
+            return None
+
+        pool = routing.ROUTES.get(request)
+        conn = pool.select() if pool is not None else None
+        if conn is None:
+            self.send_error(self.get_header(), 'no business server is available')
+            return None
+        if pool.waiting or conn.is_saturated():
+            # a body on its way can not wait in the queue
+            FUNCTIONS[conn._function].shed += 1
+            self.send_error(self.get_header(), 'business server is busy')
+            return None
+
+        sink = conn.forward_stream(self, self.get_header(), head, length, trace)
+        if sink is None:
+            self.send_error(self.get_header(), 'too many pending requests')
+            return None
+        STREAMED[self.port].inc()
+        logger.debug('stream request %d of %d bytes from %s to %s', request,
+            length, self._addr_str, conn._function)
+        return sink
+
+
+    def route_later(self, packet, trace):
+        """route packet delayed by its rate limit"""
+        if self._stream.closed():
+            return
+        self._reader.resume()
+        self.route(packet, trace)
+
+
+    def route(self, packet, trace=False):
+        """reply from cache, join an identical request or forward packet
+
+        trace is whether the packet is traced, sampled once when read.
+        """
+        request = self._header[2]
+        cached = CACHE.is_cached(request)
+        coalesced = request in get_coalesced()
+        if cached or coalesced:
+            key = get_key(request, packet[HEADER_LENGTH:])
+            reply = CACHE.get(key) if cached else None
+            if reply is not None:
+                if trace:
+                    logger.debug('reply %d from cache', request)
+                self.send(self.get_header(), reply, trace)
+                return
+            if coalesced and BusinessConnection.join(self, self.get_header(), key):
+                if trace:
+                    logger.debug('wait for identical request %d in flight', request)
+                return
+
+        pool = routing.ROUTES.get(request)
+        conn = pool.select() if pool is not None else None
+        if conn is None:
+            logger.debug('no business server is avaliable for %d', request)
+            self.send_error(self.get_header(), 'no business server is available')
+        elif pool.waiting or conn.is_saturated():
+            self.wait(pool, conn._function, packet, trace)
         else:
-            logging.debug('no %s business server is avaliable' % business)
-        BusinessConnection.clients_lock.release()
-
-        self._stream.read_bytes(Connection.header_length, self.read_header)
+            if trace:
+                logger.debug('forward request to %s', conn._function)
+            if not conn.forward(self, self.get_header(), packet, trace):
+                self.send_error(self.get_header(), 'too many pending requests')
+
+
+    def index_device(self, device):
+        """index by the device of the first packet, or of a new one"""
+        self.unindex_device()
+        self._indexed = device
+        conns = Connection.devices.setdefault((self._type, device), [])
+        if conns:
+            # reconnected before the old connection was noticed closed,
+            # or several clients of one device: the latest one wins
+            logger.info('device %d:%d connected from %s, %d more connections',
+                self._type, device, self._addr_str, len(conns))
+        conns.append(self)
+
+
+    def unindex_device(self):
+        if self._indexed is None:
+            return
+        key = (self._type, self._indexed)
+        conns = Connection.devices.get(key)
+        if conns is not None and self in conns:
+            conns.remove(self)
+            if not conns:
+                del Connection.devices[key]
+        self._indexed = None
+
+
+    def write_frame(self, frame):
+        """send a packet encoded once for many connections, eg. a push"""
+        if self._stream.closed():
+            return
+        self._writer.write(frame)
+        self.traffic.write(len(frame))
+
+
+    def wait(self, pool, function, packet, trace=False):
+        """queue packet until a connection of pool is below its limits"""
+        if len(pool.waiting) >= get_limit(function, 'max_queue'):
+            FUNCTIONS[function].shed += 1
+            self.send_error(self.get_header(), 'business server is busy')
+            return
+        FUNCTIONS[function].queued += 1
+        pool.waiting.append((self, self.get_header(), packet, trace))
+        # read nothing more from this client until its packet is forwarded
+        self._reader.pause()
+
+
+    def resume(self):
+        self._reader.resume()
+
+
+    def send(self, header, body, trace=False):
+        """send packet back with the header of its request"""
+        if self._stream.closed():
+            return
+        author, version, request, verify, device = header
+        self._writer.write(CLIENT_HEADER.pack(author, version, request,
+            verify, len(body), device), body)
+        self.traffic.write(HEADER_LENGTH + len(body))
+        get_traffic(request).write(HEADER_LENGTH + len(body))
+        if trace:
+            logger.debug('send reply(%d, %d:%s) to %s', request, len(body),
+                body, self._addr_str)
+
+
+    def send_error(self, header, reason, status=1):
+        reply = {}
+        reply['status'] = status
+        reply['reason'] = reason
+        self.send(header, json.dumps(reply))
 
 
     def on_close(self):
         self._stream.close()
-        Connection.clients.remove(self)
+        Connection.clients[self.port].remove(self)
+        REAPER.remove(self)
+        for req in BusinessConnection.pending.discard(self):
+            BusinessConnection.hand_over(req)
+        if self._piping is not None:
+            self._piping.abort_stream()
+        self.unindex_device()
+        conns = Connection.ips.get(self._address[0])
+        if conns is not None:
+            conns.discard(self)
+            if not conns:
+                del Connection.ips[self._address[0]]
+        logger.debug('%s connection %s disconnected', self.port, self._addr_str)
 
 
 class BoxConnection(Connection):
-    box_clients = set()
-    def __init__(self, stream, address):
-        Connection.__init__(self, stream, address)
-        self.set_type(2)
-        BoxConnection.box_clients.add(self)
-        logging.debug('new box connection # %d from %s' % (len(BoxConnection.box_clients), get_addr_str(address)))
-    
-    def on_close(self):
-        Connection.on_close(self)
-        BoxConnection.box_clients.remove(self)
-        logging.debug('box connection %s disconnected' % get_addr_str(self._address))
+    __slots__ = ()
+    port = 'box'
+    traffic = PORTS['box']
+    limiter = LIMITERS['box']
+    _type = DEVICE_TYPES['box']
 
 
 class AppConnection(Connection):
-    app_clients = set()
-    def __init__(self, stream, address):
-        Connection.__init__(self, stream, address)
-        self.set_type(1)
-        AppConnection.app_clients.add(self)
-        logging.debug('new app connection # %d from %s' % (len(AppConnection.app_clients), get_addr_str(address)))
-
-    def on_close(self):
-        Connection.on_close(self)
-        AppConnection.app_clients.remove(self)
-        logging.debug('app connection %s disconnected' % get_addr_str(self._address))
+    __slots__ = ()
+    port = 'app'
+    traffic = PORTS['app']
+    limiter = LIMITERS['app']
+    _type = DEVICE_TYPES['app']
 
 
 class ERPConnection(Connection):
-    erp_clients = set()
-    def __init__(self, stream, address):
-        Connection.__init__(self, stream, address)
-        self.set_type(3)
-        ERPConnection.erp_clients.add(self)
-        logging.debug('new erp connection # %d from %s' % (len(ERPConnection.erp_clients), get_addr_str(address)))
-
-    def on_close(self):
-        Connection.on_close(self)
-        ERPConnection.erp_clients.remove(self)
-        logging.debug('erp connection %s disconnected' % get_addr_str(self._address))
+    __slots__ = ()
+    port = 'erp'
+    traffic = PORTS['erp']
+    limiter = LIMITERS['erp']
+    _type = DEVICE_TYPES['erp']
 
 
 class InitConnection(Connection):
-    init_clients = set()
-    def __init__(self, stream, address):
-        Connection.__init__(self, stream, address)
-        self.set_type(4)
-        InitConnection.init_clients.add(self)
-        logging.debug('new init connection # %d from %s' % (len(InitConnection.init_clients), get_addr_str(address)))
-
-    def on_close(self):
-        Connection.on_close(self)
-        InitConnection.init_clients.remove(self)
-        logging.debug('init connection %s disconnected' % get_addr_str(self._address))
+    __slots__ = ()
+    port = 'init'
+    traffic = PORTS['init']
+    limiter = LIMITERS['init']
+    _type = DEVICE_TYPES['init']
+
+
+registry.gauge('connections', lambda: dict([(port, len(conns))
+    for port, conns in Connection.clients.iteritems()] +
+    [('business', len(BusinessConnection.conns))]))
+registry.gauge('pending', lambda: len(BusinessConnection.pending))
+registry.gauge('devices', lambda: len(Connection.devices))
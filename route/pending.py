@@ -0,0 +1,123 @@
+#coding=utf-8
+
+"""pending request table: forwarded requests waiting for a business reply"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import time
+import logging
+from collections import OrderedDict
+
+from timerwheel import TimerWheel
+
+# upper bound of all pending requests in one route process
+MAX_PENDING = 100000
+
+# upper bound of pending requests of one client connection
+MAX_PENDING_PER_CONNECTION = 256
+
+# keys of a connection without pending requests, replaced by a set on
+# its first one: most client connections are idle
+NO_PENDING = frozenset()
+
+
+class PendingRequest(object):
+    __slots__ = ('key', 'client', 'business', 'header', 'timestamp', 'deadline',
+        'body_key', 'generation', 'waiters', 'trace')
+
+    def __init__(self, key, client, business, header, timestamp):
+        self.key = key
+        self.client = client # originating box/app/erp/init connection
+        self.business = business # business connection serving it
+        self.header = header # client header: author, version, request, verify, device
+        self.timestamp = timestamp
+        self.deadline = 0 # timer wheel handle
+        self.body_key = None # (request, body digest) of cached or coalesced requests
+        self.generation = None # of the cache when a cached request was forwarded
+        self.waiters = None # (client, header) of identical requests sharing the reply
+        self.trace = False # traced at DEBUG, sampled once when the client packet was read
+
+
+class PendingTable(object):
+    """requests keyed by the 32 bytes id of the route header
+
+    Entries are kept in insertion order, so the oldest one is evicted
+    first when the table is full. Deadlines are kept in a timer wheel,
+    expiring never scans the whole table.
+    Every connection keeps the keys it takes part in (conn._pending), so
+    a closed connection releases its entries without a scan either.
+    """
+
+    def __init__(self, capacity=MAX_PENDING,
+            per_connection=MAX_PENDING_PER_CONNECTION):
+        self._requests = OrderedDict()
+        self._timers = TimerWheel()
+        self._capacity = capacity
+        self._per_connection = per_connection
+
+
+    def __len__(self):
+        return len(self._requests)
+
+
+    def __contains__(self, key):
+        return key in self._requests
+
+
+    def add(self, key, client, business, header, timeout):
+        """track a new request for timeout seconds
+
+        return the request and the oldest one evicted to make room, if
+        the table is full, else None. The evicted one is to be answered
+        by the caller. The request is None if client has too many.
+        """
+        if len(client._pending) >= self._per_connection:
+            logging.warning('too many pending requests from %s' % client._addr_str)
+            return None, None
+
+        evicted = None
+        if len(self._requests) >= self._capacity:
+            evicted = self._requests.popitem(last=False)[1]
+            self._release(evicted)
+
+        now = time.time()
+        req = PendingRequest(key, client, business, header, now)
+        req.deadline = self._timers.add(key, now + timeout)
+        self._requests[key] = req
+        if client._pending is NO_PENDING:
+            client._pending = set()
+        client._pending.add(key)
+        business._pending.add(key)
+        return req, evicted
+
+
+    def pop(self, key):
+        req = self._requests.pop(key, None)
+        if req is not None:
+            self._release(req)
+        return req
+
+
+    def discard(self, conn):
+        """drop all requests a closed connection takes part in"""
+        reqs = [self._requests.pop(key) for key in list(conn._pending)]
+        for req in reqs:
+            self._release(req)
+        return reqs
+
+
+    def expire(self, now=None):
+        """drop requests whose deadline passed, return them"""
+        expired = []
+        for key in self._timers.advance(now):
+            req = self._requests.pop(key)
+            req.client._pending.discard(key)
+            req.business._pending.discard(key)
+            expired.append(req)
+        return expired
+
+
+    def _release(self, req):
+        self._timers.cancel(req.key, req.deadline)
+        req.client._pending.discard(req.key)
+        req.business._pending.discard(req.key)
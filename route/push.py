@@ -0,0 +1,92 @@
+#coding=utf-8
+
+"""push: business modules send one frame, route delivers it to many clients
+
+command, sent by Business.push as a route frame with COMMAND_ID:
+    {"cmd" : "push", "target" : target, "request" : code, "body" : body}
+
+target:
+    boxes: every box connection
+    rooms: box connections of the rooms listed in "rooms"
+    apps: app connections of room "room", every app connection without it
+    device: latest connection of "device" of "device_type" (box, app ...)
+    ip: connections from source "ip"
+
+Rooms and devices are looked up in the device index of Connection.
+
+The client packet is encoded once and the same string is written to
+every target. Targets are written PUSH_CHUNK at a time, one chunk per
+ioloop iteration, so a push to thousands of boxes does not hold up the
+requests in between.
+"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+__all__ = ['push', 'get_targets', 'fan_out']
+
+import logging
+from tornado.ioloop import IOLoop
+
+from metrics import registry, Counter
+from framing import CLIENT_HEADER
+from connection import Connection, DEVICE_TYPES
+from bconnection import BusinessConnection
+
+# connections written per ioloop iteration
+PUSH_CHUNK = 500
+
+# pushes and connections pushed to of each target
+PUSHES = registry.family('push', Counter)
+PUSHED = registry.family('pushed', Counter)
+
+logger = logging.getLogger(__name__)
+
+
+def get_targets(command):
+    """connections of the target of command"""
+    target = command['target']
+    if target == 'boxes':
+        return list(Connection.get_clients('box'))
+    if target == 'rooms':
+        conns = []
+        for room in command['rooms']:
+            conns.extend(Connection.get_devices(DEVICE_TYPES['box'], room))
+        return conns
+    if target == 'apps':
+        if 'room' in command:
+            return list(Connection.get_devices(DEVICE_TYPES['app'], command['room']))
+        return list(Connection.get_clients('app'))
+    if target == 'device':
+        device_type = DEVICE_TYPES.get(command['device_type'], command['device_type'])
+        conn = Connection.get_device(device_type, command['device'])
+        return [conn] if conn is not None else []
+    if target == 'ip':
+        return list(Connection.get_ip(command['ip']))
+    raise ValueError('unsupported push target %s' % target)
+
+
+def fan_out(conns, frame, offset=0):
+    """write frame to conns from offset on, the rest on next iteration"""
+    end = min(offset + PUSH_CHUNK, len(conns))
+    for i in xrange(offset, end):
+        conns[i].write_frame(frame)
+    if end < len(conns):
+        IOLoop.current().add_callback(fan_out, conns, frame, end)
+
+
+def push(business, command):
+    conns = get_targets(command)
+    body = command['body'].encode('utf-8')
+    frame = CLIENT_HEADER.pack(command.get('author', 0), command.get('version', 0),
+        command['request'], 0, len(body), 0) + body
+
+    target = command['target']
+    PUSHES[target].inc()
+    PUSHED[target].inc(len(conns))
+    logger.debug('push %d to %d %s connections from %s', command['request'],
+        len(conns), target, business._function)
+    if conns:
+        fan_out(conns, frame)
+
+
+BusinessConnection.add_command('push', push)
@@ -0,0 +1,158 @@
+#coding=utf-8
+
+"""token bucket admission of client requests, see [ratelimit] of route.ini
+
+Every client port type has buckets per device, per source ip and one
+for the whole port. A request takes a token of each bucket with a rate;
+when one is empty the request waits for its token, up to max_delay,
+or is refused.
+
+Device and ip buckets live in fixed arrays, a key is hashed to its
+slot. Keys hashing to one slot share the bucket: memory does not grow
+with the clients, a rare collision only makes the limit stricter.
+"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+__all__ = ['TokenBuckets', 'RateLimiter', 'LIMITERS', 'configure']
+
+from array import array
+
+import config
+from metrics import registry
+
+# buckets of each scope of one port
+BUCKET_SLOTS = 65536
+
+
+class LimitMetrics(object):
+    """requests over the limits of one port"""
+    __slots__ = ('shed', 'delayed', 'device', 'ip', 'port')
+
+    def __init__(self):
+        self.shed = 0 # refused
+        self.delayed = 0 # waited for their token
+        self.device = 0 # over the limit of their device
+        self.ip = 0 # over the limit of their source ip
+        self.port = 0 # over the limit of the port
+
+
+    def snapshot(self):
+        return {
+            'shed' : self.shed,
+            'delayed' : self.delayed,
+            'device' : self.device,
+            'ip' : self.ip,
+            'port' : self.port,
+        }
+
+
+LIMITS = registry.family('ratelimit', LimitMetrics)
+
+
+class TokenBuckets(object):
+    """slots buckets refilled at rate tokens per second up to burst
+
+    Tokens go below 0 when requests are admitted ahead of time, later
+    requests wait for the ones before them.
+    """
+
+    def __init__(self, slots):
+        self._slots = slots
+        self._tokens = None
+        self._stamps = None
+        self.rate = 0
+        self.burst = 0
+
+
+    def configure(self, rate, burst):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        if rate and self._tokens is None:
+            # allocated for limited scopes only
+            self._tokens = array('d', [self.burst]) * self._slots
+            self._stamps = array('d', [0.0]) * self._slots
+
+
+    def get_slot(self, key):
+        return hash(key) % self._slots
+
+
+    def get_wait(self, slot, now):
+        """seconds until slot has a token"""
+        tokens = self._tokens[slot] + (now - self._stamps[slot]) * self.rate
+        if tokens > self.burst:
+            tokens = self.burst
+        self._tokens[slot] = tokens
+        self._stamps[slot] = now
+        if tokens >= 1:
+            return 0
+        return (1 - tokens) / self.rate
+
+
+    def take(self, slot):
+        self._tokens[slot] -= 1
+
+
+class RateLimiter(object):
+    """limits of one client port type"""
+
+    def __init__(self, port):
+        self.port = port
+        self.metrics = LIMITS[port]
+        self._devices = TokenBuckets(BUCKET_SLOTS)
+        self._ips = TokenBuckets(BUCKET_SLOTS)
+        self._total = TokenBuckets(1)
+        self._scopes = ()
+        self.max_delay = 0
+        self.configure()
+
+
+    def configure(self):
+        get = lambda name: config.get_rate_limit(self.port, name)
+        self._devices.configure(get('device_rate'), get('device_burst'))
+        self._ips.configure(get('ip_rate'), get('ip_burst'))
+        self._total.configure(get('port_rate'), get('port_burst'))
+        self.max_delay = get('max_delay')
+        self._scopes = tuple((name, buckets) for name, buckets in (
+            ('device', self._devices), ('ip', self._ips), ('port', self._total))
+            if buckets.rate)
+
+
+    def is_limited(self):
+        return bool(self._scopes)
+
+
+    def admit(self, device, ip, now):
+        """seconds the request waits, 0 for none, None if it is refused
+
+        Tokens are taken only from admitted requests, a refused request
+        does not use up the buckets it was in time for.
+        """
+        slots = []
+        wait = 0
+        for name, buckets in self._scopes:
+            slot = buckets.get_slot(device if name == 'device' else ip)
+            scope_wait = buckets.get_wait(slot, now)
+            if scope_wait:
+                setattr(self.metrics, name, getattr(self.metrics, name) + 1)
+                wait = max(wait, scope_wait)
+            slots.append((buckets, slot))
+        if wait > self.max_delay:
+            self.metrics.shed += 1
+            return None
+        for buckets, slot in slots:
+            buckets.take(slot)
+        if wait:
+            self.metrics.delayed += 1
+        return wait
+
+
+# limiter of each client port type
+LIMITERS = dict((port, RateLimiter(port)) for port in ('box', 'app', 'erp', 'init'))
+
+
+def configure():
+    """reload limits from config"""
+    for limiter in LIMITERS.itervalues():
+        limiter.configure()
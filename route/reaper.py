@@ -0,0 +1,108 @@
+#coding=utf-8
+
+"""closing of idle connections, see [heartbeat] of route.ini
+
+A powered off box or a dropped NAT mapping leaves a half open
+connection route never hears a close of. Connections without a packet
+for the idle_timeout of their port are closed instead, clients keep
+quiet connections open with heartbeats.
+
+Connections sit in a timer wheel of one second ticks at the time they
+may be idle for too long. Reading data, part of a packet too, only
+stamps the reader of the connection (conn.get_active()). One periodic
+sweep takes the connections whose tick came, closes the ones still
+idle and puts the others back at their new time: no timer per
+connection, no wheel work per read.
+
+A sweep running late means the ioloop was blocked, the packets of the
+connections may wait unread in their sockets: nobody is closed then,
+they are looked at again on the next tick.
+"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+__all__ = ['IdleReaper', 'REAPER', 'REAP_TICK']
+
+import time
+import logging
+
+from timerwheel import TimerWheel
+from metrics import registry, Counter
+
+# seconds per tick of the reaper, idle connections close up to one late
+REAP_TICK = 1.0
+
+# slots of the wheel of the reaper
+REAP_SLOTS = 64
+
+# seconds before a connection of a port never closing idle ones is looked
+# at again, in case a reload sets its idle_timeout
+RECHECK = 60
+
+logger = logging.getLogger(__name__)
+
+# idle connections closed, of each port type
+REAPED = registry.family('reaped', Counter)
+
+
+class IdleReaper(object):
+    """closes connections idle for longer than conn.get_idle_timeout()
+
+    conn has get_active(), the time it last read data, a slot _idle, its
+    handle in the wheel, a port and a _stream.
+    """
+
+    def __init__(self, tick=REAP_TICK, slots=REAP_SLOTS):
+        self._tick = tick
+        self._wheel = TimerWheel(tick, slots)
+        self._swept = None # time of the last sweep
+
+
+    def add(self, conn, now=None):
+        """track conn from now on, call it once conn is open"""
+        self.schedule(conn, now or time.time())
+
+
+    def schedule(self, conn, now):
+        timeout = conn.get_idle_timeout()
+        due = conn.get_active() + timeout if timeout else now + RECHECK
+        conn._idle = self._wheel.add(conn, due)
+
+
+    def remove(self, conn):
+        """stop tracking conn, call it once conn is closed"""
+        self._wheel.cancel(conn, conn._idle)
+
+
+    def update(self, conn):
+        """idle_timeout of conn changed, eg. it asked for heartbeats"""
+        self.remove(conn)
+        self.schedule(conn, time.time())
+
+
+    def sweep(self, now=None):
+        """close connections idle for too long, return how many"""
+        if now is None:
+            now = time.time()
+        late = self._swept is not None and now - self._swept > 2 * self._tick
+        self._swept = now
+        reaped = 0
+        for conn in self._wheel.advance(now):
+            if late:
+                conn._idle = self._wheel.add(conn, now)
+                continue
+            timeout = conn.get_idle_timeout()
+            idle = now - conn.get_active()
+            if timeout and idle >= timeout:
+                logger.info('close %s connection %s idle for %.0f s', conn.port,
+                    conn._addr_str, idle)
+                REAPED[conn.port].inc()
+                conn._stream.close()
+                reaped += 1
+            else:
+                self.schedule(conn, now)
+        return reaped
+
+
+# reaper of all connections of this route process
+REAPER = IdleReaper()
@@ -7,20 +7,31 @@ __author__ = "Yingqi Jin <jinyingqi@luoha.com>"
 
 import os
 import sys
-import time
 import signal
+import socket
 import logging
+import threading
 from tornado.tcpserver import TCPServer
-from tornado.ioloop import IOLoop
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.netutil import bind_sockets, bind_unix_socket
+from tornado.process import fork_processes, cpu_count
+
+# add generic dir into sys path, connections frame packets with it
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, '../generic'))
+from utility import init_log, restart_log, get_default_log, get_ip, get_unix_socket
+from framing import FrameWriter
+from logqueue import sampler
+from admin import AdminServer
 
 from connection import Connection, AppConnection, BoxConnection
 from connection import ERPConnection, InitConnection
 from bconnection import BusinessConnection
-
-# add generic dir into sys path
-ROOT = os.path.dirname(os.path.abspath(__file__))
-sys.path.append(os.path.join(ROOT, '../generic'))
-from utility import init_log, get_default_log, get_ip 
+from config import parse_config, get_ini_file
+import routing
+import push # registers the push command of business modules
+from timerwheel import TICK
+from reaper import REAPER, REAP_TICK
 
 # listen port
 BOX_PORT = 58849
@@ -28,28 +39,37 @@ ERP_PORT = 25377
 APP_PORT = 3050
 INIT_PORT = 11235
 BUSINESS_PORT = 6666
+ADMIN_PORT = 7666 # metrics and commands, one per process: ADMIN_PORT + worker
 
+# client ports are shared by all processes
 LISTEN_PORT = {
     BOX_PORT : 'box',
     ERP_PORT : 'erp',
     APP_PORT : 'app',
     INIT_PORT : 'init',
-    BUSINESS_PORT : 'business',
 }
 
 # handle_stream will be called once new connection is created
 class KTVServer(TCPServer):
-    def handle_stream(self, stream, address):
-        ip, port = stream.socket.getsockname()
-        port_conn_map = {
+    def __init__(self, business_port=BUSINESS_PORT):
+        TCPServer.__init__(self)
+        self._port_conn_map = {
             BOX_PORT : BoxConnection,
             APP_PORT : AppConnection,
             ERP_PORT : ERPConnection,
             INIT_PORT : InitConnection,
-            BUSINESS_PORT : BusinessConnection,
+            business_port : BusinessConnection,
         }
+
+
+    def handle_stream(self, stream, address):
+        if stream.socket.family == socket.AF_UNIX:
+            # only business modules on this host connect to the unix socket
+            BusinessConnection(stream, (stream.socket.getsockname(), 0))
+            return
+        ip, port = stream.socket.getsockname()
         # instance new connection based on port type
-        port_conn_map[port](stream, address)
+        self._port_conn_map[port](stream, address)
 
 
 def sig_handler(sig, frame):
@@ -58,16 +78,63 @@ def sig_handler(sig, frame):
     logging.info('stop server ...')
 
 
+def check_parent(parent):
+    """stop a worker whose parent process is gone"""
+    if os.getppid() != parent:
+        logging.info('parent process %d exited' % parent)
+        sig_handler(None, None)
+
+
+def reload_handler(sig, frame):
+    IOLoop.current().add_callback_from_signal(reload_config)
+
+
+def reload_config():
+    """parse route.ini in a thread, swap routes in on the ioloop"""
+    io_loop = IOLoop.current()
+
+    def parse():
+        try:
+            maps = parse_config(get_ini_file())
+        except ValueError, e:
+            logging.error('reload config failed: %s' % e)
+            return
+        io_loop.add_callback(install, maps)
+
+    def install(maps):
+        try:
+            routing.reload_routes(maps)
+        except ValueError, e:
+            logging.error('reload config failed: %s' % e)
+
+    threading.Thread(target=parse, name='reload').start()
+    return 'reloading %s' % get_ini_file()
+
+
 def register_options():
     from optparse import OptionParser
     parser = OptionParser()
     parser.add_option("-i", "--host", dest="host",
         default=get_ip(), help="specify host, default is local ip")
+    parser.add_option("-A", "--admin-host", dest="admin_host",
+        default='127.0.0.1', help="specify host of the admin port, it has no auth, default is 127.0.0.1")
+    parser.add_option("-c", "--config", dest="config",
+        default=get_ini_file(), help="specify config file, default is route.ini")
     parser.add_option("-l", "--log", dest="log",
         default=get_default_log(), help="specify log name")
     parser.add_option("-n", "--num", dest="num",
         type=int,
-        default=1, help="specify process num")
+        default=1, help="specify process num, 0 for one per cpu")
+    parser.add_option("-f", "--flush-delay", dest="flush_delay",
+        type=float,
+        default=0, help="specify max ms a write is delayed for batching, default is end of ioloop iteration")
+    parser.add_option("-L", "--log-level", dest="levels",
+        default='', help="specify log level of modules, eg. connection=debug,bconnection=info")
+    parser.add_option("-t", "--trace", dest="rates",
+        default='', help="specify traced fraction of packets per request, eg. 10001=0.01,default=1")
+    parser.add_option("-U", "--no-unix", dest="unix",
+        action='store_false',
+        default=True, help="do not listen on a unix socket for local business modules")
     parser.add_option("-d", "--debug", dest="debug",
         action='store_true',
         default=False, help="enable debug")
@@ -80,20 +147,71 @@ if __name__ == '__main__':
     
     opts = register_options()
 
-    init_log(opts.log, opts.debug)
-
-    signal.signal(signal.SIGTERM, sig_handler)
-    signal.signal(signal.SIGINT, sig_handler)
+    init_log(opts.log, opts.debug, opts.levels, opts.rates)
+    sampler.known = routing.is_routed
+    FrameWriter.max_delay = opts.flush_delay / 1000.0
 
     logging.info('start server ...')
     logging.info('log file %s ...' % opts.log)
 
-    server = KTVServer()
+    if opts.config != get_ini_file():
+        try:
+            routing.reload_routes(parse_config(opts.config), opts.config)
+        except ValueError, e:
+            sys.exit('invalid config %s: %s' % (opts.config, e))
+        logging.info('config file %s ...' % opts.config)
 
+    sockets = []
     for port, pstr in LISTEN_PORT.iteritems():
-        server.bind(port, opts.host)
+        sockets.extend(bind_sockets(port, opts.host))
         logging.info('listen %s port %d for %s ...' % (opts.host, port, pstr))
 
-    server.start(opts.num)
+    # every process owns its business port: BUSINESS_PORT + worker id.
+    # business modules register on BUSINESS_PORT and are told to connect
+    # to the other ones, so each process can forward to every business.
+    num = opts.num if opts.num > 0 else cpu_count()
+    worker = 0
+    if num > 1:
+        # the parent only waits for its workers: SIGTERM/SIGINT end it at
+        # once and the workers stop when they see it gone
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        parent = os.getpid()
+        worker = fork_processes(num)
+        # the log thread does not survive fork
+        restart_log()
+        PeriodicCallback(lambda: check_parent(parent), 1000).start()
+    BusinessConnection.set_worker(worker, num)
+
+    signal.signal(signal.SIGTERM, sig_handler)
+    signal.signal(signal.SIGINT, sig_handler)
+    # re-read route.ini, send it to every route process
+    signal.signal(signal.SIGHUP, reload_handler)
+
+    business_port = BUSINESS_PORT + worker
+    sockets.extend(bind_sockets(business_port, opts.host))
+    logging.info('worker %d listen %s port %d for business ...' % (
+        worker, opts.host, business_port))
+    if opts.unix:
+        # business modules on this host skip the tcp stack
+        unix_socket = get_unix_socket(business_port)
+        sockets.append(bind_unix_socket(unix_socket, 0666))
+        logging.info('worker %d listen %s for business ...' % (worker, unix_socket))
+
+    server = KTVServer(business_port)
+    server.add_sockets(sockets)
+
+    admin_port = ADMIN_PORT + worker
+    admin = AdminServer()
+    admin.add_command('reload', reload_config)
+    admin.add_command('routes', lambda: dict((function, len(pool))
+        for function, pool in routing.POOLS.iteritems()))
+    admin.listen(admin_port, opts.admin_host)
+    logging.info('worker %d listen %s port %d for admin ...' % (
+        worker, opts.admin_host, admin_port))
+
+    # time out requests whose reply never comes, once per wheel tick
+    PeriodicCallback(BusinessConnection.expire_pending, TICK * 1000).start()
+    # close connections idle for longer than [heartbeat] idle_timeout
+    PeriodicCallback(REAPER.sweep, REAP_TICK * 1000).start()
 
     IOLoop.current().start()
@@ -0,0 +1,97 @@
+#coding=utf-8
+
+"""routing table compiled from route.ini: request code -> business pool
+
+ROUTES maps every request code straight to the balancer of the business
+serving it, so forwarding a packet is one dict lookup and no lock: all
+connections live on the single threaded ioloop. Pools exist for every
+server of route.ini from the start and are filled and drained as
+business connections register and disconnect.
+"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+__all__ = ['ROUTES', 'get_pool', 'compile_routes', 'register', 'unregister',
+    'reload_routes', 'is_routed']
+
+import logging
+
+import config
+from balancer import BALANCERS, create_balancer
+from cache import CACHE
+import ratelimit
+
+
+POOLS = {} # function : balancer, kept across recompiles
+
+ROUTES = {} # request : balancer
+
+
+def get_pool(function):
+    pool = POOLS.get(function)
+    if pool is None:
+        pool = create_balancer(config.get_balancer(function))
+        POOLS[function] = pool
+    return pool
+
+
+def compile_routes():
+    """build request -> pool table from current config"""
+    routes = {}
+    for request, server in config.get_routes().iteritems():
+        routes[request] = get_pool(server)
+    return routes
+
+
+def register(conn):
+    get_pool(conn._function).add(conn)
+
+
+def unregister(conn):
+    pool = POOLS.get(conn._function)
+    if pool is not None and conn in pool:
+        pool.remove(conn)
+
+
+def reload_routes(maps, ini_file=None):
+    """install maps parsed by config.parse_config and swap ROUTES
+
+    Requests already forwarded keep their business connection, replies
+    are matched by request id and never look at ROUTES.
+    """
+    global ROUTES
+    for function, name in maps['server_balancer_map'].iteritems():
+        if name not in BALANCERS:
+            raise ValueError('unsupported balancer %s for %s' % (name, function))
+
+    config.reload_config(maps, ini_file)
+
+    # connections move to a new pool if their balancer changed
+    for function, pool in POOLS.items():
+        cls = BALANCERS[config.get_balancer(function)]
+        if type(pool) is not cls:
+            new_pool = cls()
+            for conn in pool:
+                new_pool.add(conn)
+            new_pool.waiting = pool.waiting
+            POOLS[function] = new_pool
+        for conn in POOLS[function]:
+            conn.load_limits()
+
+    ROUTES = compile_routes()
+    CACHE.configure(config.get_cache_ttls(), config.get_cache_max_bytes())
+    ratelimit.configure()
+    logging.info('reload %d routes of %d servers' % (len(ROUTES),
+        len(set(maps['request_server_map'].itervalues()))))
+
+
+def is_routed(request):
+    """whether request is a code of route.ini"""
+    return request in ROUTES
+
+
+def get_servers():
+    return [function for function, pool in POOLS.iteritems() if len(pool)]
+
+
+ROUTES = compile_routes()
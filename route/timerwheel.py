@@ -0,0 +1,67 @@
+#coding=utf-8
+
+"""hashed timer wheel: many deadlines, one periodic callback"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import math
+import time
+
+# seconds per tick, deadlines are rounded up to it
+TICK = 0.1
+
+# slots of the wheel, one turn covers TICK * SLOTS seconds
+SLOTS = 512
+
+
+class TimerWheel(object):
+    """deadlines of keys, hashed into slots by their tick
+
+    add and cancel are O(1). advance() is called every tick and only
+    looks at the slots the wheel passed; deadlines further than one
+    turn away stay in their slot until their tick comes.
+    """
+
+    def __init__(self, tick=TICK, slots=SLOTS, now=None):
+        if now is None:
+            now = time.time()
+        self._tick = tick
+        self._slots = [{} for i in xrange(slots)]
+        self._current = int(now / tick) # last tick advanced to
+
+
+    def add(self, key, deadline):
+        """schedule key at deadline, return the handle to cancel it"""
+        tick = max(int(math.ceil(deadline / self._tick)), self._current + 1)
+        self._slots[tick % len(self._slots)][key] = tick
+        return tick
+
+
+    def cancel(self, key, tick):
+        self._slots[tick % len(self._slots)].pop(key, None)
+
+
+    def advance(self, now=None):
+        """move to now, return keys whose deadline passed"""
+        if now is None:
+            now = time.time()
+        target = int(now / self._tick)
+        slots = self._slots
+        expired = []
+
+        if target - self._current >= len(slots):
+            # ioloop was blocked for more than one turn: visit every slot once
+            ticks = xrange(target - len(slots) + 1, target + 1)
+        else:
+            ticks = xrange(self._current + 1, target + 1)
+
+        for tick in ticks:
+            slot = slots[tick % len(slots)]
+            if slot:
+                due = [key for key, t in slot.iteritems() if t <= target]
+                for key in due:
+                    del slot[key]
+                expired.extend(due)
+
+        self._current = max(self._current, target)
+        return expired
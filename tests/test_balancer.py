@@ -0,0 +1,137 @@
+#!/usr/bin/env python2.7
+#coding=utf-8
+
+"""tests of route/balancer.py"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import os
+import sys
+import random
+import logging
+import unittest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, '../route'))
+from balancer import (RoundRobinBalancer, LeastOutstandingBalancer,
+    PowerOfTwoBalancer, create_balancer)
+
+
+class FakeBusiness(object):
+    def __init__(self, inflight=0, latency=0.01):
+        self.inflight = inflight
+        self.latency = latency
+        self.saturated = False
+
+    def get_inflight(self):
+        return self.inflight
+
+    def get_latency(self):
+        return self.latency
+
+    def is_saturated(self):
+        return self.saturated
+
+
+def create_pool(cls, conns):
+    pool = cls()
+    for conn in conns:
+        pool.add(conn)
+    return pool
+
+
+class BalancerTest(unittest.TestCase):
+
+    def test_empty_pool(self):
+        for cls in (RoundRobinBalancer, LeastOutstandingBalancer, PowerOfTwoBalancer):
+            self.assertEqual(cls().select(), None)
+
+
+    def test_single_connection(self):
+        conn = FakeBusiness(10)
+        for cls in (RoundRobinBalancer, LeastOutstandingBalancer, PowerOfTwoBalancer):
+            self.assertIs(create_pool(cls, [conn]).select(), conn)
+
+
+    def test_add_remove(self):
+        a, b = FakeBusiness(), FakeBusiness()
+        pool = create_pool(LeastOutstandingBalancer, [a, b, a])
+        self.assertEqual(len(pool), 2)
+        pool.remove(a)
+        self.assertNotIn(a, pool)
+        self.assertEqual(list(pool), [b])
+
+
+    def test_roundrobin(self):
+        conns = [FakeBusiness() for i in xrange(3)]
+        pool = create_pool(RoundRobinBalancer, conns)
+        self.assertEqual([pool.select() for i in xrange(6)], conns * 2)
+        # a removed connection does not break the turn
+        pool.remove(conns[2])
+        self.assertEqual([pool.select() for i in xrange(2)], conns[:2])
+
+
+    def test_least_inflight(self):
+        conns = [FakeBusiness(3), FakeBusiness(1), FakeBusiness(2)]
+        pool = create_pool(LeastOutstandingBalancer, conns)
+        self.assertIs(pool.select(), conns[1])
+
+
+    def test_least_latency_breaks_ties(self):
+        conns = [FakeBusiness(1, 0.5), FakeBusiness(1, 0.1), FakeBusiness(1, 0.3)]
+        pool = create_pool(LeastOutstandingBalancer, conns)
+        self.assertIs(pool.select(), conns[1])
+
+
+    def test_p2c_never_picks_the_most_loaded(self):
+        random.seed(1)
+        conns = [FakeBusiness(1), FakeBusiness(2), FakeBusiness(50)]
+        pool = create_pool(PowerOfTwoBalancer, conns)
+        picked = set(pool.select() for i in xrange(100))
+        self.assertNotIn(conns[2], picked)
+        self.assertEqual(len(picked), 2)
+
+
+    def test_create_balancer(self):
+        self.assertIsInstance(create_balancer('p2c'), PowerOfTwoBalancer)
+        self.assertIsInstance(create_balancer(), LeastOutstandingBalancer)
+        logging.disable(logging.ERROR)
+        try:
+            self.assertIsInstance(create_balancer('random'), LeastOutstandingBalancer)
+        finally:
+            logging.disable(logging.NOTSET)
+
+
+class SaturationTest(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(1)
+        # the least loaded ones are saturated
+        self.conns = [FakeBusiness(0), FakeBusiness(1), FakeBusiness(5), FakeBusiness(9)]
+        self.conns[0].saturated = self.conns[1].saturated = True
+
+
+    def test_skip_saturated(self):
+        for cls in (RoundRobinBalancer, LeastOutstandingBalancer, PowerOfTwoBalancer):
+            pool = create_pool(cls, self.conns)
+            picked = set(pool.select() for i in xrange(100))
+            self.assertFalse([conn for conn in picked if conn.saturated], cls)
+
+
+    def test_least_of_the_rest(self):
+        pool = create_pool(LeastOutstandingBalancer, self.conns)
+        self.assertIs(pool.select(), self.conns[2])
+        self.assertIs(pool.select_least(), self.conns[2])
+
+
+    def test_all_saturated(self):
+        for conn in self.conns:
+            conn.saturated = True
+        for cls in (RoundRobinBalancer, LeastOutstandingBalancer, PowerOfTwoBalancer):
+            pool = create_pool(cls, self.conns)
+            self.assertIn(pool.select(), self.conns)
+            self.assertEqual(pool.select_least(), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
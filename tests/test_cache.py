@@ -0,0 +1,130 @@
+#!/usr/bin/env python2.7
+#coding=utf-8
+
+"""tests of route/cache.py"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import os
+import sys
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, '../generic'))
+sys.path.append(os.path.join(ROOT, '../route'))
+from cache import ResponseCache, ENTRY_OVERHEAD, get_key
+
+REPLY = '{"status" : 0, "venue" : 520}'
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        # room for three replies
+        self.cache = ResponseCache({10001 : 60, 10005 : 60},
+            3 * (len(REPLY) + ENTRY_OVERHEAD))
+
+
+    def test_put_get(self):
+        key = get_key(10001, 'a')
+        self.assertEqual(self.cache.get(key), None)
+        self.cache.put(key, REPLY)
+        self.assertEqual(self.cache.get(key), REPLY)
+        self.assertEqual(self.cache.get(get_key(10001, 'b')), None)
+        self.assertEqual(self.cache.get_size(), len(REPLY) + ENTRY_OVERHEAD)
+
+
+    def test_not_cached_request(self):
+        key = get_key(10002, 'a')
+        self.cache.put(key, REPLY)
+        self.assertEqual(len(self.cache), 0)
+
+
+    def test_expire(self):
+        self.cache.ttls[10001] = 0.01
+        key = get_key(10001, 'a')
+        self.cache.put(key, REPLY)
+        time.sleep(0.02)
+        self.assertEqual(self.cache.get(key), None)
+        self.assertEqual(self.cache.get_size(), 0)
+
+
+    def test_lru_eviction(self):
+        keys = [get_key(10001, str(i)) for i in xrange(4)]
+        for key in keys[:3]:
+            self.cache.put(key, REPLY)
+        # the first one is used again, the second is the least recently used
+        self.cache.get(keys[0])
+        self.cache.put(keys[3], REPLY)
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.get(keys[1]), None)
+        for key in (keys[0], keys[2], keys[3]):
+            self.assertEqual(self.cache.get(key), REPLY)
+        self.assertLessEqual(self.cache.get_size(), self.cache.max_bytes)
+
+
+    def test_reply_over_max_bytes(self):
+        key = get_key(10001, 'a')
+        self.cache.put(key, 'x' * self.cache.max_bytes)
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.get_size(), 0)
+
+
+    def test_error_reply(self):
+        key = get_key(10001, 'a')
+        self.cache.put(key, '{"status": 1, "reason": "business internal error"}')
+        self.assertEqual(self.cache.get(key), None)
+        self.cache.put(key, 'not json {')
+        self.assertEqual(self.cache.get(key), 'not json {')
+
+
+    def test_invalidate(self):
+        key, other = get_key(10001, 'a'), get_key(10005, 'a')
+        self.cache.put(key, REPLY)
+        self.cache.put(other, REPLY)
+        self.cache.invalidate([10001])
+        self.assertEqual(self.cache.get(key), None)
+        self.assertEqual(self.cache.get(other), REPLY)
+        self.cache.invalidate()
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.get_size(), 0)
+
+
+    def test_reply_forwarded_before_invalidate(self):
+        key, other = get_key(10001, 'a'), get_key(10005, 'a')
+        generation = self.cache.get_generation()
+        self.cache.invalidate([10001])
+        self.cache.put(key, REPLY, generation)
+        self.cache.put(other, REPLY, generation)
+        self.assertEqual(self.cache.get(key), None)
+        self.assertEqual(self.cache.get(other), REPLY)
+
+        generation = self.cache.get_generation()
+        self.cache.invalidate()
+        self.cache.put(other, REPLY, generation)
+        self.assertEqual(self.cache.get(other), None)
+        self.cache.put(other, REPLY, self.cache.get_generation())
+        self.assertEqual(self.cache.get(other), REPLY)
+
+
+    def test_key_excludes_header(self):
+        self.assertEqual(get_key(10001, 'a'), get_key(10001, 'a'))
+        self.assertNotEqual(get_key(10001, 'a'), get_key(10005, 'a'))
+
+
+    def test_configure(self):
+        key, other = get_key(10001, 'a'), get_key(10005, 'a')
+        self.cache.put(key, REPLY)
+        self.cache.put(other, REPLY)
+        # 10001 is no longer cached and room is left for one reply
+        self.cache.configure({10005 : 60}, len(REPLY) + ENTRY_OVERHEAD)
+        self.assertFalse(self.cache.is_cached(10001))
+        self.assertEqual(self.cache.get(key), None)
+        self.assertEqual(self.cache.get(other), REPLY)
+        self.cache.configure({10005 : 60}, 0)
+        self.assertEqual(len(self.cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python2.7
+#coding=utf-8
+
+"""tests of route/config.py and reload of route/routing.py"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, '../generic'))
+sys.path.append(os.path.join(ROOT, '../route'))
+import config
+import routing
+from config import parse_config
+from balancer import LeastOutstandingBalancer, RoundRobinBalancer
+
+INI = '''
+[server]
+control = control module
+config = config module
+
+[control]
+10001 = login
+10002 = logout
+
+[config]
+10005 = get config
+
+[timeout]
+default = 10
+config = 5
+10002 = 2
+
+[cache]
+10005 = 60
+'''
+
+
+class ParseConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
+    def parse(self, text):
+        ini_file = os.path.join(self.dir, 'route.ini')
+        with open(ini_file, 'w') as f:
+            f.write(text)
+        return parse_config(ini_file)
+
+
+    def test_routes(self):
+        maps = self.parse(INI)
+        self.assertEqual(maps['request_server_map'],
+            {10001 : 'control', 10002 : 'control', 10005 : 'config'})
+        self.assertEqual(maps['request_function_map'][10001], 'login')
+
+
+    def test_timeout_fallbacks(self):
+        timeouts = self.parse(INI)['request_timeout_map']
+        self.assertEqual((timeouts[10001], timeouts[10002], timeouts[10005]), (10, 2, 5))
+        self.assertEqual(timeouts['default'], 10)
+
+
+    def test_cache(self):
+        maps = self.parse(INI)
+        self.assertEqual(maps['request_cache_map'], {10005 : 60})
+        self.assertEqual(maps['cache_max_bytes'], config.DEFAULT_CACHE_BYTES)
+
+
+    def test_invalid(self):
+        for text in (INI + '\n[control]\nlogin = 10001\n',
+                INI.replace('10005 = get config', '10001 = get config'),
+                INI + '\n[backpressure]\nmax_flight = 10\n',
+                INI + '\n[frame]\nmax_length = -1\n',
+                INI.replace('default = 10', 'default = 0'),
+                '[control]\n10001 = login\n',
+                'not an ini file'):
+            self.assertRaises(ValueError, self.parse, text)
+        self.assertRaises(ValueError, parse_config, os.path.join(self.dir, 'none.ini'))
+
+
+class FakeBusiness(object):
+    def __init__(self, function):
+        self._function = function
+        self.limits_loaded = 0
+
+    def load_limits(self):
+        self.limits_loaded += 1
+
+
+class ReloadRoutesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ini_file = config.get_ini_file()
+        self.maps = parse_config(self.ini_file)
+        self.conn = FakeBusiness('control')
+        routing.reload_routes(self.maps)
+        routing.register(self.conn)
+        logging.disable(logging.INFO)
+
+
+    def tearDown(self):
+        routing.unregister(self.conn)
+        routing.reload_routes(self.maps, self.ini_file)
+        logging.disable(logging.NOTSET)
+
+
+    def test_swap_routes(self):
+        maps = dict(self.maps)
+        maps['request_server_map'] = {10001 : 'control', 99999 : 'control'}
+        routing.reload_routes(maps)
+        self.assertEqual(sorted(routing.ROUTES), [10001, 99999])
+        self.assertIs(routing.ROUTES[10001], routing.get_pool('control'))
+        self.assertEqual(config.get_server(99999), 'control')
+
+
+    def test_balancer_change_keeps_connections(self):
+        pool = routing.get_pool('control')
+        self.assertIsInstance(pool, LeastOutstandingBalancer)
+        pool.waiting.append('queued')
+        maps = dict(self.maps)
+        maps['server_balancer_map'] = {'control' : 'roundrobin'}
+        routing.reload_routes(maps)
+        pool = routing.get_pool('control')
+        self.assertIsInstance(pool, RoundRobinBalancer)
+        self.assertEqual((list(pool), list(pool.waiting)), ([self.conn], ['queued']))
+        self.assertIs(routing.ROUTES[10001], pool)
+        self.assertEqual(self.conn.limits_loaded, 1)
+        pool.waiting.clear()
+
+
+    def test_unsupported_balancer(self):
+        maps = dict(self.maps)
+        maps['server_balancer_map'] = {'control' : 'random'}
+        maps['request_server_map'] = {}
+        self.assertRaises(ValueError, routing.reload_routes, maps)
+        # nothing was installed
+        self.assertIn(10001, routing.ROUTES)
+        self.assertEqual(config.get_server(10001), 'control')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python2.7
+#coding=utf-8
+
+"""tests of the device and ip index of route/connection.py"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import os
+import sys
+import logging
+import unittest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, '../generic'))
+sys.path.append(os.path.join(ROOT, '../route'))
+from tornado.ioloop import IOLoop
+
+from connection import Connection, BoxConnection, AppConnection, DEVICE_TYPES
+
+BOX = DEVICE_TYPES['box']
+
+
+class FakeStream(object):
+    def __init__(self):
+        self._closed = False
+        self._close_callback = None
+
+    def set_close_callback(self, callback):
+        self._close_callback = callback
+
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._close_callback()
+
+    def read_bytes(self, num_bytes, callback, partial=False):
+        pass
+
+    def write(self, data, callback=None):
+        pass
+
+
+def connect(cls, ip='10.0.0.1', device=None):
+    conn = cls(FakeStream(), (ip, 40000))
+    if device is not None:
+        conn.set_header((17, 100, 10001, 1, 0, device))
+    return conn
+
+
+class DeviceIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.io_loop = IOLoop()
+        self.io_loop.make_current()
+        logging.disable(logging.INFO)
+
+
+    def tearDown(self):
+        Connection.clean_connection()
+        logging.disable(logging.NOTSET)
+        IOLoop.clear_current()
+        self.io_loop.close()
+
+
+    def test_index_by_first_packet(self):
+        conn = connect(BoxConnection)
+        self.assertEqual(Connection.get_device(BOX, 520), None)
+        conn.set_header((17, 100, 10001, 1, 0, 520))
+        self.assertIs(Connection.get_device(BOX, 520), conn)
+        # the same device type of another port is another device
+        self.assertEqual(Connection.get_device(DEVICE_TYPES['app'], 520), None)
+
+
+    def test_latest_connection_wins(self):
+        old = connect(BoxConnection, device=520)
+        new = connect(BoxConnection, device=520)
+        self.assertIs(Connection.get_device(BOX, 520), new)
+        self.assertEqual(list(Connection.get_devices(BOX, 520)), [old, new])
+        new._stream.close()
+        self.assertIs(Connection.get_device(BOX, 520), old)
+        old._stream.close()
+        self.assertNotIn((BOX, 520), Connection.devices)
+
+
+    def test_new_device(self):
+        conn = connect(BoxConnection, device=520)
+        conn.set_header((17, 100, 10001, 1, 0, 521))
+        self.assertEqual(Connection.get_device(BOX, 520), None)
+        self.assertIs(Connection.get_device(BOX, 521), conn)
+
+
+    def test_ip(self):
+        box = connect(BoxConnection, '10.0.0.1')
+        app = connect(AppConnection, '10.0.0.1')
+        other = connect(AppConnection, '10.0.0.2')
+        self.assertEqual(set(Connection.get_ip('10.0.0.1')), set([box, app]))
+        self.assertEqual(set(Connection.get_ip('10.0.0.2')), set([other]))
+        box._stream.close()
+        app._stream.close()
+        self.assertEqual(Connection.get_ip('10.0.0.1'), ())
+        self.assertNotIn('10.0.0.1', Connection.ips)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python2.7
+#coding=utf-8
+
+"""tests of generic/framing.py"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import os
+import sys
+import logging
+import unittest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, '../generic'))
+from tornado.ioloop import IOLoop
+
+import framing
+from framing import FrameReader, FrameWriter, CLIENT_HEADER, CLIENT_LENGTH_INDEX
+
+
+def get_frame(request, body):
+    return CLIENT_HEADER.pack(17, 100, request, 1, len(body), 520) + body
+
+
+class FakeStream(object):
+    """hands the data fed to it to the pending read_bytes callback"""
+
+    def __init__(self):
+        self._closed = False
+        self._callback = None
+        self.reads = 0
+        self.writes = []
+
+
+    def closed(self):
+        return self._closed
+
+
+    def close(self):
+        self._closed = True
+
+
+    def read_bytes(self, num_bytes, callback, partial=False):
+        self._callback = callback
+        self.reads += 1
+
+
+    def feed(self, data):
+        callback, self._callback = self._callback, None
+        callback(data)
+
+
+    def write(self, data, callback=None):
+        self.writes.append(data)
+
+
+class FrameReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = FakeStream()
+        self.frames = []
+        self.reader = FrameReader(self.stream, CLIENT_HEADER, CLIENT_LENGTH_INDEX,
+            self.on_frame)
+        self.reader.start()
+
+
+    def on_frame(self, parts, frame):
+        self.frames.append((parts[2], frame))
+
+
+    def test_frames_in_one_read(self):
+        first, second = get_frame(10001, 'abc'), get_frame(10002, '')
+        self.stream.feed(first + second)
+        self.assertEqual(self.frames, [(10001, first), (10002, second)])
+        # and reads again
+        self.assertEqual(self.stream.reads, 2)
+
+
+    def test_partial_header_and_body(self):
+        frame = get_frame(10001, 'x' * 100)
+        self.stream.feed(frame[:10])
+        self.assertEqual(self.frames, [])
+        self.stream.feed(frame[10:50])
+        self.assertEqual(self.frames, [])
+        # the rest with the start of the next one
+        self.stream.feed(frame[50:] + frame[:5])
+        self.assertEqual(self.frames, [(10001, frame)])
+        self.stream.feed(frame[5:])
+        self.assertEqual(self.frames, [(10001, frame)] * 2)
+
+
+    def test_byte_by_byte(self):
+        frame = get_frame(10001, 'body')
+        for c in frame:
+            self.stream.feed(c)
+        self.assertEqual(self.frames, [(10001, frame)])
+
+
+    def test_pause(self):
+        first, second = get_frame(10001, 'a'), get_frame(10002, 'b')
+        self.reader._callback = lambda parts, frame: (self.on_frame(parts, frame),
+            self.reader.pause())
+        self.stream.feed(first + second)
+        self.assertEqual(self.frames, [(10001, first)])
+        self.assertTrue(self.reader.is_paused())
+        # a paused reader does not ask for more
+        self.assertEqual(self.stream._callback, None)
+
+
+class FrameReaderLimitsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = FakeStream()
+        self.frames = []
+        self.heads = []
+        self.chunks = []
+        self.reader = FrameReader(self.stream, CLIENT_HEADER, CLIENT_LENGTH_INDEX,
+            lambda parts, frame: self.frames.append(frame))
+        self.reader.set_limits(max_length=1000, stream_length=100,
+            on_stream=self.on_stream)
+        self.reader.start()
+
+
+    def on_stream(self, parts, head):
+        self.heads.append(head)
+        return self.chunks.append
+
+
+    def test_over_max_length_closes(self):
+        logging.disable(logging.WARNING)
+        try:
+            self.stream.feed(get_frame(10001, 'x' * 1001)[:100])
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertTrue(self.stream.closed())
+        self.assertEqual((self.frames, self.heads), ([], []))
+
+
+    def test_stream_body(self):
+        frame = get_frame(10001, 'x' * 500)
+        after = get_frame(10002, 'small')
+        self.stream.feed(frame[:300])
+        self.assertEqual(self.heads, [frame[:CLIENT_HEADER.size]])
+        self.assertEqual(self.chunks, ['x' * (300 - CLIENT_HEADER.size)])
+        self.stream.feed(frame[300:] + after)
+        self.assertEqual(''.join(self.chunks[:-1]), 'x' * 500)
+        # None ends the body, the next frame is buffered again
+        self.assertEqual(self.chunks[-1], None)
+        self.assertEqual(self.frames, [after])
+
+
+    def test_skip_streamed_body(self):
+        self.reader.set_limits(max_length=1000, stream_length=100,
+            on_stream=lambda parts, head: None)
+        after = get_frame(10002, 'small')
+        self.stream.feed(get_frame(10001, 'x' * 500) + after)
+        self.assertEqual(self.frames, [after])
+        self.assertFalse(self.stream.closed())
+
+
+    def test_at_stream_length_buffered(self):
+        frame = get_frame(10001, 'x' * 100)
+        self.stream.feed(frame)
+        self.assertEqual((self.frames, self.heads), ([frame], []))
+
+
+class FrameWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.io_loop = IOLoop()
+        self.io_loop.make_current()
+        self.stream = FakeStream()
+        self.writer = FrameWriter(self.stream)
+
+
+    def tearDown(self):
+        IOLoop.clear_current()
+        self.io_loop.close()
+
+
+    def run_iteration(self):
+        self.io_loop.add_callback(self.io_loop.stop)
+        self.io_loop.start()
+
+
+    def test_coalesce_one_iteration(self):
+        self.writer.write('head1', 'body1')
+        self.writer.write('head2', 'body2')
+        self.assertEqual(self.stream.writes, [])
+        self.assertEqual(self.writer.get_buffered_size(), 20)
+        self.run_iteration()
+        self.assertEqual(self.stream.writes, ['head1body1head2body2'])
+        self.assertEqual(self.writer.get_buffered_size(), 0)
+        self.writer.write('head3')
+        self.run_iteration()
+        self.assertEqual(self.stream.writes[1:], ['head3'])
+
+
+    def test_flush_size(self):
+        self.writer.write('x' * (framing.FLUSH_SIZE - 1))
+        self.assertEqual(self.stream.writes, [])
+        self.writer.write('y')
+        self.assertEqual(len(self.stream.writes), 1)
+        # the scheduled flush finds nothing left
+        self.run_iteration()
+        self.assertEqual(len(self.stream.writes), 1)
+
+
+    def test_closed_stream(self):
+        self.writer.write('head')
+        self.stream.close()
+        self.writer.write('lost')
+        self.run_iteration()
+        self.assertEqual(self.stream.writes, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python2.7
+#coding=utf-8
+
+"""tests of generic/metrics.py"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import os
+import sys
+import random
+import unittest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, '../generic'))
+from metrics import Histogram, Registry, bucket_index, bucket_value, MAX_BITS
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_buckets(self):
+        for value in (0, 1, 63, 64, 65, 1000, 123456, (1 << MAX_BITS) - 1):
+            low = bucket_value(bucket_index(value))
+            self.assertLessEqual(low, value)
+            self.assertLess(value - low, max(value * 0.04, 1))
+        # exact below 2 * SUB_COUNT
+        self.assertEqual([bucket_index(i) for i in xrange(64)], range(64))
+
+
+    def test_percentiles(self):
+        random.seed(1)
+        values = [random.uniform(0.001, 1) for i in xrange(10000)]
+        histogram = Histogram()
+        for value in values:
+            histogram.record(value)
+        values.sort()
+        for p in (50, 90, 99, 99.9):
+            expected = values[int(p / 100.0 * len(values)) - 1]
+            self.assertAlmostEqual(histogram.percentile(p), expected,
+                delta=expected * 0.04)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 10000)
+        self.assertAlmostEqual(snapshot['max'], values[-1], delta=1e-6)
+        self.assertAlmostEqual(snapshot['mean'], sum(values) / len(values), delta=1e-5)
+
+
+    def test_empty_and_clamped(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.snapshot(), {'count' : 0})
+        self.assertEqual(histogram.percentile(99), 0)
+        histogram.record(-1)
+        histogram.record(1e9)
+        self.assertEqual(histogram.percentile(10), 0)
+        self.assertEqual(histogram.max, (1 << MAX_BITS) - 1)
+
+
+    def test_unit(self):
+        histogram = Histogram(unit=1)
+        for value in xrange(1, 101):
+            histogram.record(value)
+        self.assertEqual(histogram.percentile(50), 50)
+        self.assertEqual(histogram.percentile(100), 100)
+
+
+class RegistryTest(unittest.TestCase):
+
+    def test_snapshot(self):
+        registry = Registry()
+        registry.counter('packets').inc(2)
+        registry.family('requests')['10001'].inc()
+        self.assertIs(registry.counter('packets'), registry.counter('packets'))
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['packets'], 2)
+        self.assertEqual(snapshot['requests'], {'10001' : 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python2.7
+#coding=utf-8
+
+"""tests of route/pending.py"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import os
+import sys
+import time
+import logging
+import unittest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, '../route'))
+from pending import PendingTable, NO_PENDING
+
+HEADER = (17, 100, 10001, 1, 520)
+
+
+class FakeConnection(object):
+    def __init__(self, pending=NO_PENDING):
+        self._pending = pending
+        self._addr_str = '127.0.0.1:1'
+
+
+class PendingTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = PendingTable(capacity=3, per_connection=2)
+        self.client = FakeConnection()
+        self.business = FakeConnection(set())
+
+
+    def add(self, key, client=None, timeout=30):
+        return self.table.add(key, client or self.client, self.business,
+            HEADER, timeout)
+
+
+    def test_add_pop(self):
+        req, evicted = self.add('a')
+        self.assertEqual(evicted, None)
+        self.assertEqual((req.key, req.client, req.header), ('a', self.client, HEADER))
+        self.assertEqual(self.client._pending, set(['a']))
+        self.assertIs(self.table.pop('a'), req)
+        self.assertEqual(self.table.pop('a'), None)
+        self.assertEqual(len(self.table), 0)
+        self.assertEqual(self.client._pending, set())
+        self.assertEqual(self.business._pending, set())
+
+
+    def test_per_connection_limit(self):
+        logging.disable(logging.WARNING)
+        try:
+            self.add('a')
+            self.add('b')
+            self.assertEqual(self.add('c'), (None, None))
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertNotIn('c', self.table)
+
+
+    def test_expire(self):
+        req, evicted = self.add('a', timeout=5)
+        self.add('b', timeout=60)
+        now = time.time()
+        self.assertEqual(self.table.expire(now), [])
+        self.assertEqual(self.table.expire(now + 6), [req])
+        self.assertNotIn('a', self.table)
+        self.assertIn('b', self.table)
+        self.assertEqual(self.client._pending, set(['b']))
+        self.assertEqual(self.business._pending, set(['b']))
+
+
+    def test_discard(self):
+        other = FakeConnection()
+        self.add('a')
+        self.add('b', other)
+        self.assertEqual([req.key for req in self.table.discard(self.client)], ['a'])
+        self.assertEqual(self.table.discard(self.client), [])
+        self.assertEqual(self.business._pending, set(['b']))
+        # a discarded request never expires
+        self.assertEqual([req.key for req in self.table.expire(time.time() + 60)], ['b'])
+
+
+    def test_evict_oldest(self):
+        other = FakeConnection()
+        first = self.add('a')[0]
+        self.add('b')
+        self.add('c', other)
+        req, evicted = self.add('d', other)
+        self.assertIs(evicted, first)
+        self.assertEqual(req.key, 'd')
+        self.assertEqual(len(self.table), 3)
+        self.assertNotIn('a', self.table)
+        self.assertEqual(self.client._pending, set(['b']))
+        self.assertEqual(sorted(req.key for req in self.table.expire(time.time() + 60)),
+            ['b', 'c', 'd'])
+
+
+if __name__ == '__main__':
+    unittest.main()
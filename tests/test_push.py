@@ -0,0 +1,142 @@
+#!/usr/bin/env python2.7
+#coding=utf-8
+
+"""tests of route/push.py"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import os
+import sys
+import json
+import logging
+import unittest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, '../generic'))
+sys.path.append(os.path.join(ROOT, '../route'))
+from tornado.ioloop import IOLoop
+
+import push
+from push import get_targets, fan_out
+from framing import CLIENT_HEADER
+from bconnection import BusinessConnection
+from connection import Connection, BoxConnection, AppConnection
+
+
+class FakeStream(object):
+    def __init__(self):
+        self._closed = False
+        self._close_callback = None
+        self.writes = []
+
+    def set_close_callback(self, callback):
+        self._close_callback = callback
+
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._close_callback()
+
+    def read_bytes(self, num_bytes, callback, partial=False):
+        pass
+
+    def write(self, data, callback=None):
+        self.writes.append(data)
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.frames = []
+
+    def write_frame(self, frame):
+        self.frames.append(frame)
+
+
+def connect(cls, device, ip='10.0.0.1'):
+    conn = cls(FakeStream(), (ip, 40000))
+    conn.set_header((17, 100, 10001, 1, 0, device))
+    return conn
+
+
+def get_business():
+    business = BusinessConnection.__new__(BusinessConnection)
+    business._function = 'control'
+    business._addr_str = '127.0.0.1:1'
+    return business
+
+
+class PushTest(unittest.TestCase):
+
+    def setUp(self):
+        self.io_loop = IOLoop()
+        self.io_loop.make_current()
+        logging.disable(logging.WARNING)
+        # two boxes of rooms 520 and 521, apps of room 520 and 522
+        self.boxes = [connect(BoxConnection, 520), connect(BoxConnection, 521, '10.0.0.2')]
+        self.apps = [connect(AppConnection, 520), connect(AppConnection, 522)]
+
+
+    def tearDown(self):
+        Connection.clean_connection()
+        logging.disable(logging.NOTSET)
+        IOLoop.clear_current()
+        self.io_loop.close()
+
+
+    def run_iteration(self):
+        self.io_loop.add_callback(self.io_loop.stop)
+        self.io_loop.start()
+
+
+    def test_targets(self):
+        self.assertEqual(set(get_targets({'target' : 'boxes'})), set(self.boxes))
+        self.assertEqual(get_targets({'target' : 'rooms', 'rooms' : [521, 523]}),
+            self.boxes[1:])
+        self.assertEqual(get_targets({'target' : 'apps', 'room' : 520}), self.apps[:1])
+        self.assertEqual(set(get_targets({'target' : 'apps'})), set(self.apps))
+        self.assertEqual(get_targets({'target' : 'device', 'device_type' : 'app',
+            'device' : 522}), self.apps[1:])
+        self.assertEqual(get_targets({'target' : 'device', 'device_type' : 2,
+            'device' : 530}), [])
+        self.assertEqual(set(get_targets({'target' : 'ip', 'ip' : '10.0.0.1'})),
+            set([self.boxes[0]] + self.apps))
+        self.assertRaises(ValueError, get_targets, {'target' : 'everybody'})
+
+
+    def test_fan_out_in_chunks(self):
+        conns = [FakeClient() for i in xrange(push.PUSH_CHUNK + 1)]
+        fan_out(conns, 'frame')
+        self.assertEqual(conns[push.PUSH_CHUNK - 1].frames, ['frame'])
+        self.assertEqual(conns[push.PUSH_CHUNK].frames, [])
+        self.run_iteration()
+        self.assertEqual(conns[push.PUSH_CHUNK].frames, ['frame'])
+        self.assertEqual(sum(len(conn.frames) for conn in conns), len(conns))
+
+
+    def test_push_one_frame(self):
+        get_business().run_command(json.dumps({'cmd' : 'push', 'target' : 'rooms',
+            'rooms' : [520], 'request' : 30001, 'body' : u'{"song" : "歌"}'}))
+        self.run_iteration()
+        body = u'{"song" : "歌"}'.encode('utf-8')
+        self.assertEqual(self.boxes[0]._stream.writes,
+            [CLIENT_HEADER.pack(0, 0, 30001, 0, len(body), 0) + body])
+        self.assertEqual(self.boxes[1]._stream.writes, [])
+
+
+    def test_invalid_push_dropped(self):
+        business = get_business()
+        for command in ({'cmd' : 'push', 'target' : 'boxes', 'request' : 1 << 32,
+                    'body' : ''},
+                {'cmd' : 'push', 'target' : 'boxes', 'request' : -1, 'body' : ''},
+                {'cmd' : 'push', 'target' : 'boxes', 'body' : ''},
+                {'cmd' : 'push', 'target' : 'nobody', 'request' : 1, 'body' : ''}):
+            business.run_command(json.dumps(command))
+        self.run_iteration()
+        self.assertEqual([conn._stream.writes for conn in self.boxes], [[], []])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python2.7
+#coding=utf-8
+
+"""tests of route/ratelimit.py"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, '../generic'))
+sys.path.append(os.path.join(ROOT, '../route'))
+import config
+from ratelimit import TokenBuckets, RateLimiter, LimitMetrics
+
+
+class TokenBucketsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.buckets = TokenBuckets(4)
+        self.buckets.configure(10, 2)
+        self.slot = self.buckets.get_slot('box 1')
+
+
+    def test_burst(self):
+        for i in xrange(2):
+            self.assertEqual(self.buckets.get_wait(self.slot, 100), 0)
+            self.buckets.take(self.slot)
+        self.assertAlmostEqual(self.buckets.get_wait(self.slot, 100), 0.1)
+
+
+    def test_waits_queue_up(self):
+        self.buckets.get_wait(self.slot, 100)
+        for i in xrange(3):
+            self.buckets.take(self.slot)
+        # the third was admitted ahead of time, the next one waits for it too
+        self.assertAlmostEqual(self.buckets.get_wait(self.slot, 100), 0.2)
+        self.assertAlmostEqual(self.buckets.get_wait(self.slot, 100.1), 0.1)
+        self.assertEqual(self.buckets.get_wait(self.slot, 100.2), 0)
+
+
+    def test_refill_up_to_burst(self):
+        self.buckets.get_wait(self.slot, 100)
+        for i in xrange(2):
+            self.buckets.take(self.slot)
+        self.assertEqual(self.buckets.get_wait(self.slot, 1000), 0)
+        for i in xrange(2):
+            self.buckets.take(self.slot)
+        self.assertGreater(self.buckets.get_wait(self.slot, 1000), 0)
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        config.reload_config({'rate_limit_map' : {'device_rate' : 1,
+            'device_burst' : 1, 'max_delay' : 0.5}})
+        self.limiter = RateLimiter('box')
+        # not the metrics of the box port shared by every test
+        self.limiter.metrics = LimitMetrics()
+
+
+    def tearDown(self):
+        config.reload_config({'rate_limit_map' : {}})
+
+
+    def test_wait_or_shed(self):
+        self.assertTrue(self.limiter.is_limited())
+        self.assertEqual(self.limiter.admit(1, '10.0.0.1', 100), 0)
+        # a second to its token, over max_delay
+        self.assertEqual(self.limiter.admit(1, '10.0.0.1', 100), None)
+        # the refused request took no token
+        self.assertAlmostEqual(self.limiter.admit(1, '10.0.0.1', 100.6), 0.4)
+        self.assertEqual(self.limiter.admit(2, '10.0.0.1', 100.6), 0)
+        self.assertEqual((self.limiter.metrics.shed, self.limiter.metrics.delayed), (1, 1))
+
+
+    def test_unlimited(self):
+        config.reload_config({'rate_limit_map' : {}})
+        self.limiter.configure()
+        self.assertFalse(self.limiter.is_limited())
+        self.assertEqual(self.limiter.admit(1, '10.0.0.1', 100), 0)
+
+
+    def test_ip_and_port_scopes(self):
+        config.reload_config({'rate_limit_map' : {'ip_rate' : 1, 'port_rate' : 2,
+            'box.port_rate' : 3}})
+        self.limiter.configure()
+        self.assertEqual(self.limiter.admit(1, '10.0.0.1', 100), 0)
+        # another device of the same ip
+        self.assertEqual(self.limiter.admit(2, '10.0.0.1', 100), None)
+        self.assertEqual(self.limiter.admit(2, '10.0.0.2', 100), 0)
+        self.assertEqual(self.limiter.admit(3, '10.0.0.3', 100), 0)
+        # box.port_rate of 3 overrides port_rate
+        self.assertEqual(self.limiter.admit(4, '10.0.0.4', 100), None)
+        metrics = self.limiter.metrics
+        self.assertEqual((metrics.device, metrics.ip, metrics.port), (0, 1, 1))
+        self.assertEqual(metrics.shed, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python2.7
+#coding=utf-8
+
+"""tests of route/reaper.py"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import os
+import sys
+import time
+import logging
+import unittest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, '../generic'))
+sys.path.append(os.path.join(ROOT, '../route'))
+import reaper
+from reaper import IdleReaper
+
+
+class FakeStream(object):
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection(object):
+    port = 'box'
+    _addr_str = '10.0.0.1:40000'
+
+    def __init__(self, active, timeout=10):
+        self.active = active
+        self.timeout = timeout
+        self._stream = FakeStream()
+        self._idle = None
+
+    def get_active(self):
+        return self.active
+
+    def get_idle_timeout(self):
+        return self.timeout
+
+
+class IdleReaperTest(unittest.TestCase):
+
+    def setUp(self):
+        self.reaper = IdleReaper(1.0, 8)
+        # the wheel starts at the current time, so do the tests
+        self.now = int(time.time()) + 1
+        logging.disable(logging.INFO)
+
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+
+    def sweep_until(self, start, end):
+        """sweep every second from start to end seconds from self.now"""
+        reaped = 0
+        for now in xrange(start, end + 1):
+            reaped += self.reaper.sweep(self.now + now)
+        return reaped
+
+
+    def test_close_idle(self):
+        conn = FakeConnection(self.now)
+        self.reaper.add(conn, self.now)
+        self.assertEqual(self.sweep_until(0, 9), 0)
+        self.assertEqual(self.reaper.sweep(self.now + 10), 1)
+        self.assertTrue(conn._stream.closed)
+
+
+    def test_activity_postpones(self):
+        conn = FakeConnection(self.now)
+        self.reaper.add(conn, self.now)
+        self.sweep_until(0, 5)
+        # a read, part of a packet too, only stamps the connection
+        conn.active = self.now + 5
+        self.assertEqual(self.sweep_until(6, 14), 0)
+        self.assertFalse(conn._stream.closed)
+        self.assertEqual(self.reaper.sweep(self.now + 15), 1)
+
+
+    def test_no_timeout(self):
+        conn = FakeConnection(self.now, 0)
+        self.reaper.add(conn, self.now)
+        self.assertEqual(self.sweep_until(0, 2 * reaper.RECHECK), 0)
+        # a reload turns it on, it is looked at again within RECHECK
+        conn.timeout = 10
+        self.assertEqual(self.sweep_until(2 * reaper.RECHECK + 1, 3 * reaper.RECHECK), 1)
+
+
+    def test_remove(self):
+        conn = FakeConnection(self.now)
+        self.reaper.add(conn, self.now)
+        self.reaper.remove(conn)
+        self.assertEqual(self.sweep_until(0, 20), 0)
+
+
+    def test_update(self):
+        conn = FakeConnection(self.now, 0)
+        self.reaper.add(conn, self.now)
+        conn.timeout = 5
+        self.reaper.update(conn)
+        self.assertEqual(self.sweep_until(0, 10), 1)
+
+
+    def test_late_sweep_closes_nobody(self):
+        conn = FakeConnection(self.now)
+        self.reaper.add(conn, self.now)
+        self.reaper.sweep(self.now)
+        # the ioloop was blocked, its data may be waiting unread
+        self.assertEqual(self.reaper.sweep(self.now + 30), 0)
+        self.assertFalse(conn._stream.closed)
+        self.assertEqual(self.reaper.sweep(self.now + 31), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python2.7
+#coding=utf-8
+
+"""tests of route/timerwheel.py"""
+
+__author__ = "Yingqi Jin <jinyingqi@luoha.com>"
+
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, '../route'))
+from timerwheel import TimerWheel
+
+
+class TimerWheelTest(unittest.TestCase):
+
+    def setUp(self):
+        # one second ticks, one turn is 8 s
+        self.wheel = TimerWheel(1.0, 8, now=100)
+
+
+    def test_expire_on_tick(self):
+        self.wheel.add('a', 102.5)
+        self.assertEqual(self.wheel.advance(102.9), [])
+        self.assertEqual(self.wheel.advance(103), ['a'])
+        self.assertEqual(self.wheel.advance(104), [])
+
+
+    def test_past_deadline_expires_next_tick(self):
+        self.wheel.add('late', 50)
+        self.assertEqual(self.wheel.advance(101), ['late'])
+
+
+    def test_cancel(self):
+        tick = self.wheel.add('a', 102)
+        self.wheel.cancel('a', tick)
+        self.wheel.cancel('a', tick)
+        self.assertEqual(self.wheel.advance(110), [])
+
+
+    def test_deadline_beyond_one_turn(self):
+        # shares its slot with ticks 104 and 112, stays there until 120
+        self.wheel.add('far', 120)
+        for now in xrange(101, 120):
+            self.assertEqual(self.wheel.advance(now), [], now)
+        self.assertEqual(self.wheel.advance(120), ['far'])
+
+
+    def test_blocked_longer_than_one_turn(self):
+        self.wheel.add('a', 103)
+        self.wheel.add('b', 110)
+        self.wheel.add('c', 130)
+        self.assertEqual(sorted(self.wheel.advance(125)), ['a', 'b'])
+        self.assertEqual(self.wheel.advance(129), [])
+        self.assertEqual(self.wheel.advance(130), ['c'])
+
+
+    def test_time_going_back(self):
+        self.wheel.add('a', 105)
+        self.assertEqual(self.wheel.advance(103), [])
+        self.assertEqual(self.wheel.advance(101), [])
+        self.assertEqual(self.wheel.advance(105), ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()